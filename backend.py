@@ -1,17 +1,148 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import time
+
+# Start of the import phase reported in /health/ready
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi import Depends, Security, status
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.security import APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
-from ultralytics import YOLO
-from YOLOv8_Explainer import yolov8_heatmap
+from contextlib import ExitStack, asynccontextmanager
+from collections import Counter
+from typing import List
+import asyncio
 import numpy as np
 from PIL import Image
 import io
 import base64
-import tempfile
+import json
+import threading
 import os
 
-app = FastAPI(title="Parasite Detection API", description="YOLO-based parasite detection system")
+import config
+from batching import MicroBatcher
+from cam import CAM_SCOPES, detect_and_explain, overlay
+from bulk import SpecimenAggregate, iter_upload_images
+from decoding import ImageTooLarge, UndecodableImage, decode_image
+from detection_store import DetectionStore
+from executor import InferenceExecutor, Overloaded
+from explainer_pool import ExplainerPool, ExplainerPoolTimeout, explain_array
+from jobs import QUEUED, SUCCEEDED, TERMINAL_STATES, JobQueue, JobQueueFull
+from detections import Detections
+from metrics import CONTENT_TYPE, COUNT_BUCKETS, Registry, RequestMetricsMiddleware
+from profiler import SamplingProfiler
+from rendering import IMAGE_FORMATS, draw_detections, encode_image
+from result_cache import ResultCache, hash_image, make_key
+from runtime import load_runtime
+from specimens import UNKNOWN_SPECIES, SpecimenStore, UnknownSpecimen
+from streaming import LatestFrame, StreamStats
+from timing import StageTimer, record
+from tracking import IoUTracker
+from uploads import UploadLimitMiddleware, UploadRejected, read_upload
+from tiling import concatenate, count_tiles, iter_tile_batches, merge_detections, nms_keep, region_window, to_global
+
+# GradCAM explainers are expensive to build, so they are pooled and reused
+explainer_pool = ExplainerPool(
+    weight=config.MODEL_WEIGHTS,
+    max_size=config.EXPLAINER_POOL_SIZE,
+    idle_ttl=config.EXPLAINER_IDLE_TTL,
+    conf_threshold=0.2,
+)
+
+# All CPU-bound stages run here so the event loop stays responsive. In process
+# mode the workers are forked by _startup() once the model is loaded and warm
+inference_executor = InferenceExecutor(
+    kind=config.INFERENCE_EXECUTOR,
+    workers=config.INFERENCE_WORKERS,
+    queue_size=config.INFERENCE_QUEUE_SIZE,
+    endpoint_limits={
+        "predict": config.PREDICT_MAX_IN_FLIGHT,
+        "generate_heatmap": config.HEATMAP_MAX_IN_FLIGHT,
+        "predict_batch": config.BULK_MAX_REQUESTS,
+        # Bulk images never hold more slots than there are workers, so interactive
+        # /predict requests can always be admitted next to a large batch
+        "predict_batch_images": config.INFERENCE_WORKERS,
+        "stream": config.STREAM_MAX_CONNECTIONS,
+    },
+    threads_per_worker=config.WORKER_THREADS,
+    task_timeout=config.WORKER_TASK_TIMEOUT,
+)
+
+# Responses and uploads keyed on image content, so repeated images skip inference
+result_cache = ResultCache(
+    max_bytes=config.CACHE_MAX_BYTES,
+    disk_dir=config.CACHE_DISK_DIR,
+    disk_max_bytes=config.CACHE_DISK_MAX_BYTES,
+    memory_only_kinds=() if config.CACHE_DISK_UPLOADS else ("image",),
+)
+
+# Unfiltered detections per image, so a new confidence threshold is a filter, not a forward pass
+detection_store = DetectionStore(
+    max_entries=config.DETECTION_STORE_MAX_ENTRIES,
+    ttl=config.DETECTION_STORE_TTL,
+)
+
+# Species counts, confidence histograms and per-field egg density of specimens made of many images
+specimen_store = SpecimenStore(path=config.SPECIMEN_DB_PATH)
+
+# Prometheus metrics for /metrics; component collectors are registered further down
+metrics_registry = Registry()
+stage_seconds = metrics_registry.histogram(
+    "parasite_stage_duration_seconds", "Time spent in each request stage", ("endpoint", "stage")
+)
+detections_per_image = metrics_registry.histogram(
+    "parasite_detections_per_image", "Detections returned per image", ("endpoint",), COUNT_BUCKETS
+)
+cascade_images = metrics_registry.counter(
+    "parasite_cascade_images_total",
+    "Cascade /predict images by the last stage that ran: coarse alone, or a refine/tiled second pass",
+    ("decided_by",),
+)
+uploads_rejected = metrics_registry.counter(
+    "parasite_uploads_rejected_total", "Uploads rejected before inference, by reason", ("reason",)
+)
+request_errors = metrics_registry.counter(
+    "parasite_request_errors_total", "Requests with a valid upload that failed during processing", ("endpoint",)
+)
+queue_wait_seconds = metrics_registry.histogram(
+    "parasite_executor_queue_wait_seconds", "Time jobs wait for an inference worker"
+)
+inference_executor.on_queue_wait = queue_wait_seconds.observe
+
+# Samples stacks during slow requests once started, at boot or through /debug/profiler
+profiler = SamplingProfiler(
+    interval_ms=config.PROFILER_INTERVAL_MS,
+    slow_ms=config.PROFILER_SLOW_MS,
+    max_captures=config.PROFILER_MAX_CAPTURES,
+)
+
+HEATMAP_METHOD = "GradCAM"
+HEATMAP_LAYERS = (18, 20, 22)
+# The explainer letterboxes to 640, so heatmap images never need more than that
+HEATMAP_INPUT_SIZE = 640
+
+
+@asynccontextmanager
+async def lifespan(app):
+    heatmap_jobs.start()
+    if config.PROFILER_ENABLED:
+        profiler.start()
+    if config.STARTUP_BACKGROUND:
+        # Serve /health/live right away; /health/ready turns 200 once startup finishes
+        threading.Thread(target=_startup, name="startup", daemon=True).start()
+    else:
+        await asyncio.to_thread(_startup)
+    yield
+    profiler.stop()
+    heatmap_jobs.close()
+    await predict_batcher.stop()
+    inference_executor.shutdown(wait=False)
+    explainer_pool.close()
+
+
+app = FastAPI(title="Parasite Detection API", description="YOLO-based parasite detection system", lifespan=lifespan)
 
 #ADDING API KEY
 API_KEY = 'kawai_so_oppai'
@@ -33,6 +164,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Cuts off oversized multipart bodies while they stream in and limits concurrent uploads per client
+app.add_middleware(
+    UploadLimitMiddleware,
+    # Room for the multipart framing and form fields around the image
+    max_bytes=config.UPLOAD_MAX_BYTES + 64 * 1024 if config.UPLOAD_MAX_BYTES else 0,
+    path_max_bytes={"/predict_batch": config.BULK_MAX_REQUEST_BYTES},
+    max_per_client=config.CLIENT_MAX_UPLOADS,
+    client_header=config.CLIENT_ID_HEADER,
+    on_reject=lambda reason: uploads_rejected.inc(reason=reason),
+)
+
+# Request counts, latency and body sizes per route; slow requests feed the profiler
+app.add_middleware(RequestMetricsMiddleware, registry=metrics_registry, listeners=[profiler.request_finished])
+
 # Parasite descriptions (same as Streamlit app)
 PARASITE_DESCRIPTIONS = {
     "Ancylostoma Spp": "Ancylostoma (hookworm) parasites attach to the small intestine and feed on blood, causing anemia and protein deficiency.",
@@ -43,96 +188,937 @@ PARASITE_DESCRIPTIONS = {
     "Schistosoma": "Parasitic flatworm that lives in blood vessels, causing chronic inflammation and organ damage.",
     "Taenia Sp": "Tapeworm that lives in the intestine, causing nutrient deficiencies and weight loss.",
     "Trichuris Trichiura": "Whipworm that infects the colon, causing diarrhea, anemia, and rectal prolapse in heavy infections.",
-    'Unknown Species': "Species couldn't be identified"
+    UNKNOWN_SPECIES: "Species couldn't be identified"
 }
 
-# Load model globally
-try:
-    model = YOLO('models/best.pt')
-except FileNotFoundError:
-    model = None
+# The model is loaded by _startup(), from the configured backend or whichever
+# artifact is available, so importing this module stays cheap
+model_runtime = None
+model_load_errors = {}
+model = None
+model_names = {}
+model_imgsz = config.MODEL_IMGSZ or 640
+
+# Statically shaped exports (e.g. the OpenVINO model) cap the batch size
+batch_max_size = config.BATCH_MAX_SIZE
+# Tile batches must respect the model's batch limit too
+tile_batch_size = min(config.TILE_BATCH_SIZE, batch_max_size)
+
+# Ultralytics predictors are not thread-safe, so forward passes are serialised
+model_lock = threading.Lock()
+
+# Startup phase durations and state, reported by /health/ready
+startup_timer = StageTimer()
+startup_state = {"status": "starting", "error": None, "explainer_error": None}
+
+
+def _load_model():
+    global model_runtime, model_load_errors, model, model_names, model_imgsz, batch_max_size, tile_batch_size
+    model_runtime, model_load_errors = load_runtime(
+        config.MODEL_BACKEND, config.MODEL_WEIGHTS, config.OPENVINO_MODEL_DIR
+    )
+    if model_runtime is None:
+        return
+    model_names = model_runtime.names
+    model_imgsz = config.MODEL_IMGSZ or model_runtime.imgsz
+    if model_runtime.max_batch:
+        batch_max_size = min(config.BATCH_MAX_SIZE, model_runtime.max_batch)
+    tile_batch_size = min(config.TILE_BATCH_SIZE, batch_max_size)
+    predict_batcher.max_batch_size = batch_max_size
+    # Results of another model (or input size) must not be served
+    namespace = f"{model_runtime.identity}:{model_imgsz}"
+    result_cache.set_namespace(namespace)
+    detection_store.set_namespace(namespace)
+    model = model_runtime.model
+
+
+def _warm_up():
+    """
+    Dummy forward passes at batch size 1 and at the production batch size, so
+    graph compilation and lazy kernel initialisation don't hit the first requests
+    """
+    dummy = np.full((model_imgsz, model_imgsz, 3), 114, dtype=np.uint8)
+    dummy.setflags(write=False)
+    batch_sizes = sorted({1, min(config.WARMUP_BATCH_SIZE or batch_max_size, batch_max_size)})
+    for _ in range(config.WARMUP_ITERATIONS):
+        for size in batch_sizes:
+            _predict_batch([dummy] * size, [0.5] * size)
+    # Loads the plotting module and its font
+    draw_detections(dummy, Detections.empty(), model_names)
+
+
+def _warm_up_explainer():
+    dummy = np.full((HEATMAP_INPUT_SIZE, HEATMAP_INPUT_SIZE, 3), 114, dtype=np.uint8)
+    with explainer_pool.acquire(
+        method=HEATMAP_METHOD,
+        layers=HEATMAP_LAYERS,
+        show_box=False,
+        timeout=config.EXPLAINER_ACQUIRE_TIMEOUT,
+    ) as heatmap_model:
+        explain_array(heatmap_model, dummy)
+
+
+def _startup():
+    """Load the model, preload the explainer and warm up; each phase is timed"""
+    try:
+        with startup_timer.stage("load_model"):
+            _load_model()
+        if config.EXPLAINER_PRELOAD and os.path.exists(config.MODEL_WEIGHTS):
+            try:
+                with startup_timer.stage("explainer_preload"):
+                    explainer_pool.preload(HEATMAP_METHOD, HEATMAP_LAYERS, show_box=False)
+            except Exception as e:
+                # Not fatal: the pool creates instances on first use instead
+                startup_state["explainer_error"] = str(e)
+        if config.WARMUP_ENABLED and model is not None:
+            with startup_timer.stage("warmup"):
+                _warm_up()
+            if config.WARMUP_HEATMAP and os.path.exists(config.MODEL_WEIGHTS):
+                with startup_timer.stage("warmup_heatmap"):
+                    _warm_up_explainer()
+        with startup_timer.stage("start_workers"):
+            inference_executor.start()
+        startup_state["status"] = "ready" if model is not None else "degraded"
+    except Exception as e:
+        startup_state["status"] = "failed"
+        startup_state["error"] = str(e)
+
 
 @app.get("/")
 def home():
     return {"status": "success", "message": "YOLO Parasites API is running"}
 
+
+@app.get("/health/live")
+def liveness():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "alive"}
+
+
+def _startup_report():
+    return {
+        "status": startup_state["status"],
+        "error": startup_state["error"],
+        "explainer_error": startup_state["explainer_error"],
+        "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in startup_timer.stages.items()},
+    }
+
+
+@app.get("/health/ready")
+def readiness():
+    """Readiness: 200 once the model is loaded and warmed up, 503 before that or if it failed to load"""
+    report = _startup_report()
+    if startup_state["status"] != "ready":
+        return JSONResponse(status_code=503, content=report)
+    return report
+
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "model_loaded": model is not None}
+    return {
+        "status": "healthy" if model is not None else "degraded",
+        "model_loaded": model is not None,
+        "startup": _startup_report(),
+        "runtime": model_runtime.info() if model_runtime is not None else None,
+        "model_load_errors": model_load_errors,
+        "explainer_pool": explainer_pool.stats(),
+        "inference_executor": inference_executor.stats(),
+        "predict_batcher": predict_batcher.stats(),
+        "result_cache": result_cache.stats(),
+        "detection_store": detection_store.stats(),
+        "heatmap_jobs": heatmap_jobs.stats(),
+        "specimens": specimen_store.stats(),
+        "streams": [stream.as_dict() for stream in active_streams],
+    }
+
+
+@app.get("/cache/stats")
+def cache_stats(token: str = Depends(get_api_key)):
+    """Result cache and detection store hit/miss counters and memory usage"""
+    return {**result_cache.stats(), "detection_store": detection_store.stats()}
+
+
+# Problems with the upload itself; answered with their own status codes and
+# counted apart from requests that fail during processing
+UPLOAD_ERRORS = (UploadRejected, ImageTooLarge, UndecodableImage)
+
+
+def _rejected_exception(e):
+    uploads_rejected.inc(reason=e.reason)
+    return HTTPException(status_code=e.status_code, detail=str(e))
+
+
+def _failed_exception(endpoint, detail):
+    request_errors.inc(endpoint=endpoint)
+    return HTTPException(status_code=500, detail=detail)
+
+
+def _overloaded_exception(e):
+    return HTTPException(
+        status_code=e.status_code,
+        detail=e.detail,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+async def _read_image(file, image_hash):
+    """
+    Return ``(contents, digest)`` for an uploaded file or a previously uploaded image hash.
+
+    ``contents`` is None when only the hash was given; load it with ``_cached_image``
+    once it is clear the response itself isn't cached.
+    """
+    if file is not None:
+        contents = await read_upload(file, config.UPLOAD_MAX_BYTES, config.MAX_IMAGE_PIXELS)
+        # Hashing a large slide takes long enough to stall the event loop
+        digest = await asyncio.to_thread(hash_image, contents)
+        if image_hash and image_hash != digest:
+            raise HTTPException(status_code=400, detail="image_hash does not match the uploaded file")
+        await _cache_put(make_key("image", digest), contents)
+        return contents, digest
+    if image_hash:
+        return None, image_hash
+    raise HTTPException(status_code=400, detail="Provide an image file or an image_hash")
+
+
+async def _cache_get(key):
+    """``result_cache.get``, off the event loop when it may read from disk"""
+    if result_cache.disk_dir:
+        return await asyncio.to_thread(result_cache.get, key)
+    return result_cache.get(key)
+
+
+async def _cache_put(key, value):
+    """``result_cache.put``, off the event loop when evictions may write to disk"""
+    if result_cache.disk_dir:
+        return await asyncio.to_thread(result_cache.put, key, value)
+    return result_cache.put(key, value)
+
+
+async def _cached_image(digest):
+    contents = await _cache_get(make_key("image", digest))
+    if contents is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Unknown image_hash, please upload the image file",
+        )
+    return contents
+
+
+def _timed(response, timer, endpoint):
+    """Report the request's stages in Server-Timing and the stage histograms"""
+    response.headers["Server-Timing"] = timer.header()
+    for stage, seconds in timer.stages.items():
+        stage_seconds.observe(seconds, endpoint=endpoint, stage=stage)
+    return response
+
+
+def _json_response(payload):
+    """Serialize once so the same bytes can be cached and returned"""
+    started = time.perf_counter()
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    record("serialize", time.perf_counter() - started)
+    return body, Response(content=body, media_type="application/json")
+
+
+def _run_heatmap(contents, show_box, progress=None):
+    """
+    CPU-bound part of /generate_heatmap, executed on the inference executor
+
+    ``progress(stage, fraction)`` is called between stages when given.
+    Returns ``(heatmap_base64, stage_seconds)``.
+    """
+    timer = StageTimer()
+    if progress is not None:
+        progress("decoding", 0.05)
+    with timer.stage("decode"):
+        decoded = _decode_upload(contents, HEATMAP_INPUT_SIZE)
+
+    # Generate heatmap with a pooled explainer, straight from the decoded array
+    if progress is not None:
+        progress("explaining", 0.2)
+    wait_started = time.perf_counter()
+    with explainer_pool.acquire(
+        method=HEATMAP_METHOD,
+        layers=HEATMAP_LAYERS,
+        show_box=show_box,
+        timeout=config.EXPLAINER_ACQUIRE_TIMEOUT,
+    ) as heatmap_model:
+        timer.add("explainer_wait", time.perf_counter() - wait_started)
+        with timer.stage("cam"):
+            heatmap_pil = explain_array(heatmap_model, decoded.array)
+
+    # Convert to base64
+    if progress is not None:
+        progress("encoding", 0.9)
+    with timer.stage("encode"):
+        img_buffer = io.BytesIO()
+        heatmap_pil.save(img_buffer, format='PNG')
+    with timer.stage("base64"):
+        heatmap_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+    return heatmap_base64, timer.stages
 
 
 @app.post("/generate_heatmap")
 async def generate_heatmap(
     token: str = Depends(get_api_key),
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
     show_box: bool = False,
+    image_hash: str = None,
 ):
 
-    
+    timer = StageTimer().activate()
     try:
-        # Read uploaded file
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        img_array = np.array(image)
-        
-        # Save image to temporary file since yolov8_heatmap expects img_path
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            tmp_path = tmp_file.name
-            Image.fromarray(img_array).save(tmp_path)
-        
-        try:
-            # Generate heatmap with specified parameters
-            heatmap_model = yolov8_heatmap(
-                weight='models/best.pt',
-                method="GradCAM",
-                conf_threshold=0.2,
-                show_box=show_box,
-                layer=[18,20,22]
-            )
-            heatmap_list = heatmap_model(img_path=tmp_path)
-            
-            # Extract heatmap image
-            if isinstance(heatmap_list, list) and len(heatmap_list) > 0:
-                heatmap_img = heatmap_list[0]
-            else:
-                heatmap_img = heatmap_list
-            
-            # Convert heatmap to PIL Image if needed
-            if isinstance(heatmap_img, Image.Image):
-                heatmap_pil = heatmap_img
-            else:
-                heatmap_pil = Image.fromarray(heatmap_img)
-            
-            # Convert to base64
-            img_buffer = io.BytesIO()
-            heatmap_pil.save(img_buffer, format='PNG')
-            heatmap_base64 = base64.b64encode(img_buffer.getvalue()).decode()
-            
-            return {
-                "status": "success",
-                "image_heatmap": heatmap_base64,
-            }
-        
-        finally:
-            # Clean up temporary file
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-    
+        # Read uploaded file, or reuse one the server already holds
+        contents, digest = await _read_image(file, image_hash)
+        cache_key = make_key("heatmap", digest, show_box=show_box)
+        with timer.stage("cache"):
+            cached = await _cache_get(cache_key)
+        if cached is not None:
+            return _timed(Response(content=cached, media_type="application/json"), timer, "generate_heatmap")
+        if contents is None:
+            contents = await _cached_image(digest)
+
+        heatmap_base64, stages = await inference_executor.run("generate_heatmap", _run_heatmap, contents, show_box)
+        for name, seconds in stages.items():
+            timer.add(name, seconds)
+
+        body, response = _json_response({
+            "status": "success",
+            "image_heatmap": heatmap_base64,
+            "image_hash": digest,
+        })
+        await _cache_put(cache_key, body)
+        return _timed(response, timer, "generate_heatmap")
+
+    except HTTPException:
+        raise
+    except UPLOAD_ERRORS as e:
+        raise _rejected_exception(e)
+    except Overloaded as e:
+        raise _overloaded_exception(e)
+    except ExplainerPoolTimeout as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Heatmap explainers are busy: {str(e)}",
+            headers={"Retry-After": "1"},
+        )
     except Exception as e:
+        raise _failed_exception("generate_heatmap", f"Error generating heatmap: {str(e)}")
+
+
+def _run_explain(contents, confidence_threshold, heatmap_size, cam_scope, show_boxes, show_labels):
+    """
+    CPU-bound part of /explain: detections and their Grad-CAM from one forward pass
+
+    Returns ``(payload, stage_seconds)``.
+    """
+    timer = StageTimer()
+    with timer.stage("decode"):
+        # One decode shared by the model input and the heatmap background
+        decoded = _decode_upload(contents, max(heatmap_size, HEATMAP_INPUT_SIZE) if heatmap_size else 0)
+    wait_started = time.perf_counter()
+    with explainer_pool.acquire(
+        method=HEATMAP_METHOD,
+        layers=HEATMAP_LAYERS,
+        show_box=False,
+        timeout=config.EXPLAINER_ACQUIRE_TIMEOUT,
+    ) as explainer:
+        timer.add("explainer_wait", time.perf_counter() - wait_started)
+        with timer.stage("cam"):
+            result = detect_and_explain(
+                explainer, decoded.array, confidence_threshold, imgsz=HEATMAP_INPUT_SIZE, scope=cam_scope
+            )
+    detections = result.detections
+    with timer.stage("overlay"):
+        heatmap, (sx, sy) = overlay(decoded.array, result.cam, heatmap_size)
+    if show_boxes:
+        with timer.stage("plot"):
+            heatmap = draw_detections(heatmap, detections.scaled(sx, sy), model_names, show_labels=show_labels)
+    with timer.stage("encode"):
+        img_buffer = io.BytesIO()
+        Image.fromarray(heatmap).save(img_buffer, format='PNG')
+    with timer.stage("base64"):
+        heatmap_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+
+    width, height = decoded.original_size
+    payload = {
+        "image_size": [width, height],
+        "heatmap_size": [heatmap.shape[1], heatmap.shape[0]],
+        "cam_scope": cam_scope,
+        "image_heatmap": heatmap_base64,
+        "detections": _detection_list(detections),
+        **detections.scaled(*decoded.scale).to_columnar(model_names),
+        **_summarise(detections),
+    }
+    return payload, timer.stages
+
+
+@app.post("/explain")
+async def explain_prediction(
+    token: str = Depends(get_api_key),
+    file: UploadFile = File(None),
+    confidence_threshold: float = 0.5,
+    image_hash: str = None,
+    heatmap_size: int = HEATMAP_INPUT_SIZE,
+    cam_scope: str = "boxes",
+    show_boxes: bool = True,
+    show_labels: bool = True,
+):
+    """
+    Detections and their Grad-CAM heatmap from a single forward pass
+
+    One upload, one decode, one forward and one backward pass on the
+    PyTorch weights give both the detections and the heatmap. Detections
+    therefore come from the explainer's PyTorch model, even when /predict
+    serves the OpenVINO export.
+
+    Parameters:
+    - heatmap_size: Longest side of the returned heatmap in pixels (0 keeps the image size)
+    - cam_scope: "boxes" (CAM normalised inside each returned box, zero elsewhere) or "image"
+    - show_boxes / show_labels: Draw the detections on the heatmap
+    """
+    _require_model()
+    _check_confidence_threshold(confidence_threshold)
+    if cam_scope not in CAM_SCOPES:
+        raise HTTPException(status_code=400, detail=f"cam_scope must be one of {CAM_SCOPES}")
+    if heatmap_size < 0:
+        raise HTTPException(status_code=400, detail="heatmap_size must not be negative")
+
+    timer = StageTimer().activate()
+    try:
+        contents, digest = await _read_image(file, image_hash)
+        cache_key = make_key(
+            "explain",
+            digest,
+            confidence_threshold=confidence_threshold,
+            heatmap_size=heatmap_size,
+            cam_scope=cam_scope,
+            show_boxes=show_boxes,
+            show_labels=show_labels,
+        )
+        with timer.stage("cache"):
+            cached = await _cache_get(cache_key)
+        if cached is not None:
+            return _timed(Response(content=cached, media_type="application/json"), timer, "explain")
+        if contents is None:
+            contents = await _cached_image(digest)
+
+        payload, stages = await inference_executor.run(
+            "generate_heatmap", _run_explain,
+            contents, confidence_threshold, heatmap_size, cam_scope, show_boxes, show_labels,
+        )
+        for name, seconds in stages.items():
+            timer.add(name, seconds)
+        detections_per_image.observe(payload["total_detections"], endpoint="explain")
+
+        payload["image_hash"] = digest
+        body, response = _json_response(payload)
+        await _cache_put(cache_key, body)
+        return _timed(response, timer, "explain")
+
+    except HTTPException:
+        raise
+    except UPLOAD_ERRORS as e:
+        raise _rejected_exception(e)
+    except Overloaded as e:
+        raise _overloaded_exception(e)
+    except ExplainerPoolTimeout as e:
         raise HTTPException(
-            status_code=400,
-            detail=f"Error generating heatmap: {str(e)}"
+            status_code=503,
+            detail=f"Heatmap explainers are busy: {str(e)}",
+            headers={"Retry-After": "1"},
+        )
+    except Exception as e:
+        raise _failed_exception("explain", f"Error explaining image: {str(e)}")
+
+
+def _heatmap_job(kind, payload, params, report):
+    """Job handler for queued heatmaps; the result also goes into the result cache"""
+    # Progress is written to the job database, which forked workers can't reach
+    progress = report if inference_executor.kind == "thread" else None
+    while True:
+        try:
+            # Shares the executor and the heatmap limit with /generate_heatmap
+            heatmap_base64, stages = inference_executor.run_blocking(
+                "generate_heatmap", _run_heatmap, payload, params["show_box"], progress=progress
+            )
+            break
+        except Overloaded as e:
+            # Queued jobs wait for a slot instead of failing; raises if cancelled meanwhile
+            report("waiting", 0.0)
+            time.sleep(e.retry_after)
+    for stage, seconds in stages.items():
+        stage_seconds.observe(seconds, endpoint="heatmap_jobs", stage=stage)
+    body, _ = _json_response({
+        "status": "success",
+        "image_heatmap": heatmap_base64,
+        "image_hash": params["image_hash"],
+    })
+    result_cache.put(make_key("heatmap", params["image_hash"], show_box=params["show_box"]), body)
+    return heatmap_base64
+
+
+# Heatmaps can also run as background jobs so clients don't block on them
+heatmap_jobs = JobQueue(
+    _heatmap_job,
+    path=config.JOB_DB_PATH,
+    workers=config.JOB_WORKERS,
+    max_queued=config.JOB_MAX_QUEUED,
+    result_ttl=config.JOB_RESULT_TTL,
+)
+
+
+def _job_view(job_id):
+    """The job as returned by the API, or None if it doesn't exist (anymore)"""
+    job = heatmap_jobs.get(job_id)
+    if job is None:
+        return None
+    result = job.pop("result", None)
+    if job["status"] == SUCCEEDED:
+        job["image_heatmap"] = result
+    return job
+
+
+def _job_or_404(job_id):
+    job = _job_view(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
+
+
+@app.post("/heatmap_jobs", status_code=202)
+async def submit_heatmap_job(
+    token: str = Depends(get_api_key),
+    file: UploadFile = File(None),
+    show_box: bool = False,
+    image_hash: str = None,
+    priority: int = 0,
+):
+    """
+    Queue a heatmap; poll /heatmap_jobs/{job_id} or stream /heatmap_jobs/{job_id}/events
+
+    Parameters:
+    - show_box: Draw detection boxes on the heatmap
+    - image_hash: SHA-256 of an image already sent to the server, instead of the file
+    - priority: Higher values run first
+    """
+    try:
+        contents, digest = await _read_image(file, image_hash)
+    except UPLOAD_ERRORS as e:
+        raise _rejected_exception(e)
+    params = {"show_box": show_box, "image_hash": digest}
+
+    cached = await _cache_get(make_key("heatmap", digest, show_box=show_box))
+    if cached is not None:
+        job_id = heatmap_jobs.complete("heatmap", json.loads(cached)["image_heatmap"], params)
+        return {"job_id": job_id, "status": SUCCEEDED, "image_hash": digest}
+
+    if contents is None:
+        contents = await _cached_image(digest)
+    try:
+        job_id = heatmap_jobs.submit("heatmap", contents, params, priority=priority)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Heatmap job queue is full: {str(e)}", headers={"Retry-After": "5"})
+    return {"job_id": job_id, "status": QUEUED, "image_hash": digest}
+
+
+@app.get("/heatmap_jobs/{job_id}")
+def get_heatmap_job(job_id: str, token: str = Depends(get_api_key)):
+    """Job status and progress; includes image_heatmap once the job has succeeded"""
+    return _job_or_404(job_id)
+
+
+@app.delete("/heatmap_jobs/{job_id}")
+def cancel_heatmap_job(job_id: str, token: str = Depends(get_api_key)):
+    """Cancel a queued or running job"""
+    _job_or_404(job_id)
+    return {"job_id": job_id, "cancelled": heatmap_jobs.cancel(job_id)}
+
+
+def _job_event(job):
+    return f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+
+
+async def _job_events(job):
+    """
+    The job's state now and after every change, until it finishes
+
+    ``job`` is resolved before the response starts: once streaming, an
+    HTTPException can no longer become a 404.
+    """
+    job_id = job["id"]
+    last_version = job["version"]
+    last_sent = time.monotonic()
+    yield _job_event(job)
+    while job["status"] not in TERMINAL_STATES:
+        await asyncio.sleep(config.JOB_EVENTS_POLL_INTERVAL)
+        state = heatmap_jobs.version(job_id)
+        if state is None:
+            # Purged in the meantime
+            return
+        if state[0] != last_version:
+            job = _job_view(job_id)
+            if job is None:
+                return
+            last_version = job["version"]
+            last_sent = time.monotonic()
+            yield _job_event(job)
+        elif time.monotonic() - last_sent > 15:
+            # Comment line keeps proxies from closing an idle stream
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+
+
+@app.get("/heatmap_jobs/{job_id}/events")
+def stream_heatmap_job(job_id: str, token: str = Depends(get_api_key)):
+    """Server-Sent Events with the job state on every change, until it finishes"""
+    return StreamingResponse(
+        _job_events(_job_or_404(job_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def _decode_upload(contents, min_size=0):
+    """Decode to RGB; ``min_size`` > 0 allows a reduced resolution with at least that longest side"""
+    return decode_image(contents, min_size=min_size, max_pixels=config.MAX_IMAGE_PIXELS)
+
+
+def _predict_batch(img_arrays, confidence_thresholds):
+    """Single batched forward pass; each image keeps only boxes above its own threshold"""
+    with model_lock:
+        results = model.predict(
+            img_arrays,
+            conf=min(confidence_thresholds),
+            imgsz=model_imgsz,
         )
+    return [
+        Detections.from_result(result).filter(threshold)
+        for result, threshold in zip(results, confidence_thresholds)
+    ]
+
+
+async def _run_predict_batch(items):
+    img_arrays = [img_array for img_array, _ in items]
+    thresholds = [threshold for _, threshold in items]
+    return await inference_executor.call(_predict_batch, img_arrays, thresholds)
+
+
+# Concurrent /predict requests share batched forward passes
+predict_batcher = MicroBatcher(
+    _run_predict_batch,
+    max_batch_size=batch_max_size,
+    max_wait_ms=config.BATCH_MAX_WAIT_MS,
+)
+
+
+# Detections below this confidence are reported as "Unknown Species"
+UNKNOWN_SPECIES_THRESHOLD = 0.5
+# Confidence tiers (exclusive lower bounds) and their emoji, highest first
+CONFIDENCE_TIERS = ((0.8, "🟢"), (0.6, "🟡"))
+LOW_CONFIDENCE_EMOJI = "🔴"
+
+
+def _species_name(conf, class_id):
+    # Handle low confidence detections
+    if conf < UNKNOWN_SPECIES_THRESHOLD:
+        return UNKNOWN_SPECIES
+    return model_names[int(class_id)]
+
+
+def _species_names(detections):
+    """``_species_name`` for every detection, looking each class name up once"""
+    names = np.array([model_names[int(c)] for c in range(max(model_names, default=-1) + 1)] + [UNKNOWN_SPECIES])
+    index = np.where(detections.confidences < UNKNOWN_SPECIES_THRESHOLD, len(names) - 1, detections.class_ids)
+    return names[index].tolist()
+
+
+def _confidence_emojis(confidences):
+    return np.select(
+        [confidences > bound for bound, _ in CONFIDENCE_TIERS],
+        [emoji for _, emoji in CONFIDENCE_TIERS],
+        LOW_CONFIDENCE_EMOJI,
+    ).tolist()
+
+
+def _detection_list(detections):
+    """Per-detection entries of the /predict response"""
+    confidences = detections.confidences.astype(float)
+    species = _species_names(detections)
+    return [
+        {
+            "index": idx + 1,
+            "name": species_name,
+            "confidence": conf,
+            "confidence_percentage": f"{conf:.1%}",
+            "confidence_emoji": conf_emoji,
+            "description": PARASITE_DESCRIPTIONS.get(species_name, "No description available."),
+        }
+        for idx, (conf, species_name, conf_emoji) in enumerate(
+            zip(confidences.tolist(), species, _confidence_emojis(confidences))
+        )
+    ]
+
+
+def _summarise(detections):
+    """Summary statistics shared by every /predict response format"""
+    if len(detections) > 0:
+        avg_confidence = float(np.mean(detections.confidences))
+        unique_classes = np.unique(detections.class_ids)
+    else:
+        avg_confidence = 0.0
+        unique_classes = ()
+
+    return {
+        "total_detections": len(detections),
+        "avg_confidence": f"{avg_confidence:.1%}" if avg_confidence > 0 else "0.0%",
+        "unique_species": len(unique_classes)
+    }
+
+
+def _build_prediction_response(img_array, detections, show_boxes, show_labels):
+    """
+    Annotate, encode and summarise a single prediction result
+
+    Returns ``(payload, stage_seconds)``.
+    """
+    timer = StageTimer()
+    # Generate annotated image
+    with timer.stage("plot"):
+        if show_boxes:
+            annotated_image = draw_detections(img_array, detections, model_names, show_labels=show_labels)
+        else:
+            annotated_image = img_array
+
+    # Convert annotated image to base64
+    with timer.stage("encode"):
+        annotated_pil = Image.fromarray(annotated_image)
+        img_buffer = io.BytesIO()
+        annotated_pil.save(img_buffer, format='PNG')
+    with timer.stage("base64"):
+        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+
+    payload = {
+        "image_base64": img_base64,
+        "detections": _detection_list(detections),
+        **_summarise(detections),
+    }
+    return payload, timer.stages
+
+
+def _build_columnar_response(decoded, detections):
+    """Structured detections only, without rendering the image, in original image coordinates"""
+    width, height = decoded.original_size
+    return {
+        "format": "columnar",
+        "image_size": [width, height],
+        **detections.scaled(*decoded.scale).to_columnar(model_names),
+        **_summarise(detections),
+    }
+
+
+def _startup_error():
+    """Why requests can't be served yet, or None once startup is complete"""
+    status = startup_state["status"]
+    if status == "ready":
+        return None
+    if status == "starting":
+        # Includes warm-up: the model may be set, but requests would queue behind it
+        return "Model is still loading"
+    if model is None:
+        return f"Model not loaded. Please ensure '{config.MODEL_WEIGHTS}' or '{config.OPENVINO_MODEL_DIR}' exists."
+    return f"Startup failed: {startup_state['error']}"
+
+
+def _require_model():
+    error = _startup_error()
+    if error is not None:
+        headers = {"Retry-After": "5"} if startup_state["status"] == "starting" else None
+        raise HTTPException(status_code=503, detail=error, headers=headers)
+
+
+def _check_confidence_threshold(confidence_threshold):
+    """Reject a threshold outside [0, 1] (or NaN) before the upload is read"""
+    if not 0 <= confidence_threshold <= 1:
+        raise HTTPException(status_code=400, detail="confidence_threshold must be between 0 and 1")
+
+
+def _predict_tiles(crops, windows, confidence_threshold):
+    """Forward pass over one batch of tiles, with boxes mapped back to image coordinates"""
+    with model_lock:
+        results = model.predict(crops, conf=confidence_threshold, imgsz=model_imgsz)
+    return concatenate([
+        to_global(Detections.from_result(result), window)
+        for result, window in zip(results, windows)
+    ])
+
+
+async def _detect_tiled(img_array, confidence_threshold):
+    """
+    Detect over overlapping tiles, with at most TILE_PARALLELISM tile batches in flight
+    so only those crops are materialised at any time.
+    """
+    tile_detections = []
+    pending = set()
+    batches = iter_tile_batches(img_array, config.TILE_SIZE, config.TILE_OVERLAP, tile_batch_size)
+    try:
+        for windows, crops in batches:
+            pending.add(asyncio.ensure_future(
+                inference_executor.call(_predict_tiles, crops, windows, confidence_threshold)
+            ))
+            if len(pending) >= config.TILE_PARALLELISM:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                tile_detections.extend(task.result() for task in done)
+        if pending:
+            done, pending = await asyncio.wait(pending)
+            tile_detections.extend(task.result() for task in done)
+    finally:
+        for task in pending:
+            task.cancel()
+    return merge_detections(
+        concatenate(tile_detections), config.TILE_MERGE_METHOD, config.TILE_MERGE_THRESHOLD
+    )
+
+
+async def _detect_raw(decoded, confidence_threshold, tiled, digest, timer):
+    """
+    Unfiltered detections for ``decoded`` in array coordinates, down to at most
+    ``confidence_threshold``. They come from the detection store when this
+    image was detected before at a low enough floor. Otherwise inference runs
+    at the configured floor and the result is stored for later thresholds.
+    """
+    stored = detection_store.get(digest, tiled) if digest else None
+    if stored is not None and stored.floor <= confidence_threshold:
+        sx, sy = decoded.scale
+        return stored.detections.scaled(1 / sx, 1 / sy)
+    floor = min(confidence_threshold, config.DETECTION_CONF_FLOOR)
+    with timer.stage("inference"):
+        if tiled:
+            raw = await _detect_tiled(decoded.array, floor)
+        else:
+            raw = await predict_batcher.submit((decoded.array, floor))
+    if digest:
+        detection_store.put(digest, raw.scaled(*decoded.scale), decoded.original_size, floor, tiled)
+    return raw
+
+
+async def _detect(contents, confidence_threshold, tiled=False, timer=None, min_size=0, digest=None):
+    """
+    Decode an upload and detect on it (caller holds an executor slot)
+
+    Returns ``(decoded, detections)`` with boxes in ``decoded.array`` coordinates.
+    Tiled detection always decodes at full resolution. With ``digest`` the
+    detection store is used, so a known image is only filtered, not re-run.
+    """
+    timer = timer or StageTimer()
+    with timer.stage("decode"):
+        decoded = await inference_executor.call(_decode_upload, contents, 0 if tiled else min_size)
+    raw = await _detect_raw(decoded, confidence_threshold, tiled, digest, timer)
+    with timer.stage("filter"):
+        detections = raw.filter(confidence_threshold)
+    return decoded, detections
+
+
+def _predict_at(img_array, confidence_threshold, imgsz):
+    """Unbatched forward pass at a given input size (the coarse cascade pass)"""
+    with model_lock:
+        results = model.predict(img_array, conf=confidence_threshold, imgsz=imgsz)
+    return Detections.from_result(results[0])
+
+
+async def _refine_regions(img_array, windows, confidence_threshold):
+    """Detect again at native resolution in ``windows``, at most TILE_PARALLELISM batches at once"""
+    parallelism = asyncio.Semaphore(config.TILE_PARALLELISM)
+
+    async def run(batch):
+        async with parallelism:
+            crops = [img_array[y0:y1, x0:x1] for x0, y0, x1, y1 in batch]
+            return await inference_executor.call(_predict_tiles, crops, batch, confidence_threshold)
+
+    batches = [windows[i:i + tile_batch_size] for i in range(0, len(windows), tile_batch_size)]
+    return concatenate(list(await asyncio.gather(*(run(batch) for batch in batches))))
+
+
+async def _detect_cascade(contents, confidence_threshold, timer, full_size=False):
+    """
+    Coarse pass over the whole image, then native resolution only where it was unsure
+
+    Detections the coarse pass scores inside [CASCADE_UNCERTAIN_MIN,
+    CASCADE_UNCERTAIN_MAX) are dropped and their regions detected again at
+    native resolution. With more than CASCADE_MAX_REGIONS regions, or more
+    regions than tiles, the whole image is tiled instead. Confident coarse
+    detections are kept as they are.
+
+    Returns ``(decoded, detections, stages, report)``: boxes in ``decoded.array``
+    coordinates, the stage that decided each detection ("coarse", "refine" or
+    "tiled") and a summary of what ran.
+    """
+    low, high = config.CASCADE_UNCERTAIN_MIN, config.CASCADE_UNCERTAIN_MAX
+    # Statically shaped exports would pad a smaller input back up, so nothing is saved there
+    coarse_imgsz = config.CASCADE_COARSE_IMGSZ if model_runtime.dynamic_shape else model_imgsz
+    # Detections down to the bottom of the band show where to look again
+    floor = min(confidence_threshold, low)
+    with timer.stage("decode"):
+        decoded = await inference_executor.call(_decode_upload, contents, 0 if full_size else coarse_imgsz)
+    with timer.stage("coarse"):
+        if coarse_imgsz == model_imgsz:
+            coarse = await predict_batcher.submit((decoded.array, floor))
+        else:
+            coarse = await inference_executor.call(_predict_at, decoded.array, floor, coarse_imgsz)
+    uncertain = (coarse.confidences >= low) & (coarse.confidences < high)
+    report = {"coarse_imgsz": coarse_imgsz, "uncertain": int(uncertain.sum()), "refined": None, "regions": 0}
+    if not uncertain.any():
+        detections = coarse.filter(confidence_threshold)
+        return decoded, detections, ["coarse"] * len(detections), report
+
+    full = decoded
+    if decoded.reduced:
+        with timer.stage("decode"):
+            full = await inference_executor.call(_decode_upload, contents, 0)
+        sx, sy = decoded.scale
+        fx, fy = full.scale
+        coarse = coarse.scaled(sx / fx, sy / fy)
+    height, width = full.array.shape[:2]
+    # Uncertain boxes close together share a window
+    windows = sorted({
+        region_window(box, width, height, config.CASCADE_REGION_SIZE) for box in coarse.boxes[uncertain].tolist()
+    })
+    with timer.stage("refine"):
+        if len(windows) > config.CASCADE_MAX_REGIONS or len(windows) >= count_tiles(
+            width, height, config.TILE_SIZE, config.TILE_OVERLAP
+        ):
+            refined = await _detect_tiled(full.array, floor)
+            report.update(refined="tiled", regions=None)
+        else:
+            refined = await _refine_regions(full.array, windows, floor)
+            report.update(refined="refine", regions=len(windows))
+
+    kept = coarse.select(~uncertain)
+    combined = concatenate([kept, refined])
+    stages = np.array(["coarse"] * len(kept) + [report["refined"]] * len(refined))
+    # Refined windows can overlap each other and the confident coarse boxes
+    keep = nms_keep(combined, config.TILE_MERGE_THRESHOLD)
+    combined, stages = combined.select(keep), stages[keep]
+    passed = combined.confidences >= confidence_threshold
+    return full, combined.select(passed), stages[passed].tolist(), report
+
+
+RESPONSE_FORMATS = ("base64", "detections")
 
 
 @app.post("/predict")
 async def predict_parasite(
     token: str = Depends(get_api_key),
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
     confidence_threshold: float = 0.5,
     show_boxes: bool = True,
-    show_labels: bool = True
+    show_labels: bool = True,
+    image_hash: str = None,
+    response_format: str = "base64",
+    tiled: bool = False,
+    cascade: bool = False,
 ):
     """
     Predict parasites in uploaded image
@@ -142,97 +1128,836 @@ async def predict_parasite(
     - confidence_threshold: Confidence threshold (0.0-1.0)
     - show_boxes: Include bounding boxes in annotated image
     - show_labels: Include labels on annotated image
+    - image_hash: SHA-256 of an image already sent to the server, instead of the file
+    - response_format: "base64" (annotated PNG embedded in JSON) or "detections"
+      (columnar boxes, class ids and confidences only; use /render for the image)
+    - tiled: Detect over overlapping 640px tiles at native resolution (for large captures)
+    - cascade: Quick low-resolution pass, then native resolution only around uncertain
+      detections; each detection reports the stage that decided it
     """
     
-    if model is None:
-        raise HTTPException(status_code=500, detail="Model not loaded. Please ensure 'models/best.pt' exists.")
+    _require_model()
+    _check_confidence_threshold(confidence_threshold)
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"response_format must be one of {RESPONSE_FORMATS}")
+    if tiled and cascade:
+        raise HTTPException(status_code=400, detail="tiled and cascade can't be combined")
     
+    timer = StageTimer().activate()
     try:
-        # Read uploaded file
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        width, height = image.size
-        img_array = np.array(image)
-        
-        # Run YOLO prediction
-        results = model.predict(img_array, conf=confidence_threshold)
-        result = results[0]
-        
-        # Generate annotated image
-        if show_boxes:
-            line_width = 3 if (width >= 500 or height >= 500) else 1
-            if show_labels:
-                annotated_image = result.plot(line_width=line_width)
-            else:
-                annotated_image = result.plot(labels=False, line_width=line_width)
+        # Read uploaded file, or reuse one the server already holds
+        contents, digest = await _read_image(file, image_hash)
+        if cascade:
+            cache_key = make_key(
+                "cascade",
+                digest,
+                confidence_threshold=confidence_threshold,
+                response_format=response_format,
+                show_boxes=show_boxes,
+                show_labels=show_labels,
+            )
+        elif response_format == "detections":
+            cache_key = make_key("detections", digest, confidence_threshold=confidence_threshold, tiled=tiled)
         else:
-            annotated_image = img_array
-        
-        # Convert annotated image to base64
-        annotated_pil = Image.fromarray(annotated_image)
-        img_buffer = io.BytesIO()
-        annotated_pil.save(img_buffer, format='PNG')
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
-
+            cache_key = make_key(
+                "predict",
+                digest,
+                confidence_threshold=confidence_threshold,
+                show_boxes=show_boxes,
+                show_labels=show_labels,
+                tiled=tiled,
+            )
+        with timer.stage("cache"):
+            cached = await _cache_get(cache_key)
+        if cached is not None:
+            return _timed(Response(content=cached, media_type="application/json"), timer, "predict")
+        if contents is None:
+            contents = await _cached_image(digest)
 
-        
-        # Extract detections
-        detections = result.boxes
-        
-        detection_list = []
-        for idx, detection in enumerate(detections):
-            conf = float(detection.conf)
-            class_id = int(detection.cls)
-            class_name = result.names[class_id]
-            
-            # Determine confidence emoji
-            if conf > 0.8:
-                conf_emoji = "🟢"
-            elif conf > 0.6:
-                conf_emoji = "🟡"
+        with inference_executor.admit("predict"):
+            # The annotated image is returned at full size; detections alone only
+            # need the resolution the model sees
+            min_size = model_imgsz if response_format == "detections" else 0
+            if cascade:
+                decoded, detections, decided_by, report = await _detect_cascade(
+                    contents, confidence_threshold, timer, full_size=response_format != "detections"
+                )
+                cascade_images.inc(decided_by=report["refined"] or "coarse")
             else:
-                conf_emoji = "🔴"
-            
-            # Handle low confidence detections
-            if conf < 0.5:
-                species_name = "Unknown Species"
+                decoded, detections = await _detect(contents, confidence_threshold, tiled, timer, min_size, digest)
+            detections_per_image.observe(len(detections), endpoint="predict")
+            if response_format == "detections":
+                payload = _build_columnar_response(decoded, detections)
             else:
-                species_name = class_name
-            
-            detection_dict = {
-                "index": idx + 1,
-                "name": species_name,
-                "confidence": conf,
-                "confidence_percentage": f"{conf:.1%}",
-                "confidence_emoji": conf_emoji,
-                "description": PARASITE_DESCRIPTIONS.get(species_name, "No description available.")
-            }
-            detection_list.append(detection_dict)
-        
-        
-        # Calculate summary statistics
-        if len(detections) > 0:
-            confidences = [float(d.conf) for d in detections]
-            avg_confidence = np.mean(confidences)
-            unique_classes = set([result.names[int(d.cls)] for d in detections])
-        else:
-            avg_confidence = 0.0
-            unique_classes = set()
-        
-        return {
-            "image_base64": img_base64,
-            "detections": detection_list,
-            "total_detections": len(detections),
-            "avg_confidence": f"{avg_confidence:.1%}" if avg_confidence > 0 else "0.0%",
-            "unique_species": len(unique_classes)
-        }
-        
+                payload, stages = await inference_executor.call(
+                    _build_prediction_response, decoded.array, detections, show_boxes, show_labels
+                )
+                for name, seconds in stages.items():
+                    timer.add(name, seconds)
+            if cascade:
+                payload["stages"] = decided_by
+                for entry, stage in zip(payload.get("detections", []), decided_by):
+                    entry["stage"] = stage
+                payload["cascade"] = report
+
+        payload["image_hash"] = digest
+        body, response = _json_response(payload)
+        await _cache_put(cache_key, body)
+        return _timed(response, timer, "predict")
+
+    except HTTPException:
+        raise
+    except UPLOAD_ERRORS as e:
+        raise _rejected_exception(e)
+    except Overloaded as e:
+        raise _overloaded_exception(e)
     except Exception as e:
+        raise _failed_exception("predict", f"Error processing image: {str(e)}")
+
+
+@app.get("/detections/{image_hash}")
+def refilter_detections(
+    image_hash: str,
+    token: str = Depends(get_api_key),
+    confidence_threshold: float = 0.5,
+    tiled: bool = False,
+):
+    """
+    Re-filter and re-summarise an image's stored detections at another threshold
+
+    No inference runs here: the raw detections kept by an earlier /predict,
+    /render or /predict_batch call are masked by confidence. The response has
+    the /predict detection list and summary plus the columnar boxes in
+    original image coordinates.
+    """
+    _check_confidence_threshold(confidence_threshold)
+    timer = StageTimer().activate()
+    stored = detection_store.get(image_hash, tiled)
+    if stored is None:
+        raise HTTPException(
+            status_code=404,
+            detail="No stored detections for this image_hash, run /predict on the image first",
+        )
+    if confidence_threshold < stored.floor:
         raise HTTPException(
-            status_code=400,
-            detail=f"Error processing image: {str(e)}"
+            status_code=409,
+            detail=f"Stored detections only go down to confidence {stored.floor}, run /predict at this threshold instead",
+        )
+    with timer.stage("filter"):
+        detections = stored.detections.filter(confidence_threshold)
+        width, height = stored.original_size
+        payload = {
+            "image_hash": image_hash,
+            "confidence_threshold": confidence_threshold,
+            "confidence_floor": stored.floor,
+            "image_size": [width, height],
+            "detections": _detection_list(detections),
+            **detections.to_columnar(model_names),
+            **_summarise(detections),
+        }
+    _, response = _json_response(payload)
+    return _timed(response, timer, "detections")
+
+
+def _ndjson(payload):
+    return (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _predict_batch_stream(uploads, confidence_threshold, tiled, admission, specimen_id=None):
+    """
+    Decode and detect uploads as a pipeline, yielding one NDJSON line per image
+    in completion order and a per-specimen summary line at the end. With
+    ``specimen_id`` every image is also attached to that specimen.
+    """
+    finished = asyncio.Queue()
+    aggregate = SpecimenAggregate()
+    # Images read but not yet being detected, and images being detected
+    decode_ahead = asyncio.Semaphore(config.BULK_DECODE_AHEAD)
+    in_flight = asyncio.Semaphore(config.BULK_MAX_IN_FLIGHT)
+    tasks = set()
+
+    async def infer(index, name, digest, image):
+        try:
+            raw = await _detect_raw(image, confidence_threshold, tiled, digest, StageTimer())
+            detections = raw.filter(confidence_threshold)
+            detections_per_image.observe(len(detections), endpoint="predict_batch")
+            species = _species_names(detections)
+            aggregate.add(detections, species)
+            payload = {
+                "type": "image",
+                "index": index,
+                "name": name,
+                "image_hash": digest,
+                **_build_columnar_response(image, detections),
+                "species_counts": dict(Counter(species)),
+            }
+            if specimen_id:
+                payload["field"], _ = specimen_store.add_field(
+                    specimen_id, digest, detections.scaled(*image.scale), species,
+                    image.original_size, confidence_threshold, name,
+                )
+        except Exception as e:
+            request_errors.inc(endpoint="predict_batch")
+            payload = {"type": "error", "index": index, "name": name, "error": f"Error processing image: {str(e)}"}
+        return payload
+
+    async def process(index, name, contents):
+        # Each image is admitted to the executor for its decode and again for its
+        # detection, waiting for a free slot rather than failing the image
+        try:
+            async with inference_executor.admit_waiting("predict_batch_images"):
+                image = await inference_executor.call(_decode_upload, contents, 0 if tiled else model_imgsz)
+            digest = await asyncio.to_thread(hash_image, contents)
+        except Exception as e:
+            decode_ahead.release()
+            if isinstance(e, UPLOAD_ERRORS):
+                uploads_rejected.inc(reason=e.reason)
+            await finished.put({"type": "error", "index": index, "name": name, "error": f"Error decoding image: {str(e)}"})
+            return
+        async with in_flight:
+            decode_ahead.release()
+            async with inference_executor.admit_waiting("predict_batch_images"):
+                payload = await infer(index, name, digest, image)
+        await finished.put(payload)
+
+    async def produce():
+        # Images are decoded concurrently, each in its own task, so a slow or huge
+        # one never holds up the rest; decode_ahead bounds how far reading runs ahead
+        index = 0
+        for upload in uploads:
+            images = iter_upload_images(upload.filename, upload.file, config.UPLOAD_MAX_BYTES)
+            while True:
+                try:
+                    item = await asyncio.to_thread(next, images, None)
+                except Exception as e:
+                    uploads_rejected.inc(reason="archive")
+                    await finished.put({"type": "error", "name": upload.filename, "error": f"Error reading upload: {str(e)}"})
+                    break
+                if item is None:
+                    break
+                name, contents = item
+                index += 1
+                if contents is None:
+                    uploads_rejected.inc(reason="bytes")
+                    error = f"Image is larger than {config.UPLOAD_MAX_BYTES} bytes"
+                    await finished.put({"type": "error", "index": index, "name": name, "error": error})
+                    continue
+                await decode_ahead.acquire()
+                task = asyncio.ensure_future(process(index, name, contents))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(set(tasks))
+        await finished.put(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            payload = await finished.get()
+            if payload is None:
+                break
+            if payload["type"] == "error":
+                aggregate.add_failure()
+            yield _ndjson(payload)
+
+        combined = aggregate.combined()
+        if specimen_id:
+            # Totals over every field attached so far, not only this request's
+            yield _ndjson({"type": "specimen", **specimen_store.summary(specimen_id)})
+        yield _ndjson({
+            "type": "summary",
+            "images": aggregate.images,
+            "failed": aggregate.failed,
+            "species_counts": dict(aggregate.species_counts),
+            "mean_confidence": float(combined.confidences.mean()) if len(combined) else 0.0,
+            **_summarise(combined),
+        })
+    finally:
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+        admission.close()
+
+
+@app.post("/predict_batch")
+async def predict_batch(
+    token: str = Depends(get_api_key),
+    files: List[UploadFile] = File(...),
+    confidence_threshold: float = 0.5,
+    tiled: bool = False,
+    specimen_id: str = None,
+):
+    """
+    Predict parasites in many images, streaming results as NDJSON
+
+    Parameters:
+    - files: Image files and/or zip/tar archives of images
+    - confidence_threshold: Confidence threshold (0.0-1.0)
+    - tiled: Detect over overlapping tiles at native resolution
+    - specimen_id: Also attach every image to this specimen (see /specimens)
+
+    Each image yields a line with "type": "image" (or "error") as soon as it
+    completes; the last line has "type": "summary" with per-specimen totals.
+    With specimen_id, a "type": "specimen" line with the specimen's running
+    totals comes before it.
+    """
+
+    _require_model()
+    _check_confidence_threshold(confidence_threshold)
+    if specimen_id and not specimen_store.exists(specimen_id):
+        raise HTTPException(status_code=404, detail="Unknown specimen id")
+
+    admission = ExitStack()
+    try:
+        admission.enter_context(inference_executor.admit("predict_batch"))
+    except Overloaded as e:
+        raise _overloaded_exception(e)
+
+    # The slot is released when the stream ends; the background task covers
+    # responses that are abandoned before streaming starts
+    return StreamingResponse(
+        _predict_batch_stream(files, confidence_threshold, tiled, admission, specimen_id),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(admission.close),
+    )
+
+
+def _specimen_or_404(specimen_id):
+    summary = specimen_store.summary(specimen_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Unknown specimen id")
+    return summary
+
+
+@app.post("/specimens", status_code=201)
+def create_specimen(token: str = Depends(get_api_key), name: str = None):
+    """Create a specimen to attach the images (fields) of one sample to"""
+    return specimen_store.summary(specimen_store.create(name))
+
+
+@app.get("/specimens/{specimen_id}")
+def get_specimen(specimen_id: str, token: str = Depends(get_api_key)):
+    """
+    Running totals over every field of the specimen
+
+    Species counts and mean confidences, a confidence histogram, eggs per
+    field (mean, standard deviation, maximum) and eggs per megapixel. These
+    are maintained as fields are added, so reading them costs the same
+    however many fields there are.
+    """
+    return _specimen_or_404(specimen_id)
+
+
+@app.delete("/specimens/{specimen_id}")
+def delete_specimen(specimen_id: str, token: str = Depends(get_api_key)):
+    """Delete a specimen with all its fields"""
+    if not specimen_store.delete(specimen_id):
+        raise HTTPException(status_code=404, detail="Unknown specimen id")
+    return {"specimen_id": specimen_id, "deleted": True}
+
+
+@app.post("/specimens/{specimen_id}/images")
+async def add_specimen_image(
+    specimen_id: str,
+    token: str = Depends(get_api_key),
+    file: UploadFile = File(None),
+    image_hash: str = None,
+    confidence_threshold: float = 0.5,
+    tiled: bool = False,
+    name: str = None,
+):
+    """
+    Detect on one field of the specimen and add it to the specimen's totals
+
+    Returns the field's columnar detections, its field number and the
+    updated specimen summary. An image already attached to the specimen is
+    not counted again ("added": false).
+    """
+    _require_model()
+    _check_confidence_threshold(confidence_threshold)
+    _specimen_or_404(specimen_id)
+
+    timer = StageTimer().activate()
+    try:
+        contents, digest = await _read_image(file, image_hash)
+        if contents is None:
+            contents = await _cached_image(digest)
+        with inference_executor.admit("predict"):
+            decoded, detections = await _detect(
+                contents, confidence_threshold, tiled, timer, 0 if tiled else model_imgsz, digest
+            )
+        detections_per_image.observe(len(detections), endpoint="specimens")
+        species = _species_names(detections)
+        with timer.stage("aggregate"):
+            field, added = specimen_store.add_field(
+                specimen_id, digest, detections.scaled(*decoded.scale), species,
+                decoded.original_size, confidence_threshold, name or getattr(file, "filename", None),
+            )
+            summary = specimen_store.summary(specimen_id)
+        _, response = _json_response({
+            "specimen_id": specimen_id,
+            "field": field,
+            "added": added,
+            "image_hash": digest,
+            **_build_columnar_response(decoded, detections),
+            "species_counts": dict(Counter(species)),
+            "specimen": summary,
+        })
+        return _timed(response, timer, "specimens")
+
+    except HTTPException:
+        raise
+    except UnknownSpecimen:
+        # Deleted while its image was being detected
+        raise HTTPException(status_code=404, detail="Unknown specimen id")
+    except UPLOAD_ERRORS as e:
+        raise _rejected_exception(e)
+    except Overloaded as e:
+        raise _overloaded_exception(e)
+    except Exception as e:
+        raise _failed_exception("specimens", f"Error processing image: {str(e)}")
+
+
+SPECIMEN_EXPORT_FORMATS = ("ndjson", "csv")
+_CSV_HEADER = "field,image_name,image_hash,x1,y1,x2,y2,class_id,class_name,species,confidence\n"
+
+
+def _csv_field(value):
+    value = "" if value is None else str(value)
+    if any(c in value for c in ',"\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _specimen_export(specimen_id, export_format):
+    if export_format == "csv":
+        yield _CSV_HEADER.encode("utf-8")
+    for field, detections in specimen_store.iter_fields(specimen_id):
+        species = _species_names(detections)
+        if export_format == "ndjson":
+            image_size = [field.pop("width"), field.pop("height")]
+            yield _ndjson({
+                **field,
+                "image_size": image_size,
+                **detections.to_columnar(model_names),
+                "species": species,
+            })
+            continue
+        prefix = f"{field['field']},{_csv_field(field['name'])},{field['image_hash']},"
+        rows = [
+            prefix + f"{x1:.1f},{y1:.1f},{x2:.1f},{y2:.1f},{class_id},{_csv_field(model_names[class_id])},"
+            f"{_csv_field(species_name)},{confidence:.4f}\n"
+            for (x1, y1, x2, y2), class_id, species_name, confidence in zip(
+                detections.boxes.tolist(), detections.class_ids.tolist(), species, detections.confidences.tolist()
+            )
+        ]
+        yield "".join(rows).encode("utf-8")
+
+
+@app.get("/specimens/{specimen_id}/detections")
+def export_specimen_detections(
+    specimen_id: str,
+    token: str = Depends(get_api_key),
+    export_format: str = "ndjson",
+):
+    """
+    Every detection of the specimen, streamed field by field
+
+    Parameters:
+    - export_format: "ndjson" (one line per field with columnar boxes in
+      original image pixels) or "csv" (one row per detection)
+    """
+    if export_format not in SPECIMEN_EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"export_format must be one of {SPECIMEN_EXPORT_FORMATS}")
+    _specimen_or_404(specimen_id)
+    media_type = "application/x-ndjson" if export_format == "ndjson" else "text/csv"
+    return StreamingResponse(
+        _specimen_export(specimen_id, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="specimen-{specimen_id}.{export_format}"'},
+    )
+
+
+def _render(img_array, detections, show_boxes, show_labels, image_format, quality, max_size):
+    if show_boxes:
+        img_array = draw_detections(img_array, detections, model_names, show_labels=show_labels)
+    return encode_image(img_array, image_format, quality, max_size)
+
+
+@app.post("/render")
+async def render_prediction(
+    token: str = Depends(get_api_key),
+    file: UploadFile = File(None),
+    confidence_threshold: float = 0.5,
+    show_boxes: bool = True,
+    show_labels: bool = True,
+    image_hash: str = None,
+    image_format: str = "jpeg",
+    quality: int = 85,
+    max_size: int = 0,
+    tiled: bool = False,
+):
+    """
+    Annotated image as binary JPEG/WebP/PNG
+
+    Parameters:
+    - image_format: "jpeg", "webp" or "png"
+    - quality: Encoder quality for JPEG/WebP (1-100)
+    - max_size: Downscale so the longest side is at most this many pixels (0 keeps full size)
+    """
+
+    _require_model()
+    _check_confidence_threshold(confidence_threshold)
+    if image_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"image_format must be one of {tuple(IMAGE_FORMATS)}")
+    if not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+    if max_size < 0:
+        raise HTTPException(status_code=400, detail="max_size must not be negative")
+    media_type = IMAGE_FORMATS[image_format][1]
+
+    timer = StageTimer().activate()
+    try:
+        contents, digest = await _read_image(file, image_hash)
+        cache_key = make_key(
+            "render",
+            digest,
+            confidence_threshold=confidence_threshold,
+            show_boxes=show_boxes,
+            show_labels=show_labels,
+            image_format=image_format,
+            quality=quality,
+            max_size=max_size,
+            tiled=tiled,
         )
+        with timer.stage("cache"):
+            cached = await _cache_get(cache_key)
+        if cached is not None:
+            return _timed(Response(content=cached, media_type=media_type), timer, "render")
+        if contents is None:
+            contents = await _cached_image(digest)
+
+        with inference_executor.admit("predict"):
+            # Reuse detections from an earlier /predict?response_format=detections call
+            detections_key = make_key("detections", digest, confidence_threshold=confidence_threshold, tiled=tiled)
+            cached_detections = await _cache_get(detections_key)
+            # A downscaled render only needs to be decoded at about its output size
+            min_size = max(max_size, model_imgsz) if max_size else 0
+            if cached_detections is not None:
+                with timer.stage("decode"):
+                    decoded = await inference_executor.call(_decode_upload, contents, min_size)
+                sx, sy = decoded.scale
+                detections = Detections.from_columnar(json.loads(cached_detections)).scaled(1 / sx, 1 / sy)
+            else:
+                decoded, detections = await _detect(contents, confidence_threshold, tiled, timer, min_size, digest)
+                detections_per_image.observe(len(detections), endpoint="render")
+                payload = _build_columnar_response(decoded, detections)
+                payload["image_hash"] = digest
+                await _cache_put(detections_key, _json_response(payload)[0])
+
+            with timer.stage("render"):
+                body, media_type = await inference_executor.call(
+                    _render, decoded.array, detections, show_boxes, show_labels, image_format, quality, max_size
+                )
+
+        await _cache_put(cache_key, body)
+        response = Response(content=body, media_type=media_type, headers={"X-Image-Hash": digest})
+        return _timed(response, timer, "render")
+
+    except HTTPException:
+        raise
+    except UPLOAD_ERRORS as e:
+        raise _rejected_exception(e)
+    except Overloaded as e:
+        raise _overloaded_exception(e)
+    except Exception as e:
+        raise _failed_exception("render", f"Error rendering image: {str(e)}")
+
+
+# Live streams currently connected to /ws/stream
+active_streams = set()
+stream_frames = metrics_registry.counter(
+    "parasite_stream_frames_total", "Live stream frames by outcome", ("outcome",)
+)
+
+
+def _stream_message(stats, frame, image_size, detections, track_ids, counts):
+    """Lightweight per-frame message: boxes in original frame pixels, no image"""
+    width, height = image_size
+    return {
+        "type": "detections",
+        "frame": frame,
+        "image_size": [width, height],
+        "boxes": np.round(detections.boxes, 1).tolist(),
+        "confidences": np.round(detections.confidences, 4).tolist(),
+        "class_ids": detections.class_ids.tolist(),
+        "labels": _species_names(detections),
+        "track_ids": track_ids.tolist(),
+        "counts": dict(counts),
+        "total_counted": sum(counts.values()),
+        "stats": stats.as_dict(),
+    }
+
+
+def _stream_command(text):
+    """Parse and validate a /ws/stream control message; raises ValueError"""
+    command = json.loads(text)
+    if not isinstance(command, dict):
+        raise ValueError("Control messages must be JSON objects")
+    if "confidence_threshold" in command:
+        try:
+            threshold = float(command["confidence_threshold"])
+        except (TypeError, ValueError):
+            threshold = None
+        # Also rejects NaN
+        if threshold is None or not 0 <= threshold <= 1:
+            raise ValueError("confidence_threshold must be a number between 0 and 1")
+        command["confidence_threshold"] = threshold
+    return command
+
+
+@app.websocket("/ws/stream")
+async def stream_detections(websocket: WebSocket, confidence_threshold: float = 0.5):
+    """
+    Live detection on a stream of camera frames
+
+    The client sends frames as binary messages (JPEG, or any format /predict
+    accepts). Text messages are JSON control commands:
+    ``{"confidence_threshold": 0.4}`` changes the threshold, and
+    ``{"type": "reset"}`` starts a new slide (tracks and counts are cleared).
+    An invalid command is answered with an ``error`` message and ignored.
+    Each processed frame is answered with a ``detections`` message carrying
+    boxes, labels, track ids, the per-species counts of tracked eggs and the
+    connection's statistics. A frame that arrives while the previous one is
+    still waiting replaces it (latest frame wins). A frame that finds the
+    executor full is dropped. The API key goes in the ``access_token``
+    header or query parameter.
+    """
+    api_key = websocket.headers.get(API_KEY_NAME) or websocket.query_params.get(API_KEY_NAME)
+    if api_key != API_KEY:
+        await websocket.close(code=1008, reason="Access denied")
+        return
+    if _startup_error() is not None:
+        # Close reasons are limited to 123 bytes
+        await websocket.close(code=1013, reason=_startup_error()[:120])
+        return
+    if len(active_streams) >= config.STREAM_MAX_CONNECTIONS:
+        await websocket.close(code=1013, reason="Too many live streams")
+        return
+    await websocket.accept()
+
+    client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else None
+    stats = StreamStats(client)
+    active_streams.add(stats)
+    slot = LatestFrame()
+    tracker = IoUTracker(config.TRACK_IOU_THRESHOLD, config.TRACK_MAX_MISSED, config.TRACK_MIN_HITS)
+    counts = Counter()
+    settings = {"confidence_threshold": confidence_threshold}
+
+    async def receive():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    stats.frame_received()
+                    if slot.put((stats.received, time.monotonic(), message["bytes"])):
+                        stats.dropped_stale += 1
+                        stream_frames.inc(outcome="dropped_stale")
+                elif message.get("text"):
+                    try:
+                        command = _stream_command(message["text"])
+                    except ValueError as e:
+                        await websocket.send_json({"type": "error", "error": f"Invalid control message: {str(e)}"})
+                        continue
+                    if "confidence_threshold" in command:
+                        settings["confidence_threshold"] = command["confidence_threshold"]
+                    if command.get("type") == "reset":
+                        # Applied by the detection loop so it never races with tracker.update()
+                        settings["reset"] = True
+        except WebSocketDisconnect:
+            pass
+        finally:
+            slot.close()
+
+    receiver = asyncio.ensure_future(receive())
+    try:
+        while True:
+            item = await slot.get()
+            if item is None:
+                break
+            frame, received_at, contents = item
+            if settings.pop("reset", False):
+                tracker.reset()
+                counts.clear()
+            try:
+                with inference_executor.admit("stream"):
+                    decoded = await inference_executor.call(_decode_upload, contents, model_imgsz)
+                    detections = await predict_batcher.submit((decoded.array, settings["confidence_threshold"]))
+            except Overloaded:
+                stats.dropped_overloaded += 1
+                stream_frames.inc(outcome="dropped_overloaded")
+                continue
+            except Exception as e:
+                stats.errors += 1
+                stream_frames.inc(outcome="error")
+                await websocket.send_json({"type": "error", "frame": frame, "error": f"Error processing frame: {str(e)}"})
+                continue
+            # Tracked in original frame coordinates so a changing decode scale can't break matching
+            detections = detections.scaled(*decoded.scale)
+            track_ids, confirmed = tracker.update(detections)
+            for track in confirmed:
+                counts[_species_name(track.best_confidence, track.class_id)] += 1
+            stats.frame_processed(received_at)
+            stream_frames.inc(outcome="processed")
+            await websocket.send_json(_stream_message(stats, frame, decoded.original_size, detections, track_ids, counts))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        active_streams.discard(stats)
+
+
+# Component statistics, evaluated only when /metrics is scraped
+metrics_registry.gauge_callback(
+    "parasite_model_loaded", "1 if a detector model is loaded", lambda: int(model is not None)
+)
+metrics_registry.gauge_callback(
+    "parasite_ready", "1 once startup and warm-up have finished", lambda: int(startup_state["status"] == "ready")
+)
+metrics_registry.gauge_callback(
+    "parasite_startup_phase_seconds", "Duration of each startup phase",
+    lambda: dict(startup_timer.stages), ("phase",),
+)
+metrics_registry.gauge_callback(
+    "parasite_executor_in_flight", "Jobs admitted to the inference executor",
+    lambda: inference_executor.stats()["in_flight"],
+)
+metrics_registry.counter_callback(
+    "parasite_executor_rejected_total", "Requests rejected as overloaded",
+    lambda: inference_executor.stats()["rejected"], ("endpoint",),
+)
+metrics_registry.counter_callback(
+    "parasite_worker_restarts_total", "Inference worker processes restarted after exiting",
+    lambda: inference_executor.stats().get("worker_pool", {}).get("restarts"),
+)
+metrics_registry.gauge_callback(
+    "parasite_worker_outstanding", "Tasks queued or running per inference worker process",
+    lambda: {
+        str(p["index"]): p["outstanding"]
+        for p in inference_executor.stats().get("worker_pool", {}).get("processes", [])
+    },
+    ("worker",),
+)
+metrics_registry.counter_callback(
+    "parasite_batches_total", "Forward passes run by the micro-batcher, by batch size",
+    lambda: predict_batcher.stats()["batch_size_histogram"], ("size",),
+)
+metrics_registry.counter_callback(
+    "parasite_batch_items_total", "Images run through the micro-batcher",
+    lambda: predict_batcher.stats()["items"],
+)
+metrics_registry.counter_callback(
+    "parasite_cache_hits_total", "Result cache hits by kind and tier",
+    lambda: {
+        **{(kind, "memory"): n for kind, n in result_cache.stats()["hits"].items()},
+        **{(kind, "disk"): n for kind, n in result_cache.stats()["disk_hits"].items()},
+    },
+    ("kind", "tier"),
+)
+metrics_registry.counter_callback(
+    "parasite_cache_misses_total", "Result cache misses by kind",
+    lambda: result_cache.stats()["misses"], ("kind",),
+)
+metrics_registry.gauge_callback(
+    "parasite_cache_bytes", "Bytes held by the result cache",
+    lambda: {"memory": result_cache.stats()["bytes"], "disk": result_cache.stats()["disk_bytes"]},
+    ("tier",),
+)
+metrics_registry.counter_callback(
+    "parasite_cache_evictions_total", "Entries evicted from the in-memory cache",
+    lambda: result_cache.stats()["evictions"],
+)
+metrics_registry.gauge_callback(
+    "parasite_detection_store_entries", "Images with raw detections kept for re-thresholding",
+    lambda: detection_store.stats()["entries"],
+)
+metrics_registry.counter_callback(
+    "parasite_detection_store_lookups_total", "Detection store lookups by result",
+    lambda: {"hit": detection_store.stats()["hits"], "miss": detection_store.stats()["misses"]},
+    ("result",),
+)
+metrics_registry.gauge_callback(
+    "parasite_specimens", "Specimens and the fields attached to them",
+    lambda: {"specimens": specimen_store.stats()["specimens"], "fields": specimen_store.stats()["fields"]},
+    ("kind",),
+)
+metrics_registry.gauge_callback(
+    "parasite_stream_connections", "Live streams connected to /ws/stream", lambda: len(active_streams)
+)
+metrics_registry.gauge_callback(
+    "parasite_explainers", "Pooled GradCAM explainers by state",
+    lambda: {"busy": explainer_pool.stats()["busy"], "total": explainer_pool.stats()["size"]},
+    ("state",),
+)
+metrics_registry.gauge_callback(
+    "parasite_heatmap_jobs", "Heatmap jobs by status", lambda: heatmap_jobs.stats()["jobs"], ("status",),
+)
+batch_wait_seconds = metrics_registry.histogram(
+    "parasite_batch_wait_seconds", "Time /predict images wait for their micro-batch to be dispatched"
+)
+predict_batcher.on_batch_wait = batch_wait_seconds.observe
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics in the text exposition format"""
+    return PlainTextResponse(metrics_registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/profiler")
+def profiler_status(token: str = Depends(get_api_key)):
+    """Sampling profiler state and the slow requests captured so far"""
+    return {**profiler.stats(), "captures": profiler.captures()}
+
+
+@app.post("/debug/profiler/start")
+def start_profiler(
+    token: str = Depends(get_api_key),
+    interval_ms: float = None,
+    slow_ms: float = None,
+):
+    """
+    Start sampling; requests slower than slow_ms keep their samples as a capture
+
+    Parameters:
+    - interval_ms: Sampling interval in milliseconds
+    - slow_ms: Requests taking at least this long are captured
+    """
+    if interval_ms is not None and interval_ms <= 0:
+        raise HTTPException(status_code=400, detail="interval_ms must be positive")
+    profiler.start(interval_ms=interval_ms, slow_ms=slow_ms)
+    return profiler.stats()
+
+
+@app.post("/debug/profiler/stop")
+def stop_profiler(token: str = Depends(get_api_key)):
+    """Stop sampling; existing captures are kept"""
+    profiler.stop()
+    return profiler.stats()
+
+
+@app.get("/debug/profiler/captures/{capture_id}", response_class=PlainTextResponse)
+def profiler_capture(capture_id: int, token: str = Depends(get_api_key)):
+    """Collapsed stacks of a slow request, for flamegraph.pl or speedscope"""
+    folded = profiler.folded(capture_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired capture id")
+    return PlainTextResponse(folded)
+
+
+startup_timer.add("import", time.perf_counter() - _import_started)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+"""
+Dynamic micro-batching for detector forward passes.
+
+Concurrent requests are collected for up to ``max_batch_size`` images or
+``max_wait_ms`` milliseconds, whichever comes first, and handed to
+``run_batch`` as one list. While a batch is running, new requests queue up and
+form the next batch, so under load batches fill up on their own and when idle
+a lone request only waits ``max_wait_ms``.
+"""
+import asyncio
+import contextvars
+import time
+from collections import Counter
+
+from timing import record
+
+
+class MicroBatcher:
+    """Collects submitted items into batches for an async ``run_batch`` callable."""
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self._run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = None
+        self._task = None
+        self._histogram = Counter()
+        self._items = 0
+        # Called with every item's wait for its batch in seconds
+        self.on_batch_wait = None
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            # A fresh context, so the loop doesn't inherit the first caller's request state
+            self._task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, item):
+        """Queue ``item`` for the next batch and wait for its own result."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        future.dispatched = None
+        submitted = time.monotonic()
+        await self._queue.put((item, future))
+        result = await future
+        if future.dispatched is not None:
+            wait = future.dispatched - submitted
+            record("batch_wait", wait)
+            if self.on_batch_wait is not None:
+                self.on_batch_wait(wait)
+        return result
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Callers that gave up while waiting don't need a forward pass
+        return [(item, future) for item, future in batch if not future.cancelled()]
+
+    async def _loop(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            self._histogram[len(batch)] += 1
+            self._items += len(batch)
+            dispatched = time.monotonic()
+            for _, future in batch:
+                future.dispatched = dispatched
+            try:
+                results = await self._run_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        batches = sum(self._histogram.values())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "items": self._items,
+            "mean_batch_size": round(self._items / batches, 3) if batches else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self._histogram.items())},
+        }
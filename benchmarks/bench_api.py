@@ -0,0 +1,321 @@
+"""
+Latency/throughput benchmark for the Parasite Detection API.
+
+Drives the FastAPI app either in-process (ASGI transport, no sockets) or over
+loopback (a real uvicorn server on 127.0.0.1) at a configurable concurrency,
+using the sample images in ``data/`` plus synthetic high-resolution images.
+Reports p50/p95/p99 latency, images per second, peak RSS and the per-stage
+breakdown from the ``Server-Timing`` header, and writes everything to JSON.
+
+Usage:
+    python benchmarks/bench_api.py --output bench.json
+    python benchmarks/bench_api.py --endpoints predict --concurrency 1 4 8
+    python benchmarks/bench_api.py --output new.json --compare bench.json --threshold 0.10
+
+The result cache and the detection store are disabled for the run, so every
+request reaches the model.
+"""
+import argparse
+import asyncio
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Lower is better for everything except throughput
+HIGHER_IS_BETTER = ("images_per_second",)
+COMPARED_METRICS = ("p50_ms", "p95_ms", "p99_ms", "images_per_second", "peak_rss_mb")
+
+
+def _percentiles(values):
+    import numpy as np
+
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "mean_ms": round(float(np.mean(values)), 2),
+    }
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def load_images(synthetic_sizes, seed=0):
+    """Sample images from data/ plus deterministic synthetic high-resolution JPEGs."""
+    import numpy as np
+    from PIL import Image
+
+    images = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "data", "*.jpg"))):
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read()))
+
+    rng = np.random.default_rng(seed)
+    for width, height in synthetic_sizes:
+        # Smooth background with a few dark elliptical "eggs" so JPEG sizes are realistic
+        yy, xx = np.mgrid[0:height, 0:width]
+        background = 180 + 30 * np.sin(xx / 97.0) * np.cos(yy / 131.0)
+        canvas = np.repeat(background[..., None], 3, axis=2)
+        for _ in range(12):
+            cx, cy = rng.integers(0, width), rng.integers(0, height)
+            rx, ry = rng.integers(15, 60), rng.integers(10, 40)
+            mask = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1
+            canvas[mask] = rng.integers(60, 120, size=3)
+        canvas += rng.normal(0, 6, canvas.shape)
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(canvas, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=90)
+        images.append((f"synthetic_{width}x{height}.jpg", buffer.getvalue()))
+    return images
+
+
+async def _drive(client, endpoint, params, images, concurrency, total_requests):
+    from backend import API_KEY, API_KEY_NAME
+    from timing import parse_server_timing
+
+    latencies = []
+    stages = {}
+    statuses = {}
+    counter = iter(range(total_requests))
+
+    async def worker():
+        for i in counter:
+            name, contents = images[i % len(images)]
+            started = time.perf_counter()
+            response = await client.post(
+                f"/{endpoint}",
+                headers={API_KEY_NAME: API_KEY},
+                files={"file": (name, contents)},
+                params=params,
+            )
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code != 200:
+                continue
+            latencies.append(elapsed_ms)
+            for stage, ms in parse_server_timing(response.headers.get("server-timing")).items():
+                stages.setdefault(stage, []).append(ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return latencies, stages, statuses, elapsed
+
+
+async def run_scenario(client, endpoint, params, images, concurrency, total_requests, warmup):
+    if warmup:
+        await _drive(client, endpoint, params, images, 1, warmup)
+    latencies, stages, statuses, elapsed = await _drive(
+        client, endpoint, params, images, concurrency, total_requests
+    )
+    return {
+        "endpoint": endpoint,
+        "params": params,
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+        **_percentiles(latencies),
+        "images_per_second": round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": {stage: _percentiles(values) for stage, values in sorted(stages.items())},
+    }
+
+
+async def wait_ready(client, timeout):
+    """Poll /health/ready until startup and warm-up have finished; returns the startup report."""
+    deadline = time.monotonic() + timeout
+    while True:
+        response = await client.get("/health/ready")
+        if response.status_code == 200:
+            return response.json()
+        if response.json().get("status") in ("failed", "degraded") or time.monotonic() > deadline:
+            raise RuntimeError(f"API did not become ready: {response.json()}")
+        await asyncio.sleep(0.1)
+
+
+class _LoopbackServer:
+    """uvicorn serving the app on a free loopback port in a background thread."""
+
+    def __init__(self, app):
+        import uvicorn
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+async def run_benchmarks(args):
+    import httpx
+
+    import backend
+
+    images = load_images(args.synthetic_sizes)
+    scenarios = []
+    for endpoint in args.endpoints:
+        params = {"response_format": args.response_format} if endpoint == "predict" else {}
+        requests = args.heatmap_requests if endpoint == "generate_heatmap" else args.requests
+        for concurrency in args.concurrency:
+            scenarios.append((endpoint, params, concurrency, requests))
+
+    results = {}
+    timeout = httpx.Timeout(args.timeout)
+    if args.mode == "inprocess":
+        async with backend.app.router.lifespan_context(backend.app):
+            transport = httpx.ASGITransport(app=backend.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+                startup = await wait_ready(client, args.timeout)
+                for endpoint, params, concurrency, requests in scenarios:
+                    key = f"{args.mode}:{endpoint}:c{concurrency}"
+                    print(f"running {key} ...", file=sys.stderr)
+                    results[key] = await run_scenario(
+                        client, endpoint, params, images, concurrency, requests, args.warmup
+                    )
+    else:
+        with _LoopbackServer(backend.app) as base_url:
+            async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+                startup = await wait_ready(client, args.timeout)
+                for endpoint, params, concurrency, requests in scenarios:
+                    key = f"{args.mode}:{endpoint}:c{concurrency}"
+                    print(f"running {key} ...", file=sys.stderr)
+                    results[key] = await run_scenario(
+                        client, endpoint, params, images, concurrency, requests, args.warmup
+                    )
+    return results, [name for name, _ in images], startup
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Return a list of regressions worse than ``threshold`` (a ratio, e.g. 0.1 = 10%)."""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get("results", {}).get(key)
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                change = (old - new) / old
+            else:
+                change = (new - old) / old
+            if change > threshold:
+                regressions.append({
+                    "scenario": key,
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": round(change, 4),
+                })
+    return regressions
+
+
+def _parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("inprocess", "loopback"), default="inprocess")
+    parser.add_argument("--endpoints", nargs="+", default=["predict", "generate_heatmap"],
+                        choices=("predict", "generate_heatmap"))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--requests", type=int, default=40, help="requests per /predict scenario")
+    parser.add_argument("--heatmap-requests", type=int, default=8, help="requests per /generate_heatmap scenario")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--response-format", default="base64", choices=("base64", "detections"))
+    parser.add_argument("--synthetic-sizes", nargs="*", type=_parse_size, default=[(2048, 1536), (4096, 3072)],
+                        help="synthetic image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed regression ratio")
+    args = parser.parse_args(argv)
+
+    # Every request must reach the model, and relative model paths resolve from the repo root
+    os.environ["PARASITE_CACHE_MAX_BYTES"] = "0"
+    os.environ["PARASITE_CACHE_DISK_DIR"] = ""
+    # Repeated images would otherwise only be re-filtered from stored detections
+    os.environ["PARASITE_DETECTION_STORE_MAX_ENTRIES"] = "0"
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    results, image_names, startup = asyncio.run(run_benchmarks(args))
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mode": args.mode,
+            "images": image_names,
+            "startup_ms": startup["phases_ms"],
+            "config": {k: v for k, v in sorted(os.environ.items()) if k.startswith("PARASITE_")},
+        },
+        "results": results,
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(results, baseline, args.threshold)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+    if report.get("regressions"):
+        for r in report["regressions"]:
+            print(
+                f"REGRESSION {r['scenario']} {r['metric']}: {r['baseline']} -> {r['current']} "
+                f"({r['change']:+.1%})",
+                file=sys.stderr,
+            )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
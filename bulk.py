@@ -0,0 +1,93 @@
+"""
+Helpers for bulk ingestion through ``/predict_batch``.
+
+Uploads may be individual images or zip/tar archives of images; archives are
+read member by member so a large archive is never extracted into memory at
+once. ``SpecimenAggregate`` accumulates per-image detections into the
+per-specimen summary sent as the final NDJSON line.
+"""
+import os
+import tarfile
+import zipfile
+from collections import Counter
+
+from tiling import concatenate
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def _is_image_name(name):
+    base = os.path.basename(name)
+    return not base.startswith(".") and base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _is_zip(fileobj):
+    position = fileobj.tell()
+    try:
+        return zipfile.is_zipfile(fileobj)
+    finally:
+        fileobj.seek(position)
+
+
+def _is_tar(filename):
+    return filename.lower().endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz"))
+
+
+def _file_size(fileobj):
+    position = fileobj.tell()
+    try:
+        return fileobj.seek(0, os.SEEK_END)
+    finally:
+        fileobj.seek(position)
+
+
+def _within(size, max_bytes):
+    return not max_bytes or size <= max_bytes
+
+
+def iter_upload_images(filename, fileobj, max_bytes=0):
+    """
+    Yield ``(name, bytes)`` for an uploaded image or for each image inside an archive.
+
+    Images larger than ``max_bytes`` (if > 0) are yielded as ``(name, None)``
+    without being read; their size is known from the file or archive entry.
+    """
+    filename = filename or "upload"
+    if _is_zip(fileobj):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_image_name(info.filename):
+                    # zipfile stops reading an entry that inflates past its declared size
+                    contents = archive.read(info) if _within(info.file_size, max_bytes) else None
+                    yield f"{filename}/{info.filename}", contents
+    elif _is_tar(filename):
+        with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+            for member in archive:
+                if member.isfile() and _is_image_name(member.name):
+                    contents = archive.extractfile(member).read() if _within(member.size, max_bytes) else None
+                    yield f"{filename}/{member.name}", contents
+    else:
+        yield filename, fileobj.read() if _within(_file_size(fileobj), max_bytes) else None
+
+
+class SpecimenAggregate:
+    """Running per-specimen totals over many images."""
+
+    def __init__(self):
+        self.images = 0
+        self.failed = 0
+        self.species_counts = Counter()
+        self._detections = []
+
+    def add(self, detections, species_names):
+        self.images += 1
+        self.species_counts.update(species_names)
+        self._detections.append(detections)
+
+    def add_failure(self):
+        self.failed += 1
+
+    def combined(self):
+        """All detections of the specimen as one ``Detections``."""
+        return concatenate(self._detections)
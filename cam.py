@@ -0,0 +1,141 @@
+"""
+Detection and Grad-CAM from a single forward pass.
+
+``yolov8_heatmap`` runs the model twice per image: once inside the CAM method
+(forward and backward) and again for NMS. A heatmap request after ``/predict``
+adds a third pass on the detector. ``detect_and_explain`` runs one forward
+pass of the explainer's PyTorch model on one letterboxed tensor. The
+explainer's hooks on the target layers record the activations, NMS on the raw
+output gives the detections, and a single backward pass from the class
+scores of the kept boxes gives the gradients.
+
+The CAM is therefore driven only by the boxes that are returned. With
+``scope="boxes"`` it is also normalised inside each box and zero elsewhere,
+as in ``renormalize_cam_in_bounding_boxes``. The CAM is kept at letterbox
+resolution and is only resized once, to the requested heatmap size, when it
+is overlaid.
+"""
+import numpy as np
+
+from detections import Detections
+
+
+CAM_SCOPES = ("boxes", "image")
+
+
+class CamResult:
+    """Detections in input-array coordinates and a CAM covering the whole input."""
+
+    __slots__ = ("detections", "cam")
+
+    def __init__(self, detections, cam):
+        self.detections = detections
+        self.cam = cam
+
+
+def _scale(cam):
+    cam = cam - cam.min()
+    return cam / (cam.max() + 1e-7)
+
+
+def _grad_cam(activations, gradients, size):
+    """Grad-CAM per layer, resized to ``size`` (w, h), ReLU'd, scaled and averaged as pytorch_grad_cam does."""
+    import cv2
+
+    cams = []
+    for acts, grads in zip(activations, gradients):
+        acts, grads = acts.numpy()[0], grads.numpy()[0]
+        weights = grads.mean(axis=(1, 2))
+        cam = np.maximum((weights[:, None, None] * acts).sum(axis=0), 0)
+        cams.append(cv2.resize(_scale(cam).astype(np.float32), size))
+    return _scale(np.mean(cams, axis=0)).astype(np.float32)
+
+
+def _restrict_to_boxes(cam, boxes):
+    """Normalise the CAM inside every box and zero it outside."""
+    height, width = cam.shape
+    restricted = np.zeros_like(cam)
+    for x1, y1, x2, y2 in np.round(boxes).astype(int):
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, width), min(y2, height)
+        if x2 > x1 and y2 > y1:
+            restricted[y1:y2, x1:x2] = np.maximum(restricted[y1:y2, x1:x2], _scale(cam[y1:y2, x1:x2]))
+    return _scale(restricted)
+
+
+def detect_and_explain(explainer, img_array, conf_threshold=0.25, iou_threshold=0.7,
+                       max_det=300, imgsz=640, scope="boxes"):
+    """
+    Detect on ``img_array`` and compute the Grad-CAM of the detections in one pass.
+
+    ``explainer`` is a pooled ``yolov8_heatmap`` (its model and layer hooks
+    are reused). Returns a ``CamResult``. The CAM covers the letterboxed
+    image without its padding, so it has the aspect ratio of ``img_array``.
+    """
+    import torch
+    import torchvision
+    from ultralytics.utils.ops import xywh2xyxy
+    from YOLOv8_Explainer.utils import letterbox
+
+    if scope not in CAM_SCOPES:
+        raise ValueError(f"scope must be one of {CAM_SCOPES}")
+    height, width = img_array.shape[:2]
+    letterboxed, (ratio, _), (pad_w, pad_h) = letterbox(np.ascontiguousarray(img_array), new_shape=imgsz)
+    tensor = torch.from_numpy(np.transpose(np.float32(letterboxed) / 255.0, (2, 0, 1))).unsqueeze(0)
+    tensor = tensor.to(explainer.device)
+
+    hooks = explainer.method.activations_and_grads
+    hooks.activations, hooks.gradients = [], []
+    explainer.model.zero_grad(set_to_none=True)
+    try:
+        with torch.enable_grad():
+            # (4 box + per-class score rows, anchors)
+            prediction = explainer.model(tensor)[0][0]
+            scores, class_ids = prediction[4:].max(0)
+            candidates = torch.nonzero(scores.detach() >= conf_threshold).flatten()
+            boxes = xywh2xyxy(prediction[:4, candidates].detach().T)
+            keep = torchvision.ops.batched_nms(
+                boxes, scores[candidates].detach(), class_ids[candidates], iou_threshold
+            )[:max_det]
+            anchors = candidates[keep]
+            boxes = boxes[keep].cpu().numpy()
+            confidences = scores[anchors].detach().cpu().numpy()
+            kept_classes = class_ids[anchors].cpu().numpy()
+            lb_height, lb_width = tensor.shape[-2:]
+            if len(anchors):
+                # Gradients of the returned boxes' scores only
+                scores[anchors].sum().backward()
+                cam = _grad_cam(hooks.activations, hooks.gradients, (lb_width, lb_height))
+            else:
+                cam = np.zeros((lb_height, lb_width), dtype=np.float32)
+    finally:
+        hooks.activations, hooks.gradients = [], []
+        explainer.model.zero_grad(set_to_none=True)
+
+    if scope == "boxes":
+        cam = _restrict_to_boxes(cam, boxes)
+    # Drop the letterbox padding, then map boxes back to img_array pixels
+    top, left = int(round(pad_h - 0.1)), int(round(pad_w - 0.1))
+    cam = _scale(cam[top:top + int(round(height * ratio)), left:left + int(round(width * ratio))])
+    boxes = (boxes - np.array([pad_w, pad_h, pad_w, pad_h], dtype=np.float32)) / ratio
+    boxes = np.clip(boxes, 0, [width, height, width, height])
+    return CamResult(Detections(boxes, confidences, kept_classes), cam)
+
+
+def overlay(img_array, cam, max_size=640):
+    """
+    Heatmap over the image, with the longest side at most ``max_size`` (0 keeps the size).
+
+    Returns ``(overlay, (sx, sy))``; multiply ``img_array`` coordinates by ``(sx, sy)`` to place boxes on it.
+    """
+    import cv2
+    from pytorch_grad_cam.utils.image import show_cam_on_image
+
+    height, width = img_array.shape[:2]
+    factor = min(1.0, max_size / max(width, height)) if max_size else 1.0
+    size = (max(1, round(width * factor)), max(1, round(height * factor)))
+    if size != (width, height):
+        img_array = cv2.resize(np.ascontiguousarray(img_array), size, interpolation=cv2.INTER_AREA)
+    cam = cv2.resize(cam, size, interpolation=cv2.INTER_LINEAR)
+    image = show_cam_on_image(np.float32(img_array) / 255.0, cam, use_rgb=True)
+    return image, (size[0] / width, size[1] / height)
@@ -0,0 +1,137 @@
+"""
+Runtime settings for the Parasite Detection API.
+
+Every value can be overridden with an environment variable of the same name
+prefixed with ``PARASITE_`` (e.g. ``PARASITE_EXPLAINER_POOL_SIZE=4``).
+"""
+import os
+
+
+def _env_str(name, default):
+    return os.environ.get(f"PARASITE_{name}", default)
+
+
+def _env_int(name, default):
+    value = os.environ.get(f"PARASITE_{name}")
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(f"PARASITE_{name}")
+    return float(value) if value not in (None, "") else default
+
+
+def _env_bool(name, default):
+    value = os.environ.get(f"PARASITE_{name}")
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Model weights (used by the detector and the GradCAM explainer)
+MODEL_WEIGHTS = _env_str("MODEL_WEIGHTS", "models/best.pt")
+
+# Detector runtime: "auto", "pytorch" or "openvino"
+MODEL_BACKEND = _env_str("MODEL_BACKEND", "auto")
+OPENVINO_MODEL_DIR = _env_str("OPENVINO_MODEL_DIR", "models/best_int8_openvino_model")
+
+# GradCAM explainer pool
+EXPLAINER_POOL_SIZE = _env_int("EXPLAINER_POOL_SIZE", 2)
+EXPLAINER_IDLE_TTL = _env_float("EXPLAINER_IDLE_TTL", 600.0)
+EXPLAINER_ACQUIRE_TIMEOUT = _env_float("EXPLAINER_ACQUIRE_TIMEOUT", 60.0)
+EXPLAINER_PRELOAD = _env_bool("EXPLAINER_PRELOAD", True)
+
+# Inference executor ("thread" or "process")
+INFERENCE_EXECUTOR = _env_str("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = _env_int("INFERENCE_WORKERS", 2)
+INFERENCE_QUEUE_SIZE = _env_int("INFERENCE_QUEUE_SIZE", 16)
+PREDICT_MAX_IN_FLIGHT = _env_int("PREDICT_MAX_IN_FLIGHT", 16)
+HEATMAP_MAX_IN_FLIGHT = _env_int("HEATMAP_MAX_IN_FLIGHT", 2)
+# Process executor only: torch threads per worker (0 divides the cores evenly) and
+# how long one task may run before its worker is killed and restarted (0 disables)
+WORKER_THREADS = _env_int("WORKER_THREADS", 0)
+WORKER_TASK_TIMEOUT = _env_float("WORKER_TASK_TIMEOUT", 300.0)
+
+# Dynamic micro-batching for /predict
+# 0 uses the imgsz the loaded artifact was trained or exported with
+MODEL_IMGSZ = _env_int("MODEL_IMGSZ", 0)
+BATCH_MAX_SIZE = _env_int("BATCH_MAX_SIZE", 8)
+BATCH_MAX_WAIT_MS = _env_float("BATCH_MAX_WAIT_MS", 10.0)
+
+# Content-addressed result cache (an empty CACHE_DISK_DIR disables the disk tier)
+CACHE_MAX_BYTES = _env_int("CACHE_MAX_BYTES", 256 * 1024 * 1024)
+CACHE_DISK_DIR = _env_str("CACHE_DISK_DIR", "")
+CACHE_DISK_MAX_BYTES = _env_int("CACHE_DISK_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+# Raw uploads (for image_hash reuse) stay in memory unless this writes them to disk too
+CACHE_DISK_UPLOADS = _env_bool("CACHE_DISK_UPLOADS", False)
+
+# Raw detections kept per image so other thresholds are a filter, not a forward pass.
+# Inference runs at min(requested threshold, DETECTION_CONF_FLOOR)
+DETECTION_CONF_FLOOR = _env_float("DETECTION_CONF_FLOOR", 0.1)
+DETECTION_STORE_MAX_ENTRIES = _env_int("DETECTION_STORE_MAX_ENTRIES", 4096)
+DETECTION_STORE_TTL = _env_float("DETECTION_STORE_TTL", 3600.0)
+
+# Tiled inference for high-resolution images ("nms" or "wbf" merging across seams)
+TILE_SIZE = _env_int("TILE_SIZE", 640)
+TILE_OVERLAP = _env_float("TILE_OVERLAP", 0.2)
+TILE_BATCH_SIZE = _env_int("TILE_BATCH_SIZE", 4)
+TILE_PARALLELISM = _env_int("TILE_PARALLELISM", 2)
+TILE_MERGE_METHOD = _env_str("TILE_MERGE_METHOD", "nms")
+TILE_MERGE_THRESHOLD = _env_float("TILE_MERGE_THRESHOLD", 0.6)
+
+# Cascade inference (/predict?cascade=true): a coarse pass at CASCADE_COARSE_IMGSZ, then
+# native-resolution regions around detections in [UNCERTAIN_MIN, UNCERTAIN_MAX) are re-run.
+# More uncertain regions than CASCADE_MAX_REGIONS re-run the whole image as tiles instead
+CASCADE_COARSE_IMGSZ = _env_int("CASCADE_COARSE_IMGSZ", 320)
+CASCADE_UNCERTAIN_MIN = _env_float("CASCADE_UNCERTAIN_MIN", 0.25)
+CASCADE_UNCERTAIN_MAX = _env_float("CASCADE_UNCERTAIN_MAX", 0.5)
+CASCADE_REGION_SIZE = _env_int("CASCADE_REGION_SIZE", 640)
+CASCADE_MAX_REGIONS = _env_int("CASCADE_MAX_REGIONS", 8)
+
+# Bulk ingestion through /predict_batch
+BULK_MAX_REQUESTS = _env_int("BULK_MAX_REQUESTS", 2)
+BULK_DECODE_AHEAD = _env_int("BULK_DECODE_AHEAD", 8)
+BULK_MAX_IN_FLIGHT = _env_int("BULK_MAX_IN_FLIGHT", 16)
+
+# Live camera stream over WebSocket (/ws/stream) and its frame-to-frame tracker
+STREAM_MAX_CONNECTIONS = _env_int("STREAM_MAX_CONNECTIONS", 4)
+TRACK_IOU_THRESHOLD = _env_float("TRACK_IOU_THRESHOLD", 0.3)
+TRACK_MAX_MISSED = _env_int("TRACK_MAX_MISSED", 10)
+TRACK_MIN_HITS = _env_int("TRACK_MIN_HITS", 3)
+
+# Background heatmap jobs (JOB_DB_PATH may be a SQLite file to keep jobs across restarts)
+JOB_DB_PATH = _env_str("JOB_DB_PATH", ":memory:")
+JOB_WORKERS = _env_int("JOB_WORKERS", 1)
+JOB_MAX_QUEUED = _env_int("JOB_MAX_QUEUED", 64)
+JOB_RESULT_TTL = _env_float("JOB_RESULT_TTL", 3600.0)
+JOB_EVENTS_POLL_INTERVAL = _env_float("JOB_EVENTS_POLL_INTERVAL", 0.25)
+
+# Specimens aggregating detections over many fields (a file keeps them across restarts)
+SPECIMEN_DB_PATH = _env_str("SPECIMEN_DB_PATH", ":memory:")
+
+# Sampling profiler for slow requests (can also be started at runtime via /debug/profiler)
+PROFILER_ENABLED = _env_bool("PROFILER_ENABLED", False)
+PROFILER_INTERVAL_MS = _env_float("PROFILER_INTERVAL_MS", 10.0)
+PROFILER_SLOW_MS = _env_float("PROFILER_SLOW_MS", 1000.0)
+PROFILER_MAX_CAPTURES = _env_int("PROFILER_MAX_CAPTURES", 20)
+
+# Uploads with more pixels than this are rejected with 413 before they are decoded
+MAX_IMAGE_PIXELS = _env_int("MAX_IMAGE_PIXELS", 100_000_000)
+# Upload limits: bytes per image, bytes per /predict_batch request, and upload
+# requests one client may have in flight (0 disables a limit). Clients are told
+# apart by CLIENT_ID_HEADER, e.g. X-Forwarded-For behind a proxy, or by address
+UPLOAD_MAX_BYTES = _env_int("UPLOAD_MAX_BYTES", 128 * 1024 * 1024)
+BULK_MAX_REQUEST_BYTES = _env_int("BULK_MAX_REQUEST_BYTES", 2 * 1024 * 1024 * 1024)
+CLIENT_ID_HEADER = _env_str("CLIENT_ID_HEADER", "")
+# Off by default without a client header: behind a proxy or the Streamlit app
+# every request shares one address, so a per-address limit would throttle everyone
+CLIENT_MAX_UPLOADS = _env_int("CLIENT_MAX_UPLOADS", 4 if CLIENT_ID_HEADER else 0)
+
+# Startup: load and warm up in the background so /health/live answers at once and
+# /health/ready only turns 200 when the first requests won't pay for warm-up
+STARTUP_BACKGROUND = _env_bool("STARTUP_BACKGROUND", True)
+WARMUP_ENABLED = _env_bool("WARMUP_ENABLED", True)
+# 0 warms up at BATCH_MAX_SIZE (capped by the model's batch limit)
+WARMUP_BATCH_SIZE = _env_int("WARMUP_BATCH_SIZE", 0)
+WARMUP_ITERATIONS = _env_int("WARMUP_ITERATIONS", 2)
+WARMUP_HEATMAP = _env_bool("WARMUP_HEATMAP", False)
@@ -0,0 +1,152 @@
+"""
+Shared image decode stage for every endpoint.
+
+Uploads are decoded once into a read-only, C-contiguous RGB ``uint8`` array
+that is handed as-is to the detector, the renderer and the GradCAM explainer:
+
+- the pixel count is checked from the header, before any pixel data is
+  decoded, so oversized uploads are rejected cheaply;
+- when the caller only needs about ``min_size`` pixels on the longest side
+  (the model letterboxes to 640 anyway), JPEGs use libjpeg's scaled DCT
+  decoding (``Image.draft``) and never materialise the full resolution;
+- EXIF orientation is applied, and RGBA/LA/palette (composited on white),
+  grayscale, CMYK and 16-bit/float images are normalised to 8-bit RGB.
+
+``DecodedImage.scale`` maps coordinates on the (possibly reduced) array back to
+the original, orientation-corrected image.
+"""
+import io
+import math
+import warnings
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+_ORIENTATION_TAG = 0x0112
+# EXIF orientations that rotate by 90 degrees and so swap width and height
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an upload has more pixels than allowed."""
+
+    status_code = 413
+    reason = "pixels"
+
+
+class UndecodableImage(ValueError):
+    """Raised when an upload is not an image Pillow can decode, or is corrupt or truncated."""
+
+    status_code = 422
+    reason = "undecodable"
+
+
+class DecodedImage:
+    """An RGB array plus the size of the image it was decoded from."""
+
+    __slots__ = ("array", "original_size")
+
+    def __init__(self, array, original_size):
+        self.array = array
+        self.original_size = original_size
+
+    @property
+    def size(self):
+        height, width = self.array.shape[:2]
+        return width, height
+
+    @property
+    def scale(self):
+        """``(sx, sy)`` from array coordinates to original image coordinates."""
+        width, height = self.size
+        return self.original_size[0] / width, self.original_size[1] / height
+
+    @property
+    def reduced(self):
+        return self.size != tuple(self.original_size)
+
+
+def _open(contents, max_pixels):
+    with warnings.catch_warnings():
+        # Our own limit below replaces Pillow's decompression bomb warning
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        try:
+            image = Image.open(io.BytesIO(contents))
+        except Image.DecompressionBombError as e:
+            raise ImageTooLarge(f"Image too large: {str(e)}")
+        except (OSError, SyntaxError):
+            # Pillow's message here names its BytesIO buffer, which tells the client nothing
+            raise UndecodableImage("Not a supported image file")
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"Image too large: {width}x{height} pixels, the limit is {max_pixels} pixels")
+    return image
+
+
+def _orientation(image):
+    return image.getexif().get(_ORIENTATION_TAG, 1)
+
+
+def _request_draft(image, min_size):
+    # libjpeg can decode at 1/2, 1/4 or 1/8 scale; draft picks the smallest
+    # scale that still covers the requested size
+    width, height = image.size
+    factor = min_size / max(width, height)
+    if factor < 1:
+        image.draft("RGB", (math.ceil(width * factor), math.ceil(height * factor)))
+
+
+def _to_uint8(image):
+    """8-bit array for 16-bit and 32-bit integer or float single-channel images."""
+    array = np.asarray(image)
+    if image.mode.startswith("I;16"):
+        return (array >> 8).astype(np.uint8)
+    peak = float(array.max()) if array.size else 0.0
+    if image.mode == "F" and peak <= 1.0:
+        array = array * 255.0
+    elif peak > 255:
+        array = array / 257.0
+    return np.clip(array, 0, 255).astype(np.uint8)
+
+
+def _to_rgb_array(image):
+    if image.mode in ("I", "I;16", "I;16B", "I;16L", "I;16N", "F"):
+        gray = _to_uint8(image)
+        return np.ascontiguousarray(np.repeat(gray[..., None], 3, axis=2))
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        # Transparent regions become a white slide background instead of black
+        rgba = image.convert("RGBA")
+        background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, rgba)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image)
+
+
+def decode_image(contents, min_size=0, max_pixels=0):
+    """
+    Decode upload bytes to a ``DecodedImage``.
+
+    ``min_size`` > 0 allows decoding at a reduced resolution whose longest side
+    is still at least ``min_size``; ``max_pixels`` > 0 rejects larger images
+    with ``ImageTooLarge`` before they are decoded. Corrupt or truncated data
+    raises ``UndecodableImage``.
+    """
+    image = _open(contents, max_pixels)
+    try:
+        orientation = _orientation(image)
+        width, height = image.size
+        original_size = (height, width) if orientation in _TRANSPOSED_ORIENTATIONS else (width, height)
+        if min_size and image.format == "JPEG":
+            _request_draft(image, min_size)
+        if orientation != 1:
+            # exif_transpose copies the image, so only call it when there is something to do
+            image = ImageOps.exif_transpose(image)
+        array = _to_rgb_array(image)
+    except (OSError, SyntaxError) as e:
+        # Pillow reports bad pixel data as either, often only once it decodes
+        raise UndecodableImage(f"Could not decode image: {str(e)}")
+    # Shared by inference, rendering and CAM, so nobody may modify it in place
+    array.setflags(write=False)
+    return DecodedImage(array, original_size)
@@ -0,0 +1,120 @@
+"""
+Raw detections per image, for re-thresholding without re-inference.
+
+Inference runs once per image at a low confidence floor. The unfiltered
+boxes, confidences and class ids are kept here, keyed by image hash and
+detection mode, in original image coordinates. Any threshold at or above the
+floor is then a single vectorised mask over the stored arrays
+(``Detections.filter``) instead of another forward pass.
+
+Raising the threshold never changes which boxes survive NMS, because a
+lower-scored box can't suppress a higher-scored one. The only difference is
+the model's ``max_det`` cap, which now counts boxes down to the floor.
+
+Entries expire ``ttl`` seconds after they were stored. The store is bounded by
+``max_entries`` and evicts the least recently used entry first. Like the
+result cache, it is scoped to a namespace (the loaded model), and entries from
+another namespace are dropped.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+class StoredDetections:
+    """Unfiltered detections of one image and the confidence floor they were run at."""
+
+    __slots__ = ("detections", "original_size", "floor", "stored_at")
+
+    def __init__(self, detections, original_size, floor):
+        self.detections = detections
+        self.original_size = tuple(original_size)
+        self.floor = floor
+        self.stored_at = time.monotonic()
+
+    @property
+    def nbytes(self):
+        d = self.detections
+        return d.boxes.nbytes + d.confidences.nbytes + d.class_ids.nbytes
+
+
+class DetectionStore:
+    """LRU of ``StoredDetections`` keyed by ``(image_hash, tiled)`` with TTL expiry."""
+
+    def __init__(self, max_entries=4096, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counts = Counter()
+        self._last_purge = time.monotonic()
+        self.namespace = ""
+
+    def set_namespace(self, namespace):
+        """Scope entries to ``namespace``, e.g. the identity of the loaded model."""
+        with self._lock:
+            if namespace == self.namespace:
+                return
+            # Detections of another model must not be re-filtered for this one
+            self._entries.clear()
+            self.namespace = namespace
+
+    def _expired(self, entry, now):
+        return self.ttl > 0 and now - entry.stored_at > self.ttl
+
+    def get(self, image_hash, tiled=False):
+        key = (image_hash, bool(tiled))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, time.monotonic()):
+                del self._entries[key]
+                self._counts["expired"] += 1
+                entry = None
+            if entry is None:
+                self._counts["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counts["hits"] += 1
+            return entry
+
+    def put(self, image_hash, detections, original_size, floor, tiled=False):
+        if self.max_entries <= 0:
+            return
+        key = (image_hash, bool(tiled))
+        entry = StoredDetections(detections, original_size, floor)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+            purge = time.monotonic() - self._last_purge > 60.0
+            if purge:
+                self._last_purge = time.monotonic()
+        if purge:
+            # Entries that are never read again would otherwise only leave through LRU eviction
+            self.purge_expired()
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+            for key in expired:
+                del self._entries[key]
+            self._counts["expired"] += len(expired)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            counts = dict(self._counts)
+        return {
+            "entries": len(entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "bytes": sum(entry.nbytes for entry in entries),
+            "hits": counts.get("hits", 0),
+            "misses": counts.get("misses", 0),
+            "evictions": counts.get("evictions", 0),
+            "expired": counts.get("expired", 0),
+        }
@@ -0,0 +1,63 @@
+"""
+Compact, framework-independent representation of detections for one image.
+
+Boxes, confidences and class ids are kept as flat numpy arrays, which are
+cheap to cache, pickle between processes and serialise in columnar form.
+"""
+import numpy as np
+
+
+class Detections:
+    """Boxes (``xyxy`` in original image pixels), confidences and class ids."""
+
+    __slots__ = ("boxes", "confidences", "class_ids")
+
+    def __init__(self, boxes, confidences, class_ids):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.confidences = np.asarray(confidences, dtype=np.float32).reshape(-1)
+        self.class_ids = np.asarray(class_ids, dtype=np.int32).reshape(-1)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0))
+
+    @classmethod
+    def from_result(cls, result):
+        """Convert an ultralytics ``Results`` object."""
+        boxes = result.boxes
+        return cls(
+            boxes.xyxy.cpu().numpy(),
+            boxes.conf.cpu().numpy(),
+            boxes.cls.cpu().numpy(),
+        )
+
+    @classmethod
+    def from_columnar(cls, payload):
+        return cls(payload["boxes"], payload["confidences"], payload["class_ids"])
+
+    def __len__(self):
+        return len(self.confidences)
+
+    def select(self, index):
+        return Detections(self.boxes[index], self.confidences[index], self.class_ids[index])
+
+    def filter(self, threshold):
+        """Keep only detections with confidence >= threshold."""
+        return self.select(self.confidences >= threshold)
+
+    def scaled(self, sx, sy):
+        """Boxes mapped to an image resized by ``sx`` horizontally and ``sy`` vertically."""
+        if sx == 1 and sy == 1:
+            return self
+        factors = np.array([sx, sy, sx, sy], dtype=np.float32)
+        return Detections(self.boxes * factors, self.confidences, self.class_ids)
+
+    def to_columnar(self, names):
+        """JSON-friendly columnar form: one list per attribute."""
+        present = np.unique(self.class_ids)
+        return {
+            "boxes": np.round(self.boxes, 1).tolist(),
+            "confidences": np.round(self.confidences, 4).tolist(),
+            "class_ids": self.class_ids.tolist(),
+            "class_names": {str(int(c)): names[int(c)] for c in present},
+        }
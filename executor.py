@@ -0,0 +1,258 @@
+"""
+Bounded executor for CPU-bound inference work.
+
+The API endpoints are ``async``, so running the model, plotting and image
+encoding directly in them stalls the whole event loop. Every CPU-bound stage
+goes through an ``InferenceExecutor`` instead. It admits at most
+``workers + queue_size`` jobs in total and a per-endpoint maximum in flight;
+anything beyond that is rejected immediately with ``Overloaded`` so the load
+balancer sees a 429/503 with ``Retry-After`` rather than a timeout.
+
+With ``kind="process"`` the stages run on a ``WorkerPool`` of forked worker
+processes that receive image arrays through shared memory.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+from timing import record
+from worker_pool import PoolNotStarted, WorkerCrashed, WorkerPool
+
+
+class Overloaded(Exception):
+    """Raised when a job cannot be admitted to the executor."""
+
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def _crashed(error):
+    return Overloaded(503, f"Inference worker failed: {str(error)}", 1)
+
+
+def _timed_call(fn, submitted, args, kwargs):
+    # Runs on the worker; monotonic clocks are shared with forked workers on Linux
+    queue_wait = time.monotonic() - submitted
+    return queue_wait, fn(*args, **kwargs)
+
+
+class InferenceExecutor:
+    """Thread or process pool with a bounded queue and per-endpoint limits."""
+
+    def __init__(self, kind="thread", workers=2, queue_size=8, endpoint_limits=None,
+                 threads_per_worker=0, task_timeout=0.0):
+        if kind == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        elif kind == "process":
+            # Forked on start(), so workers inherit the already loaded model
+            self._pool = WorkerPool(workers, threads_per_worker=threads_per_worker, task_timeout=task_timeout)
+        else:
+            raise ValueError(f"Unknown executor kind: {kind!r}")
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        self.endpoint_limits = dict(endpoint_limits or {})
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._per_endpoint = Counter()
+        self._rejected = Counter()
+        self._completed = 0
+        self._avg_service_time = 0.0
+        # Notified whenever a slot is released, for admit_waiting
+        self._slot_released = threading.Condition(self._lock)
+        # admit_waiting blocks on the condition here rather than on the event loop
+        self._waiters = ThreadPoolExecutor(thread_name_prefix="admission")
+        self._closed = False
+        # Called with every job's queue wait in seconds, e.g. to feed a histogram
+        self.on_queue_wait = None
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_size
+
+    def _retry_after(self):
+        # Rough time for the current backlog to drain, at least one second
+        backlog = self._in_flight / max(self.workers, 1)
+        return max(1, math.ceil(backlog * self._avg_service_time))
+
+    def _refusal(self, endpoint):
+        # Why endpoint can't be admitted right now, or None; call with the lock held
+        limit = self.endpoint_limits.get(endpoint)
+        if limit is not None and self._per_endpoint[endpoint] >= limit:
+            return Overloaded(
+                429,
+                f"Too many concurrent '{endpoint}' requests ({limit} in flight)",
+                self._retry_after(),
+            )
+        if self._in_flight >= self.capacity:
+            return Overloaded(
+                503,
+                "Inference queue is full",
+                self._retry_after(),
+            )
+        return None
+
+    def _admit(self, endpoint):
+        with self._lock:
+            refusal = self._refusal(endpoint)
+            if refusal is not None:
+                self._rejected[endpoint] += 1
+                raise refusal
+            self._in_flight += 1
+            self._per_endpoint[endpoint] += 1
+
+    def _admit_blocking(self, endpoint, abandoned):
+        # Runs on a waiter thread; False if the caller gave up or the executor shut down
+        with self._slot_released:
+            while not abandoned.is_set() and not self._closed and self._refusal(endpoint) is not None:
+                self._slot_released.wait()
+            if abandoned.is_set() or self._closed:
+                return False
+            self._in_flight += 1
+            self._per_endpoint[endpoint] += 1
+            return True
+
+    def _unadmit(self, endpoint):
+        # Gives back a slot that was taken for a caller who had already given up
+        with self._slot_released:
+            self._in_flight -= 1
+            self._per_endpoint[endpoint] -= 1
+            self._slot_released.notify_all()
+
+    def _release(self, endpoint, started):
+        elapsed = time.monotonic() - started
+        with self._slot_released:
+            self._in_flight -= 1
+            self._per_endpoint[endpoint] -= 1
+            self._completed += 1
+            # Exponential moving average of time spent queued and running
+            self._avg_service_time += 0.2 * (elapsed - self._avg_service_time)
+            self._slot_released.notify_all()
+
+    def _submit_admitted(self, endpoint, fn, args, kwargs):
+        self._admit(endpoint)
+        started = time.monotonic()
+        try:
+            future = self._submit(fn, args, kwargs)
+        except BaseException:
+            self._release(endpoint, started)
+            raise
+        # Release the slot when the work actually finishes, even if the
+        # caller has stopped waiting for it in the meantime
+        future.add_done_callback(lambda _: self._release(endpoint, started))
+        return future
+
+    async def run(self, endpoint, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on the pool, or raise ``Overloaded``."""
+        return await self._result(self._submit_admitted(endpoint, fn, args, kwargs))
+
+    def run_blocking(self, endpoint, fn, *args, **kwargs):
+        """``run`` for callers on their own thread (e.g. job workers); blocks until done."""
+        future = self._submit_admitted(endpoint, fn, args, kwargs)
+        try:
+            outcome = future.result()
+        except WorkerCrashed as e:
+            raise _crashed(e)
+        return self._finish(outcome)
+
+    @contextmanager
+    def admit(self, endpoint):
+        """
+        Reserve a slot for a request made of several stages.
+
+        Use ``call`` for the individual stages while the slot is held.
+        """
+        self._admit(endpoint)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(endpoint, started)
+
+    @asynccontextmanager
+    async def admit_waiting(self, endpoint):
+        """
+        ``admit`` for work that should wait for a slot instead of being
+        rejected, such as the individual images of a bulk request.
+        """
+        abandoned = threading.Event()
+        waiter = self._waiters.submit(self._admit_blocking, endpoint, abandoned)
+        try:
+            admitted = await asyncio.wrap_future(waiter)
+        except asyncio.CancelledError:
+            with self._slot_released:
+                abandoned.set()
+                self._slot_released.notify_all()
+            # The waiter may have taken the slot just before it saw the flag
+            waiter.add_done_callback(
+                lambda f: not f.cancelled() and f.result() and self._unadmit(endpoint)
+            )
+            raise
+        if not admitted:
+            raise Overloaded(503, "Inference executor is shutting down", 5)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(endpoint, started)
+
+    async def call(self, fn, *args, **kwargs):
+        """Run one stage of an already admitted request on the pool."""
+        return await self._result(self._submit(fn, args, kwargs))
+
+    def start(self):
+        """Start process workers; call after the model is loaded. No-op for threads."""
+        if self.kind == "process":
+            self._pool.start()
+
+    def _submit(self, fn, args, kwargs):
+        try:
+            return self._pool.submit(_timed_call, fn, time.monotonic(), args, kwargs)
+        except PoolNotStarted as e:
+            # Workers are forked by start() once startup has finished
+            raise Overloaded(503, str(e), 5)
+
+    async def _result(self, future):
+        try:
+            outcome = await asyncio.wrap_future(future)
+        except WorkerCrashed as e:
+            raise _crashed(e)
+        return self._finish(outcome)
+
+    def _finish(self, outcome):
+        queue_wait, result = outcome
+        # Shows up as a queue_wait stage in the request's Server-Timing
+        record("queue_wait", queue_wait)
+        if self.on_queue_wait is not None:
+            self.on_queue_wait(queue_wait)
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "kind": self.kind,
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "in_flight": self._in_flight,
+                "in_flight_per_endpoint": {k: v for k, v in self._per_endpoint.items() if v},
+                "rejected": dict(self._rejected),
+                "completed": self._completed,
+                "avg_service_time": round(self._avg_service_time, 4),
+            }
+        if self.kind == "process":
+            stats["worker_pool"] = self._pool.stats()
+        return stats
+
+    def shutdown(self, wait=True):
+        with self._slot_released:
+            self._closed = True
+            self._slot_released.notify_all()
+        self._waiters.shutdown(wait=wait, cancel_futures=True)
+        self._pool.shutdown(wait=wait, cancel_futures=True)
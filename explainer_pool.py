@@ -0,0 +1,215 @@
+"""
+Pool of long-lived GradCAM explainers.
+
+Building a ``yolov8_heatmap`` loads the weights and registers CAM hooks on the
+target layers, which is far more expensive than running it. The pool keeps
+instances alive between requests, keyed by ``(method, layers, show_box)``.
+Each instance is used by one request at a time so concurrent requests never
+share hook state, and instances idle for longer than ``idle_ttl`` are dropped
+to keep memory bounded.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ExplainerPoolTimeout(Exception):
+    """Raised when no explainer becomes available within the acquire timeout."""
+
+
+class _PooledExplainer:
+    def __init__(self, key, explainer):
+        self.key = key
+        self.explainer = explainer
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+def _default_factory(weight, method, layers, show_box, conf_threshold):
+    from YOLOv8_Explainer import yolov8_heatmap
+
+    return yolov8_heatmap(
+        weight=weight,
+        method=method,
+        conf_threshold=conf_threshold,
+        show_box=show_box,
+        layer=list(layers),
+    )
+
+
+def _release_hooks(explainer):
+    # pytorch_grad_cam keeps forward hooks on the target layers until released
+    method = getattr(explainer, "method", None)
+    activations_and_grads = getattr(method, "activations_and_grads", None)
+    if activations_and_grads is not None:
+        activations_and_grads.release()
+
+
+def explain_array(explainer, img_array):
+    """
+    ``yolov8_heatmap.process`` for an in-memory RGB array.
+
+    The library only accepts image paths and re-reads them with OpenCV; this
+    runs the same letterbox, CAM and box drawing on an already decoded array,
+    so no temporary file is written or decoded again. Returns a PIL image.
+    """
+    import numpy as np
+    import torch
+    from PIL import Image
+    from pytorch_grad_cam.utils.image import show_cam_on_image
+    from YOLOv8_Explainer.utils import letterbox
+
+    img = letterbox(np.ascontiguousarray(img_array))[0]
+    img = np.float32(img) / 255.0
+    tensor = torch.from_numpy(np.transpose(img, axes=[2, 0, 1])).unsqueeze(0).to(explainer.device)
+
+    grayscale_cam = explainer.method(tensor, [explainer.target])[0, :]
+    pred = explainer.post_process(explainer.model(tensor)[0])
+    if explainer.renormalize:
+        cam_image = explainer.renormalize_cam(
+            pred[:, :4].cpu().detach().numpy().astype(np.int32), img, grayscale_cam
+        )
+    else:
+        cam_image = show_cam_on_image(img, grayscale_cam, use_rgb=True)
+    if explainer.show_box:
+        for data in pred:
+            data = data.cpu().detach().numpy()
+            class_id = int(data[4:].argmax())
+            conf = min(float(data[4:].max()), 1)
+            cam_image = explainer.draw_detections(
+                data[:4], explainer.colors[class_id], f"{explainer.model_names[class_id]} {conf}", cam_image
+            )
+    return Image.fromarray(cam_image)
+
+
+class ExplainerPool:
+    """Bounded, keyed pool of explainer instances with idle eviction."""
+
+    def __init__(self, weight, max_size=2, idle_ttl=600.0, conf_threshold=0.2, factory=None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.weight = weight
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.conf_threshold = conf_threshold
+        self._factory = factory or _default_factory
+        self._cond = threading.Condition()
+        self._instances = []
+        self._pending = 0
+        self._reaper = None
+        self._closed = False
+
+    def _make_key(self, method, layers, show_box):
+        return (method, tuple(layers), bool(show_box))
+
+    def _take_idle(self, key):
+        for entry in self._instances:
+            if entry.key == key and entry.lock.acquire(blocking=False):
+                return entry
+        return None
+
+    def _evict_one_idle(self):
+        # Least recently used idle instance of any key
+        idle = [e for e in self._instances if not e.lock.locked()]
+        if not idle:
+            return False
+        victim = min(idle, key=lambda e: e.last_used)
+        self._instances.remove(victim)
+        _release_hooks(victim.explainer)
+        return True
+
+    @contextmanager
+    def acquire(self, method="GradCAM", layers=(18, 20, 22), show_box=False, timeout=None):
+        """Check out an explainer for exclusive use by the caller."""
+        key = self._make_key(method, layers, show_box)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        entry = None
+        create = False
+
+        with self._cond:
+            while entry is None and not create:
+                entry = self._take_idle(key)
+                if entry is not None:
+                    break
+                if len(self._instances) + self._pending < self.max_size or self._evict_one_idle():
+                    self._pending += 1
+                    create = True
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise ExplainerPoolTimeout(f"No explainer available within {timeout}s")
+                self._cond.wait(remaining)
+
+        if create:
+            try:
+                explainer = self._factory(self.weight, method, key[1], key[2], self.conf_threshold)
+            except BaseException:
+                with self._cond:
+                    self._pending -= 1
+                    self._cond.notify()
+                raise
+            entry = _PooledExplainer(key, explainer)
+            entry.lock.acquire()
+            with self._cond:
+                self._pending -= 1
+                self._instances.append(entry)
+            self._start_reaper()
+
+        try:
+            yield entry.explainer
+        finally:
+            entry.last_used = time.monotonic()
+            entry.lock.release()
+            with self._cond:
+                self._cond.notify()
+
+    def preload(self, method="GradCAM", layers=(18, 20, 22), show_box=False):
+        """Create an instance up front so the first request doesn't pay for it."""
+        with self.acquire(method, layers, show_box):
+            pass
+
+    def evict_idle(self):
+        """Drop instances that have been idle for longer than ``idle_ttl``."""
+        now = time.monotonic()
+        evicted = 0
+        with self._cond:
+            for entry in list(self._instances):
+                if now - entry.last_used < self.idle_ttl:
+                    continue
+                if not entry.lock.acquire(blocking=False):
+                    continue
+                self._instances.remove(entry)
+                _release_hooks(entry.explainer)
+                evicted += 1
+            if evicted:
+                self._cond.notify_all()
+        return evicted
+
+    def _start_reaper(self):
+        if self._reaper is not None or self.idle_ttl <= 0:
+            return
+
+        def _reap():
+            while not self._closed:
+                time.sleep(max(self.idle_ttl / 2, 1.0))
+                self.evict_idle()
+
+        self._reaper = threading.Thread(target=_reap, name="explainer-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": len(self._instances),
+                "max_size": self.max_size,
+                "busy": sum(1 for e in self._instances if e.lock.locked()),
+                "keys": sorted({repr(e.key) for e in self._instances}),
+            }
+
+    def close(self):
+        self._closed = True
+        with self._cond:
+            for entry in self._instances:
+                _release_hooks(entry.explainer)
+            self._instances.clear()
+            self._cond.notify_all()
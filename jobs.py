@@ -0,0 +1,239 @@
+"""
+Local job queue for slow work such as GradCAM heatmaps.
+
+Jobs are persisted in SQLite (in memory by default, or a file so a single box
+needs no external broker) and executed by a small pool of worker threads in
+priority order. Handlers report progress through a callback and can be
+cancelled cooperatively between stages. Finished jobs, including their
+results, are kept for ``result_ttl`` seconds.
+"""
+import heapq
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+TERMINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job has been cancelled."""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    params TEXT NOT NULL,
+    payload BLOB,
+    result TEXT,
+    error TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    finished REAL
+)
+"""
+
+
+class JobQueue:
+    """Priority job queue backed by SQLite with a local worker pool."""
+
+    def __init__(self, handler, path=":memory:", workers=1, max_queued=64, result_ttl=3600.0):
+        self._handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._threads = []
+        self._closed = False
+        self._last_purge = time.monotonic()
+        with self._db_lock, self._db:
+            self._db.execute(_SCHEMA)
+            # Jobs left over from a previous process can't be resumed
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, payload = NULL, finished = ?, updated = ?"
+                " WHERE status IN (?, ?)",
+                (FAILED, "Interrupted by a restart", time.time(), time.time(), QUEUED, RUNNING),
+            )
+
+    # -- storage -----------------------------------------------------------
+
+    def _update(self, job_id, from_states=None, **fields):
+        """
+        Update a job's columns. Returns False if nothing was updated.
+
+        With ``from_states``, the update only applies while the job is still in
+        one of those states, so a concurrent cancel is never overwritten.
+        """
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        query = f"UPDATE jobs SET {assignments}, version = version + 1 WHERE id = ?"
+        values = (*fields.values(), job_id)
+        if from_states is not None:
+            query += f" AND status IN ({', '.join('?' for _ in from_states)})"
+            values += tuple(from_states)
+        with self._db_lock, self._db:
+            return self._db.execute(query, values).rowcount > 0
+
+    def _row(self, job_id, columns="*"):
+        with self._db_lock:
+            return self._db.execute(f"SELECT {columns} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    # -- public API --------------------------------------------------------
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind, payload, params=None, priority=0):
+        """Queue a job; higher ``priority`` runs first. Returns the job id."""
+        with self._cond:
+            if len(self._heap) >= self.max_queued:
+                raise JobQueueFull(f"{len(self._heap)} jobs already queued")
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            with self._db_lock, self._db:
+                self._db.execute(
+                    "INSERT INTO jobs (id, kind, status, priority, params, payload, created, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, QUEUED, priority, json.dumps(params or {}), payload, now, now),
+                )
+            heapq.heappush(self._heap, (-priority, next(self._seq), job_id))
+            self._cond.notify()
+        return job_id
+
+    def complete(self, kind, result, params=None):
+        """Record an already finished job (e.g. answered from a cache)."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, status, priority, stage, progress, params, result,"
+                " created, updated, finished) VALUES (?, ?, ?, 0, 'done', 1, ?, ?, ?, ?, ?)",
+                (job_id, kind, SUCCEEDED, json.dumps(params or {}), result, now, now, now),
+            )
+        return job_id
+
+    def get(self, job_id, include_result=True):
+        columns = "id, kind, status, priority, stage, progress, params, error, version, created, updated, finished"
+        if include_result:
+            columns += ", result"
+        row = self._row(job_id, columns)
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        if job["status"] in (QUEUED, RUNNING):
+            job["queue_position"] = self._queue_position(job_id) if job["status"] == QUEUED else 0
+        return job
+
+    def version(self, job_id):
+        row = self._row(job_id, "version, status")
+        return None if row is None else (row["version"], row["status"])
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns False if it had already finished."""
+        # A running handler notices at its next progress report
+        if not self._update(
+            job_id, from_states=(QUEUED, RUNNING), status=CANCELLED, payload=None, finished=time.time()
+        ):
+            return False
+        with self._cond:
+            self._heap = [entry for entry in self._heap if entry[2] != job_id]
+            heapq.heapify(self._heap)
+        return True
+
+    def _queue_position(self, job_id):
+        with self._cond:
+            for position, entry in enumerate(sorted(self._heap)):
+                if entry[2] == job_id:
+                    return position + 1
+        return 0
+
+    def stats(self):
+        with self._db_lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"workers": self.workers, "queued": len(self._heap), "jobs": counts}
+
+    def purge_expired(self):
+        cutoff = time.time() - self.result_ttl
+        with self._db_lock, self._db:
+            return self._db.execute(
+                "DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (cutoff,)
+            ).rowcount
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    # -- workers -----------------------------------------------------------
+
+    def _next_job(self):
+        with self._cond:
+            while not self._heap and not self._closed:
+                # Wake up now and then to purge expired results, but never spin
+                if not self._cond.wait(timeout=min(max(self.result_ttl, 1.0), 60.0)):
+                    return None
+            if self._closed:
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    def _work(self):
+        while not self._closed:
+            job_id = self._next_job()
+            if job_id is not None:
+                self._run(job_id)
+            if time.monotonic() - self._last_purge > 60.0:
+                self._last_purge = time.monotonic()
+                self.purge_expired()
+
+    def _run(self, job_id):
+        row = self._row(job_id, "kind, params, payload")
+        if row is None or not self._update(job_id, from_states=(QUEUED,), status=RUNNING, stage="started"):
+            return
+
+        def report(stage, progress):
+            if not self._update(job_id, from_states=(RUNNING,), stage=stage, progress=progress):
+                raise JobCancelled(job_id)
+
+        try:
+            result = self._handler(row["kind"], row["payload"], json.loads(row["params"]), report)
+        except JobCancelled:
+            return
+        except Exception as e:
+            # Compare-and-set, so a job cancelled meanwhile stays cancelled
+            self._update(
+                job_id, from_states=(RUNNING,), status=FAILED, error=str(e), payload=None,
+                finished=time.time(),
+            )
+            return
+        self._update(
+            job_id, from_states=(RUNNING,), status=SUCCEEDED, stage="done", progress=1.0,
+            result=result, payload=None, finished=time.time(),
+        )
@@ -1,10 +1,11 @@
 import streamlit as st
 import requests
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
 import os
 import io
 import base64
+import hashlib
 
 # Parasite descriptions
 PARASITE_DESCRIPTIONS = {
@@ -94,15 +95,171 @@ st.markdown("""
 BACKEND_URL = "http://127.0.0.1:8000"
 HEADERS = {'access_token' : 'kawai_so_oppai'}
 
+# Uploads are downscaled to this longest side before sending; the model sees 640 px anyway
+UPLOAD_MAX_SIDE = 2048
+UPLOAD_JPEG_QUALITY = 90
+HEALTH_CHECK_TTL = 5
+
+
+class BackendError(Exception):
+    """Non-success response from the backend; raised so the failure isn't cached"""
+
+
+@st.cache_resource
+def get_session():
+    """One keep-alive connection pool shared by every rerun and session"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
 # Check backend health
-# @st.cache_resource
+@st.cache_data(ttl=HEALTH_CHECK_TTL, show_spinner=False)
 def check_backend_health():
-    """Check if backend is running"""
+    """Return 'ready', 'starting' (model still loading) or 'down'"""
     try:
-        response = requests.get(f"{BACKEND_URL}/health", timeout=2)
-        return response.status_code == 200
-    except:
-        return False
+        response = get_session().get(f"{BACKEND_URL}/health/ready", timeout=2)
+    except requests.exceptions.RequestException:
+        return 'down'
+    if response.status_code == 200:
+        return 'ready'
+    return 'starting' if response.status_code == 503 else 'down'
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def prepare_upload(image_bytes):
+    """
+    Downscale large images and recompress them as JPEG before they are sent.
+
+    Returns (upload bytes, SHA-256 of those bytes); the hash matches the
+    backend's image_hash, so later requests can send the hash instead.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    if max(image.size) > UPLOAD_MAX_SIDE or image.format not in ('JPEG', 'PNG'):
+        # Re-encoding drops EXIF, so apply the orientation first
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((UPLOAD_MAX_SIDE, UPLOAD_MAX_SIDE), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=UPLOAD_JPEG_QUALITY)
+        if buffer.tell() < len(image_bytes):
+            image_bytes = buffer.getvalue()
+    return image_bytes, hashlib.sha256(image_bytes).hexdigest()
+
+
+def post_image(path, image_hash, image_bytes, params=None, timeout=30, uploaded=False):
+    """POST by image_hash if the backend already holds the image, else upload it"""
+    session = get_session()
+    if uploaded:
+        response = session.post(
+            f"{BACKEND_URL}{path}",
+            params={**(params or {}), 'image_hash': image_hash},
+            timeout=timeout
+        )
+        if response.status_code != 404:
+            return response
+    return session.post(
+        f"{BACKEND_URL}{path}",
+        files={'file': image_bytes},
+        params=params,
+        timeout=timeout
+    )
+
+
+def is_uploaded(image_hash):
+    """Whether this session already sent the image to the backend"""
+    return image_hash in st.session_state.get('uploaded_hashes', set())
+
+
+def mark_uploaded(image_hash):
+    """Remember that the backend holds this image, so later calls send only its hash"""
+    st.session_state.setdefault('uploaded_hashes', set()).add(image_hash)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def predict(image_hash, _image_bytes, confidence_threshold, show_boxes, show_labels, _uploaded=False):
+    """
+    Memoised /predict call keyed by image hash and settings.
+
+    Reruns with unchanged inputs (e.g. after an unrelated widget changed) are
+    answered from here without contacting the backend. The annotated image is
+    returned as PNG bytes so it isn't base64-decoded on every rerun. Session
+    state is left to the caller, since cached calls don't run for every session.
+    """
+    response = post_image(
+        "/predict",
+        image_hash,
+        _image_bytes,
+        params={
+            'confidence_threshold': confidence_threshold,
+            'show_boxes': show_boxes,
+            'show_labels': show_labels
+        },
+        uploaded=_uploaded
+    )
+    if response.status_code != 200:
+        raise BackendError(response.text)
+    result = response.json()
+    image_base64 = result.pop('image_base64', None)
+    result['annotated_image'] = base64.b64decode(image_base64) if image_base64 else None
+    return result
+
+
+@st.fragment(run_every=1.0)
+def show_heatmap_job(image_hash):
+    """Poll the heatmap job for the current image without blocking the rest of the page"""
+    # Finished heatmaps are kept for the whole session, one per image
+    heatmaps = st.session_state.setdefault('heatmaps', {})
+    if image_hash in heatmaps:
+        st.image(heatmaps[image_hash], width='stretch', caption="Heatmap")
+        return
+
+    job = st.session_state.get('heatmap_job')
+    if not job or job.get('image_hash') != image_hash:
+        error = st.session_state.get('heatmap_error')
+        if error and error['image_hash'] == image_hash:
+            st.error(error['message'])
+        return
+
+    if job.get('image_heatmap') is None:
+        try:
+            job_response = get_session().get(
+                f"{BACKEND_URL}/heatmap_jobs/{job['job_id']}",
+                timeout=5
+            )
+        except requests.exceptions.RequestException as e:
+            st.error(f"Error: {str(e)}")
+            return
+        if job_response.status_code != 200:
+            finish_heatmap_job(image_hash, f"Heatmap generation error: {job_response.text}")
+            return
+        job.update(job_response.json())
+
+    status = job['status']
+    if status == 'succeeded' and job.get('image_heatmap'):
+        heatmaps[image_hash] = base64.b64decode(job['image_heatmap'])
+        finish_heatmap_job(image_hash)
+        st.image(heatmaps[image_hash], width='stretch', caption="Heatmap")
+    elif status in ('succeeded', 'failed', 'cancelled'):
+        # Terminal either way: stop polling and let the user start a new job
+        finish_heatmap_job(image_hash, f"Heatmap {status}: {job.get('error') or ''}")
+    else:
+        stage = job.get('stage') or 'queued'
+        st.progress(job.get('progress') or 0.0, text=f"Generating heatmap ({stage})...")
+        if st.button("Cancel", key="cancel_heatmap"):
+            get_session().delete(f"{BACKEND_URL}/heatmap_jobs/{job['job_id']}", timeout=5)
+
+
+def finish_heatmap_job(image_hash, error=None):
+    """Drop the polled job, keeping its error on screen until the next attempt"""
+    st.session_state.pop('heatmap_job', None)
+    if error is None:
+        st.session_state.pop('heatmap_error', None)
+    else:
+        st.session_state['heatmap_error'] = {'image_hash': image_hash, 'message': error}
+        st.error(error)
 
 # Main interface
 col1, col2 = st.columns([1, 1], gap="large", border=True,)
@@ -148,39 +305,36 @@ with col2:
 # Process and display results
 if image_source is not None:
     # Check backend health
-    if not check_backend_health():
+    backend_state = check_backend_health()
+    if backend_state == 'starting':
+        st.warning("⏳ The backend is still loading the model. Please try again in a few seconds.")
+    elif backend_state != 'ready':
         st.error("❌ Backend server is not running. Please start the backend with: python backend.py")
     else:
         # Load image
         if isinstance(image_source, str):
-            image = Image.open(image_source)
             # Read file bytes for backend
             with open(image_source, 'rb') as f:
                 image_bytes = f.read()
         else:
-            image = Image.open(image_source)
             image_bytes = image_source.getvalue()
+        image_bytes, image_hash = prepare_upload(image_bytes)
 
         # Send to backend for prediction
         with st.spinner("🔍 Analyzing image..."):
             try:
-                files = {'file': image_bytes}
-                params = {
-                    'confidence_threshold': confidence_threshold,
-                    'show_boxes': show_boxes,
-                    'show_labels': show_labels
-                }
-                
-                response = requests.post(
-                    f"{BACKEND_URL}/predict",
-                    headers=HEADERS,
-                    files=files,
-                    params=params,
-                    timeout=30
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
+                try:
+                    result = predict(
+                        image_hash, image_bytes, confidence_threshold, show_boxes, show_labels,
+                        _uploaded=is_uploaded(image_hash)
+                    )
+                    # predict() only reaches here once the backend has answered for this image
+                    mark_uploaded(image_hash)
+                except BackendError as e:
+                    result = None
+                    st.error(f"Error from backend: {e}")
+
+                if result is not None:
                     
                     # Create two columns for image and results
                     img_col, result_col = st.columns([1, 1], gap="large")
@@ -189,48 +343,36 @@ if image_source is not None:
                         st.subheader("Image Analysis")
                         
                         # Display annotated image from backend
-                        if result.get('image_base64'):
-                            img_data = base64.b64decode(result['image_base64'])
-                            annotated_image = Image.open(io.BytesIO(img_data))
-                            st.image(annotated_image, width='stretch')
+                        if result.get('annotated_image'):
+                            st.image(result['annotated_image'], width='stretch')
                         else:
-                            st.image(image,width='stretch', caption="Original Image")
+                            st.image(image_bytes, width='stretch', caption="Original Image")
 
                         # Heatmap section with on-demand generation
                         st.divider()
                         st.subheader("Heatmap Analysis")
                         
-                        # Generate heatmap button
-                        if st.button("🔥 Generate Heatmap", use_container_width=True, key="generate_heatmap"):
-                            with st.spinner("Generating heatmap (GPU intensive)..."):
-                                try:
-                                    # Re-upload the file for heatmap generation
-                                    if isinstance(image_source, str):
-                                        with open(image_source, 'rb') as f:
-                                            heatmap_files = {'file': f.read()}
-                                    else:
-                                        heatmap_files = {'file': image_source.getvalue()}
-                                    
-                                    heatmap_response = requests.post(
-                                        f"{BACKEND_URL}/generate_heatmap",
-                                        headers=HEADERS,
-                                        files=heatmap_files,
-                                        timeout=60
-                                    )
-                                    
-                                    if heatmap_response.status_code == 200:
-                                        heatmap_result = heatmap_response.json()
-                                        if heatmap_result.get('image_heatmap'):
-                                            heatmap_data = base64.b64decode(heatmap_result['image_heatmap'])
-                                            heatmap_image = Image.open(io.BytesIO(heatmap_data))
-                                            st.image(heatmap_image, width='stretch', caption=f"Heatmap")
-                                        else:
-                                            st.error('Failed to generate heatmap')
-                                    else:
-                                        st.error(f"Heatmap generation error: {heatmap_response.text}")
-                                
-                                except Exception as e:
-                                    st.error(f"Error: {str(e)}")
+                        # Generate heatmap button (runs as a background job on the backend)
+                        # Not offered again once this image's heatmap is in the session
+                        heatmap_done = image_hash in st.session_state.get('heatmaps', {})
+                        if not heatmap_done and st.button("🔥 Generate Heatmap", use_container_width=True, key="generate_heatmap"):
+                            try:
+                                # The backend usually holds the image already, so only its hash is sent
+                                job_response = post_image(
+                                    "/heatmap_jobs", image_hash, image_bytes, uploaded=is_uploaded(image_hash)
+                                )
+
+                                if job_response.status_code == 202:
+                                    mark_uploaded(image_hash)
+                                    st.session_state.pop('heatmap_error', None)
+                                    st.session_state['heatmap_job'] = job_response.json()
+                                else:
+                                    st.error(f"Heatmap generation error: {job_response.text}")
+
+                            except Exception as e:
+                                st.error(f"Error: {str(e)}")
+
+                        show_heatmap_job(image_hash)
 
                     with result_col:
                         st.subheader("Detection Results")
@@ -285,9 +427,6 @@ if image_source is not None:
                                 st.metric("Unique Species", result['unique_species'])
                         else:
                             st.metric("Total Detections", "0")
-                
-                else:
-                    st.error(f"Error from backend: {response.text}")
             
             except requests.exceptions.ConnectionError:
                 st.error("❌ Cannot connect to backend. Please ensure it's running on http://127.0.0.1:8000")
@@ -0,0 +1,245 @@
+"""
+Minimal Prometheus metrics for the API.
+
+Counters and histograms are updated on the hot path with a lock and a
+``bisect`` per observation, so instrumenting every stage costs microseconds.
+Components that already keep their own statistics (cache, batcher, executor,
+job queue) are exported through collector callbacks that are only evaluated
+when ``/metrics`` is scraped. ``render()`` produces the Prometheus text
+exposition format (version 0.0.4).
+"""
+import bisect
+import threading
+import time
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from sub-millisecond cache hits up to slow GradCAM runs
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB .. 256 MiB
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self._header()
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    @staticmethod
+    def _cumulative(state):
+        total = 0
+        for count in state[:-1]:
+            total += count
+            yield total
+
+    def collect(self):
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        lines = self._header()
+        bounds = self.buckets + (float("inf"),)
+        for key, state in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = list(self._cumulative(state))
+            for bound, count in zip(bounds, cumulative):
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {count}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative[-1]}")
+        return lines
+
+
+class _Callback(_Metric):
+    """Gauge or counter whose samples come from ``fn()`` at scrape time."""
+
+    def __init__(self, name, documentation, type, fn, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self._fn = fn
+
+    def collect(self):
+        lines = self._header()
+        samples = self._fn()
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        for key, value in sorted(samples.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """Holds all metrics and renders them for ``/metrics``."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name, documentation, fn, labelnames=()):
+        """``fn()`` returns a number, or ``{label_value(s): number}`` for labelled gauges."""
+        return self._register(_Callback(name, documentation, "gauge", fn, labelnames))
+
+    def counter_callback(self, name, documentation, fn, labelnames=()):
+        """Like ``gauge_callback`` for monotonically increasing totals kept elsewhere."""
+        return self._register(_Callback(name, documentation, "counter", fn, labelnames))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.collect())
+            except Exception:
+                # One broken collector must not take down the whole scrape
+                continue
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording per-route request counts, latency and body sizes.
+
+    Routes are labelled by their path template (``/heatmap_jobs/{job_id}``),
+    so label cardinality stays bounded. Each finished request is also passed to
+    ``listeners`` as ``(endpoint, started, finished, status)`` with monotonic
+    timestamps, which is how the sampling profiler spots slow requests.
+    """
+
+    def __init__(self, app, registry, listeners=()):
+        self.app = app
+        self.listeners = listeners
+        self.requests = registry.counter(
+            "parasite_http_requests_total", "HTTP requests by route and status code", ("endpoint", "status")
+        )
+        self.latency = registry.histogram(
+            "parasite_http_request_duration_seconds", "Time until the response finished sending", ("endpoint",)
+        )
+        self.request_bytes = registry.histogram(
+            "parasite_http_request_bytes", "Request body size", ("endpoint",), BYTES_BUCKETS
+        )
+        self.response_bytes = registry.histogram(
+            "parasite_http_response_bytes", "Response body size", ("endpoint",), BYTES_BUCKETS
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.monotonic()
+        sizes = {"request": 0, "response": 0}
+        status = {"code": 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            finished = time.monotonic()
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            self.requests.inc(endpoint=endpoint, status=status["code"])
+            self.latency.observe(finished - started, endpoint=endpoint)
+            self.request_bytes.observe(sizes["request"], endpoint=endpoint)
+            self.response_bytes.observe(sizes["response"], endpoint=endpoint)
+            for listener in self.listeners:
+                listener(endpoint, started, finished, status["code"])
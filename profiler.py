@@ -0,0 +1,137 @@
+"""
+On-demand sampling profiler for slow requests.
+
+While running, a background thread snapshots the stacks of all busy threads
+every ``interval_ms`` (``sys._current_frames``) into a bounded ring buffer.
+When a request takes longer than ``slow_ms``, the samples taken during it are
+folded into a capture in the collapsed-stack format used by flamegraph.pl and
+speedscope (``thread;outer;...;inner count`` per line).
+
+Samples are process-wide: work for concurrent requests, which runs on shared
+executor threads, shows up in each of their captures. The profiler is off by
+default and costs nothing until started.
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+# Threads whose innermost frame is in one of these modules are idle, not working
+_IDLE_MODULES = ("threading.py", "selectors.py", "queue.py")
+# Innermost frames that block in C while idle (pool workers waiting for work, sleeping reapers)
+_IDLE_FRAMES = ("thread.py:_worker", "explainer_pool.py:_reap")
+
+
+def _is_idle(frame):
+    return os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES or _frame_label(frame) in _IDLE_FRAMES
+
+
+def _fold(frame, max_depth=128):
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Samples all thread stacks while running and keeps captures of slow requests."""
+
+    def __init__(self, interval_ms=10, slow_ms=1000, max_samples=100000, max_captures=20):
+        self.interval_ms = interval_ms
+        self.slow_ms = slow_ms
+        self._samples = deque(maxlen=max_samples)
+        self._captures = deque(maxlen=max_captures)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._sample_count = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms=None, slow_ms=None):
+        if interval_ms is not None:
+            self.interval_ms = interval_ms
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            self._samples.clear()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval_ms / 1000.0):
+            now = time.monotonic()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            samples = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or _is_idle(frame):
+                    continue
+                samples.append((now, f"{names.get(thread_id, thread_id)};{_fold(frame)}"))
+            with self._lock:
+                self._samples.extend(samples)
+                self._sample_count += len(samples)
+
+    def request_finished(self, endpoint, started, finished, status):
+        """Middleware listener; keeps a capture when the request was slow."""
+        duration_ms = (finished - started) * 1000
+        if not self.running or duration_ms < self.slow_ms:
+            return
+        with self._lock:
+            stacks = Counter(stack for t, stack in self._samples if started <= t <= finished)
+            self._captures.append({
+                "id": next(self._ids),
+                "endpoint": endpoint,
+                "status": status,
+                "duration_ms": round(duration_ms, 2),
+                "captured_at": time.time(),
+                "samples": sum(stacks.values()),
+                "stacks": stacks,
+            })
+
+    def captures(self):
+        with self._lock:
+            return [
+                {k: v for k, v in capture.items() if k != "stacks"}
+                for capture in reversed(self._captures)
+            ]
+
+    def folded(self, capture_id):
+        """Collapsed stacks of one capture, or None if it is unknown or expired."""
+        with self._lock:
+            for capture in self._captures:
+                if capture["id"] == capture_id:
+                    return "".join(f"{stack} {count}\n" for stack, count in capture["stacks"].most_common())
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self.running,
+                "interval_ms": self.interval_ms,
+                "slow_ms": self.slow_ms,
+                "buffered_samples": len(self._samples),
+                "total_samples": self._sample_count,
+                "captures": len(self._captures),
+            }
@@ -0,0 +1,60 @@
+"""
+Drawing detections and encoding images for API responses.
+"""
+import io
+
+import numpy as np
+from PIL import Image
+
+
+IMAGE_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+
+
+def default_line_width(width, height):
+    return 3 if (width >= 500 or height >= 500) else 1
+
+
+def draw_detections(img_array, detections, names, show_labels=True, line_width=None):
+    """Draw boxes the same way ``Results.plot`` does, on a copy of the image."""
+    from ultralytics.utils.plotting import Annotator, colors
+
+    height, width = img_array.shape[:2]
+    annotator = Annotator(
+        np.ascontiguousarray(img_array).copy(),
+        line_width=line_width or default_line_width(width, height),
+        example=str(names),
+    )
+    # Highest confidence last so it ends up on top, as in Results.plot
+    for i in reversed(range(len(detections))):
+        box, conf, class_id = detections.boxes[i], detections.confidences[i], detections.class_ids[i]
+        label = f"{names[int(class_id)]} {conf:.2f}" if show_labels else None
+        annotator.box_label(box, label, color=colors(int(class_id), True))
+    return annotator.result()
+
+
+def encode_image(img_array, fmt="jpeg", quality=85, max_size=0):
+    """
+    Encode an image array, optionally downscaled so its longest side is at most ``max_size``.
+
+    Returns ``(bytes, media_type)``.
+    """
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {fmt!r}")
+    pil_format, media_type = IMAGE_FORMATS[fmt]
+
+    image = Image.fromarray(img_array)
+    if max_size and max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    if pil_format == "PNG":
+        image.save(buffer, format=pil_format)
+    else:
+        image.save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue(), media_type
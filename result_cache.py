@@ -0,0 +1,205 @@
+"""
+Content-addressed cache for uploaded images and serialized API responses.
+
+Entries are keyed on the SHA-256 of the uploaded bytes plus the request
+parameters, so re-submitting the same slide image with the same settings is
+served without touching the model. Values are stored as bytes (the encoded
+JSON response, or the raw upload) in an in-memory LRU bounded by
+``max_bytes``. When ``disk_dir`` is set, entries evicted from memory spill to
+an on-disk LRU tier bounded by ``disk_max_bytes`` and are promoted back on
+the next hit, except for the kinds in ``memory_only_kinds``.
+
+Responses depend on the model as well as the image, so the cache is scoped
+to a ``namespace`` identifying the loaded model (see ``set_namespace``). The
+disk tier records the namespace its files were written under and is emptied
+when a different model is loaded.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import Counter, OrderedDict
+
+
+def hash_image(contents):
+    """Content hash clients can send back instead of re-uploading the image."""
+    return hashlib.sha256(contents).hexdigest()
+
+
+def make_key(kind, digest, **params):
+    return f"{kind}:{digest}:{json.dumps(params, sort_keys=True)}"
+
+
+def _kind_of(key):
+    return key.split(":", 1)[0]
+
+
+class ResultCache:
+    """Byte-budgeted LRU cache with an optional on-disk tier."""
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0, memory_only_kinds=()):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self.memory_only_kinds = frozenset(memory_only_kinds)
+        self.namespace = ""
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._hits = Counter()
+        self._disk_hits = Counter()
+        self._misses = Counter()
+        self._evictions = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    # -- disk tier ---------------------------------------------------------
+
+    def _disk_path(self, key):
+        name = hashlib.sha256(f"{self.namespace}|{key}".encode()).hexdigest()
+        return os.path.join(self.disk_dir, f"{name}.bin")
+
+    def _namespace_path(self):
+        return os.path.join(self.disk_dir, "NAMESPACE")
+
+    def _clear_disk(self):
+        for path in self._disk:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._disk.clear()
+        self._disk_bytes = 0
+
+    def _load_disk_index(self):
+        # Oldest files first so they are evicted first. Only keys written by
+        # this process are known, so files are indexed by path.
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith(".bin") and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._disk[path] = size
+            self._disk_bytes += size
+
+    def _disk_put(self, key, value):
+        path = self._disk_path(key)
+        if len(value) > self.disk_max_bytes or _kind_of(key) in self.memory_only_kinds:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        self._disk_bytes -= self._disk.pop(path, 0)
+        self._disk[path] = len(value)
+        self._disk_bytes += len(value)
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            old_path, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        if path not in self._disk:
+            return None
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+        except FileNotFoundError:
+            self._disk_bytes -= self._disk.pop(path)
+            return None
+        self._disk.move_to_end(path)
+        return value
+
+    # -- public API --------------------------------------------------------
+
+    def set_namespace(self, namespace):
+        """
+        Scope entries to ``namespace``, e.g. the identity of the loaded model.
+
+        Memory entries from another namespace are dropped, and so is the disk
+        tier if it was written under another namespace (or by a version that
+        didn't record one).
+        """
+        with self._lock:
+            if namespace == self.namespace:
+                return
+            if self.namespace:
+                self._memory.clear()
+                self._memory_bytes = 0
+            self.namespace = namespace
+            if not self.disk_dir:
+                return
+            try:
+                with open(self._namespace_path()) as f:
+                    previous = f.read()
+            except FileNotFoundError:
+                previous = None
+            if previous != namespace:
+                self._clear_disk()
+                with open(self._namespace_path(), "w") as f:
+                    f.write(namespace)
+
+    def get(self, key):
+        kind = _kind_of(key)
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._hits[kind] += 1
+                return value
+            if self.disk_dir:
+                value = self._disk_get(key)
+                if value is not None:
+                    self._disk_hits[kind] += 1
+                    self._put_memory(key, value)
+                    return value
+            self._misses[kind] += 1
+            return None
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._memory or (
+                self.disk_dir is not None and self._disk_path(key) in self._disk
+            )
+
+    def put(self, key, value):
+        with self._lock:
+            self._put_memory(key, value)
+
+    def _put_memory(self, key, value):
+        if len(value) > self.max_bytes:
+            if self.disk_dir:
+                self._disk_put(key, value)
+            return
+        self._memory_bytes -= len(self._memory.pop(key, b""))
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.max_bytes:
+            old_key, old_value = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_value)
+            self._evictions += 1
+            if self.disk_dir:
+                self._disk_put(old_key, old_value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "bytes": self._memory_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "hits": dict(self._hits),
+                "disk_hits": dict(self._disk_hits),
+                "misses": dict(self._misses),
+            }
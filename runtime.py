@@ -0,0 +1,149 @@
+"""
+Inference runtime selection.
+
+The detector can be served from the PyTorch checkpoint (``best.pt``) or from
+the exported OpenVINO INT8 model directory. The backend is chosen with
+``PARASITE_MODEL_BACKEND`` (``auto``, ``pytorch`` or ``openvino``); ``auto``
+prefers OpenVINO because it is the faster option on CPU-only hosts. If the
+requested artifact is missing or fails to load, the other one is tried before
+giving up.
+"""
+import glob
+import hashlib
+import os
+
+import yaml
+
+
+DEFAULT_IMGSZ = 640
+
+
+def artifact_identity(backend, artifact):
+    """
+    Short hash of the backend and the artifact's path, sizes and modification
+    times; it changes whenever a different or re-exported model is loaded.
+    """
+    paths = [artifact]
+    if os.path.isdir(artifact):
+        paths = sorted(glob.glob(os.path.join(artifact, "**", "*"), recursive=True))
+    parts = [backend, os.path.abspath(artifact)]
+    for path in paths:
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            parts.append(f"{os.path.relpath(path, artifact)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+class ModelRuntime:
+    """A loaded detector together with what the API needs to know about it."""
+
+    def __init__(self, model, backend, artifact, names, imgsz, max_batch=None, dynamic_shape=True):
+        self.model = model
+        self.backend = backend
+        self.artifact = artifact
+        self.names = names
+        self.imgsz = imgsz
+        # None means any batch size is accepted
+        self.max_batch = max_batch
+        # Whether inputs other than imgsz x imgsz can be run without padding up to it
+        self.dynamic_shape = dynamic_shape
+        # Taken at load time, so it describes the model actually being served
+        self.identity = artifact_identity(backend, artifact)
+
+    def info(self):
+        return {
+            "backend": self.backend,
+            "artifact": self.artifact,
+            "imgsz": self.imgsz,
+            "max_batch": self.max_batch,
+            "dynamic_shape": self.dynamic_shape,
+            "num_classes": len(self.names),
+            "identity": self.identity,
+        }
+
+
+def read_metadata(model_dir):
+    """Read the ``metadata.yaml`` written next to an exported model, if any."""
+    path = os.path.join(model_dir, "metadata.yaml")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def _imgsz_from(value):
+    if isinstance(value, (list, tuple)):
+        return int(max(value))
+    if value:
+        return int(value)
+    return DEFAULT_IMGSZ
+
+
+def _missing_openvino_files(model_dir):
+    if not os.path.isdir(model_dir):
+        return f"{model_dir} does not exist"
+    xml_files = glob.glob(os.path.join(model_dir, "*.xml"))
+    if not xml_files:
+        return f"no .xml graph in {model_dir}"
+    bin_file = os.path.splitext(xml_files[0])[0] + ".bin"
+    if not os.path.exists(bin_file):
+        return f"{bin_file} is missing"
+    return None
+
+
+def _load_pytorch(weights):
+    if not os.path.exists(weights):
+        raise FileNotFoundError(f"{weights} does not exist")
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+    imgsz = _imgsz_from(model.overrides.get("imgsz"))
+    return ModelRuntime(model, "pytorch", weights, dict(model.names), imgsz)
+
+
+def _load_openvino(model_dir):
+    missing = _missing_openvino_files(model_dir)
+    if missing:
+        raise FileNotFoundError(missing)
+    from ultralytics import YOLO
+
+    metadata = read_metadata(model_dir)
+    names = {int(k): v for k, v in (metadata.get("names") or {}).items()}
+    model = YOLO(model_dir, task=metadata.get("task", "detect"))
+    args = metadata.get("args") or {}
+    # Statically shaped exports only accept the batch size they were exported with
+    max_batch = None if args.get("dynamic") else int(metadata.get("batch", 1))
+    return ModelRuntime(
+        model, "openvino", model_dir, names, _imgsz_from(metadata.get("imgsz")), max_batch,
+        dynamic_shape=bool(args.get("dynamic")),
+    )
+
+
+LOADERS = {
+    "pytorch": _load_pytorch,
+    "openvino": _load_openvino,
+}
+
+
+def load_runtime(backend, weights, openvino_dir):
+    """
+    Load the requested backend, falling back to the other one.
+
+    Returns ``(runtime, errors)``; ``runtime`` is None if nothing could be
+    loaded and ``errors`` maps each backend that was tried to its failure.
+    """
+    artifacts = {"pytorch": weights, "openvino": openvino_dir}
+    if backend == "auto":
+        order = ["openvino", "pytorch"]
+    elif backend in LOADERS:
+        order = [backend] + [name for name in LOADERS if name != backend]
+    else:
+        raise ValueError(f"Unknown model backend: {backend!r}")
+
+    errors = {}
+    for name in order:
+        try:
+            return LOADERS[name](artifacts[name]), errors
+        except Exception as e:
+            errors[name] = str(e)
+    return None, errors
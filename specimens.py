@@ -0,0 +1,272 @@
+"""
+Per-specimen aggregation of detections over many microscope fields.
+
+A diagnosis is made from many images (fields) of one specimen. Rather than
+having clients re-aggregate dozens of ``/predict`` responses, images are
+attached to a specimen, and its running totals are updated in the same
+SQLite transaction that appends the field:
+
+- field, detection and positive-field counts, the sum of squared per-field
+  counts (for the spread of eggs per field), the largest field count and
+  the imaged area (for eggs per megapixel);
+- per-species counts and confidence sums;
+- a fixed-bin confidence histogram.
+
+A summary therefore reads one specimen row, one row per species and at most
+``CONFIDENCE_BINS`` histogram rows, however many fields have been added.
+Each field's detections are appended as a single packed row (float32 boxes
+and confidences, uint16 class ids), so an export walks one row per field
+instead of one per box. The database is in memory by default, or a file
+(written in WAL mode) to keep specimens across restarts.
+"""
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from detections import Detections
+
+
+CONFIDENCE_BINS = 20
+# Species bucket of low-confidence detections; it isn't a species of its own
+UNKNOWN_SPECIES = "Unknown Species"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS specimens (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    fields INTEGER NOT NULL DEFAULT 0,
+    positive_fields INTEGER NOT NULL DEFAULT 0,
+    detections INTEGER NOT NULL DEFAULT 0,
+    detections_squared INTEGER NOT NULL DEFAULT 0,
+    max_detections INTEGER NOT NULL DEFAULT 0,
+    confidence_sum REAL NOT NULL DEFAULT 0,
+    pixels INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS specimen_species (
+    specimen_id TEXT NOT NULL,
+    species TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    confidence_sum REAL NOT NULL,
+    PRIMARY KEY (specimen_id, species)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS specimen_confidence (
+    specimen_id TEXT NOT NULL,
+    bin INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (specimen_id, bin)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS specimen_fields (
+    specimen_id TEXT NOT NULL,
+    field INTEGER NOT NULL,
+    image_hash TEXT NOT NULL,
+    name TEXT,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    confidence_threshold REAL NOT NULL,
+    detections INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    added REAL NOT NULL,
+    PRIMARY KEY (specimen_id, field),
+    UNIQUE (specimen_id, image_hash)
+);
+"""
+
+_FIELD_COLUMNS = "field, image_hash, name, width, height, confidence_threshold, detections, added"
+
+
+class UnknownSpecimen(KeyError):
+    """Raised when a specimen id doesn't exist."""
+
+
+def _pack(detections):
+    return (
+        detections.boxes.astype(np.float32).tobytes()
+        + detections.confidences.astype(np.float32).tobytes()
+        + detections.class_ids.astype(np.uint16).tobytes()
+    )
+
+
+def _unpack(data, count):
+    boxes = np.frombuffer(data, dtype=np.float32, count=count * 4)
+    confidences = np.frombuffer(data, dtype=np.float32, count=count, offset=count * 16)
+    class_ids = np.frombuffer(data, dtype=np.uint16, count=count, offset=count * 20)
+    return Detections(boxes, confidences, class_ids)
+
+
+def confidence_histogram(confidences):
+    """Counts of ``confidences`` in ``CONFIDENCE_BINS`` equal bins over [0, 1]."""
+    bins = np.clip((np.asarray(confidences) * CONFIDENCE_BINS).astype(np.int64), 0, CONFIDENCE_BINS - 1)
+    return np.bincount(bins, minlength=CONFIDENCE_BINS)
+
+
+class SpecimenStore:
+    """Specimens, their fields' detections and running aggregates in SQLite."""
+
+    def __init__(self, path=":memory:"):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            if path != ":memory:":
+                # Appends then only write the log, without a full sync per field
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+
+    def create(self, name=None):
+        """New empty specimen; returns its id."""
+        specimen_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO specimens (id, name, created, updated) VALUES (?, ?, ?, ?)",
+                (specimen_id, name, now, now),
+            )
+        return specimen_id
+
+    def exists(self, specimen_id):
+        with self._db_lock:
+            return self._db.execute("SELECT 1 FROM specimens WHERE id = ?", (specimen_id,)).fetchone() is not None
+
+    def delete(self, specimen_id):
+        with self._db_lock, self._db:
+            for table, column in (
+                ("specimen_fields", "specimen_id"),
+                ("specimen_species", "specimen_id"),
+                ("specimen_confidence", "specimen_id"),
+                ("specimens", "id"),
+            ):
+                deleted = self._db.execute(f"DELETE FROM {table} WHERE {column} = ?", (specimen_id,)).rowcount
+        return deleted > 0
+
+    def add_field(self, specimen_id, image_hash, detections, species, image_size, confidence_threshold, name=None):
+        """
+        Append one field and fold it into the specimen's aggregates.
+
+        ``detections`` are in original image pixels and ``species`` has the
+        species name of each detection. Returns ``(field, added)``. An image
+        that is already attached isn't counted twice: its field number is
+        returned with ``added`` False.
+        """
+        width, height = image_size
+        count = len(detections)
+        species, inverse = np.unique(np.asarray(species, dtype=object).astype(str), return_inverse=True)
+        species_counts = np.bincount(inverse, minlength=len(species))
+        species_confidences = np.bincount(inverse, weights=detections.confidences, minlength=len(species))
+        histogram = confidence_histogram(detections.confidences)
+        now = time.time()
+        with self._db_lock, self._db:
+            row = self._db.execute("SELECT fields FROM specimens WHERE id = ?", (specimen_id,)).fetchone()
+            if row is None:
+                raise UnknownSpecimen(specimen_id)
+            existing = self._db.execute(
+                "SELECT field FROM specimen_fields WHERE specimen_id = ? AND image_hash = ?",
+                (specimen_id, image_hash),
+            ).fetchone()
+            if existing is not None:
+                return existing["field"], False
+            field = row["fields"] + 1
+            self._db.execute(
+                f"INSERT INTO specimen_fields (specimen_id, {_FIELD_COLUMNS}, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (specimen_id, field, image_hash, name, width, height, confidence_threshold, count, now, _pack(detections)),
+            )
+            self._db.execute(
+                "UPDATE specimens SET fields = fields + 1, positive_fields = positive_fields + ?,"
+                " detections = detections + ?, detections_squared = detections_squared + ?,"
+                " max_detections = MAX(max_detections, ?), confidence_sum = confidence_sum + ?,"
+                " pixels = pixels + ?, updated = ? WHERE id = ?",
+                (int(count > 0), count, count * count, count, float(detections.confidences.sum()),
+                 width * height, now, specimen_id),
+            )
+            self._db.executemany(
+                "INSERT INTO specimen_species (specimen_id, species, count, confidence_sum) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (specimen_id, species) DO UPDATE SET"
+                " count = count + excluded.count, confidence_sum = confidence_sum + excluded.confidence_sum",
+                [
+                    (specimen_id, name, int(n), float(total))
+                    for name, n, total in zip(species.tolist(), species_counts, species_confidences)
+                ],
+            )
+            self._db.executemany(
+                "INSERT INTO specimen_confidence (specimen_id, bin, count) VALUES (?, ?, ?)"
+                " ON CONFLICT (specimen_id, bin) DO UPDATE SET count = count + excluded.count",
+                [(specimen_id, int(b), int(histogram[b])) for b in np.flatnonzero(histogram)],
+            )
+        return field, True
+
+    def summary(self, specimen_id):
+        """Aggregates of a specimen, or None if it doesn't exist."""
+        with self._db_lock:
+            row = self._db.execute("SELECT * FROM specimens WHERE id = ?", (specimen_id,)).fetchone()
+            if row is None:
+                return None
+            species = self._db.execute(
+                "SELECT species, count, confidence_sum FROM specimen_species WHERE specimen_id = ? ORDER BY count DESC",
+                (specimen_id,),
+            ).fetchall()
+            bins = self._db.execute(
+                "SELECT bin, count FROM specimen_confidence WHERE specimen_id = ?", (specimen_id,)
+            ).fetchall()
+        fields, detections = row["fields"], row["detections"]
+        mean_per_field = detections / fields if fields else 0.0
+        variance = row["detections_squared"] / fields - mean_per_field ** 2 if fields else 0.0
+        histogram = [0] * CONFIDENCE_BINS
+        for b in bins:
+            histogram[b["bin"]] = b["count"]
+        return {
+            "specimen_id": row["id"],
+            "name": row["name"],
+            "created": row["created"],
+            "updated": row["updated"],
+            "fields": fields,
+            "positive_fields": row["positive_fields"],
+            "total_detections": detections,
+            "unique_species": sum(1 for s in species if s["species"] != UNKNOWN_SPECIES),
+            "mean_confidence": row["confidence_sum"] / detections if detections else 0.0,
+            "species_counts": {s["species"]: s["count"] for s in species},
+            "species_mean_confidence": {s["species"]: s["confidence_sum"] / s["count"] for s in species},
+            "confidence_histogram": {
+                "bin_edges": np.round(np.linspace(0, 1, CONFIDENCE_BINS + 1), 3).tolist(),
+                "counts": histogram,
+            },
+            "eggs_per_field": {
+                "mean": mean_per_field,
+                "std": max(variance, 0.0) ** 0.5,
+                "max": row["max_detections"],
+            },
+            "eggs_per_megapixel": detections / (row["pixels"] / 1e6) if row["pixels"] else 0.0,
+        }
+
+    def iter_fields(self, specimen_id, page_size=256):
+        """
+        Yield ``(field, detections)`` for every field in the order they were added.
+
+        Fields are read a page at a time, so appends aren't blocked for the
+        whole of a long export.
+        """
+        last = 0
+        while True:
+            with self._db_lock:
+                rows = self._db.execute(
+                    f"SELECT {_FIELD_COLUMNS}, data FROM specimen_fields"
+                    " WHERE specimen_id = ? AND field > ? ORDER BY field LIMIT ?",
+                    (specimen_id, last, page_size),
+                ).fetchall()
+            for row in rows:
+                field = dict(row)
+                yield field, _unpack(field.pop("data"), row["detections"])
+            if len(rows) < page_size:
+                return
+            last = rows[-1]["field"]
+
+    def stats(self):
+        with self._db_lock:
+            specimens, fields = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(fields), 0) FROM specimens"
+            ).fetchone()
+        return {"specimens": specimens, "fields": fields}
@@ -0,0 +1,117 @@
+"""
+Building blocks for the live camera WebSocket stream.
+
+A live feed must never queue frames: if detection falls behind, the frames
+waiting for it are stale by the time they would be processed. ``LatestFrame``
+is a single-slot mailbox in which a newly received frame replaces one that
+hasn't been picked up yet (latest frame wins), so at most one frame waits
+while another is being detected and latency stays bounded by one detection.
+
+``StreamStats`` keeps per-connection counters and frame rates, reported in
+every message and in ``/health``.
+"""
+import asyncio
+import itertools
+import time
+from collections import deque
+
+
+class LatestFrame:
+    """Single-slot frame mailbox that drops the older frame when a new one arrives."""
+
+    def __init__(self):
+        self._frame = None
+        self._event = asyncio.Event()
+        self._closed = False
+
+    def put(self, frame):
+        """Store ``frame``; returns True if it replaced a frame nobody had picked up."""
+        replaced = self._frame is not None
+        self._frame = frame
+        self._event.set()
+        return replaced
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+    async def get(self):
+        """Next frame, or None once closed and empty."""
+        while self._frame is None:
+            if self._closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+
+class RateMeter:
+    """Events per second over a sliding window."""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self._times = deque()
+
+    def mark(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._times.append(now)
+        self._trim(now)
+
+    def _trim(self, now):
+        while self._times and now - self._times[0] > self.window:
+            self._times.popleft()
+
+    def rate(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._trim(now)
+        if len(self._times) < 2:
+            return 0.0
+        span = max(self._times[-1] - self._times[0], now - self._times[0])
+        return (len(self._times) - 1) / span if span > 0 else 0.0
+
+
+_stream_ids = itertools.count(1)
+
+
+class StreamStats:
+    """Counters and rates of one stream connection."""
+
+    def __init__(self, client=None):
+        self.id = next(_stream_ids)
+        self.client = client
+        self.started_at = time.time()
+        self.received = 0
+        self.processed = 0
+        self.dropped_stale = 0
+        self.dropped_overloaded = 0
+        self.errors = 0
+        self.latency_ms = 0.0
+        self._fps_in = RateMeter()
+        self._fps_out = RateMeter()
+
+    def frame_received(self):
+        self.received += 1
+        self._fps_in.mark()
+
+    def frame_processed(self, received_at):
+        self.processed += 1
+        self._fps_out.mark()
+        latency = (time.monotonic() - received_at) * 1000
+        # Exponential moving average, seeded with the first frame
+        self.latency_ms = latency if self.processed == 1 else self.latency_ms + 0.2 * (latency - self.latency_ms)
+
+    def as_dict(self):
+        return {
+            "stream_id": self.id,
+            "client": self.client,
+            "uptime": round(time.time() - self.started_at, 1),
+            "received": self.received,
+            "processed": self.processed,
+            "dropped_stale": self.dropped_stale,
+            "dropped_overloaded": self.dropped_overloaded,
+            "errors": self.errors,
+            "fps_in": round(self._fps_in.rate(), 2),
+            "fps_out": round(self._fps_out.rate(), 2),
+            "latency_ms": round(self.latency_ms, 1),
+        }
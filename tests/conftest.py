@@ -0,0 +1,33 @@
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The service modules live at the repository root, not in a package
+sys.path.insert(0, ROOT)
+
+# End-to-end API tests run the real detector, whose weights aren't in the repository
+requires_model = pytest.mark.skipif(
+    not os.path.exists(os.path.join(ROOT, "models", "best.pt")),
+    reason="needs the model weights in models/best.pt",
+)
+
+
+@pytest.fixture(scope="session")
+def api():
+    """A test client for the API, with the API key header; the backend is imported on first use."""
+    from fastapi.testclient import TestClient
+
+    # Model and data paths in config.py are relative to the repository root
+    os.chdir(ROOT)
+    import backend
+
+    with TestClient(backend.app, headers={backend.API_KEY_NAME: backend.API_KEY}) as client:
+        # The model loads and warms up in the background
+        deadline = time.monotonic() + 300
+        while client.get("/health/ready").status_code == 503 and backend.startup_state["status"] == "starting":
+            assert time.monotonic() < deadline, "startup did not finish"
+            time.sleep(0.1)
+        yield client
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_results():
+    batches = []
+
+    async def run_batch(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    async def scenario():
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=50)
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(6))), batcher.stats()
+        finally:
+            await batcher.stop()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [0, 10, 20, 30, 40, 50]
+    assert [len(batch) for batch in batches] == [4, 2]
+    assert stats["batch_size_histogram"] == {"2": 1, "4": 1}
+    assert stats["items"] == 6
+
+
+def test_a_lone_request_only_waits_max_wait():
+    async def run_batch(items):
+        return items
+
+    async def scenario():
+        batcher = MicroBatcher(run_batch, max_batch_size=8, max_wait_ms=20)
+        try:
+            started = time.monotonic()
+            await batcher.submit("x")
+            return time.monotonic() - started
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(scenario()) < 0.5
+
+
+def test_a_failed_batch_fails_every_request_in_it():
+    async def run_batch(items):
+        raise RuntimeError("boom")
+
+    async def scenario():
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=20)
+        try:
+            return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(scenario())
+    assert [str(result) for result in results] == ["boom", "boom"]
+
+
+def test_cancelled_requests_are_left_out_of_the_batch():
+    batches = []
+
+    async def run_batch(items):
+        batches.append(list(items))
+        return items
+
+    async def scenario():
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=50)
+        try:
+            abandoned = asyncio.ensure_future(batcher.submit("abandoned"))
+            kept = asyncio.ensure_future(batcher.submit("kept"))
+            await asyncio.sleep(0)
+            abandoned.cancel()
+            return await kept
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(scenario()) == "kept"
+    assert batches == [["kept"]]
+
+
+def test_max_batch_size_must_be_positive():
+    with pytest.raises(ValueError):
+        MicroBatcher(lambda items: items, max_batch_size=0)
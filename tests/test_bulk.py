@@ -0,0 +1,79 @@
+import io
+import json
+import tarfile
+import zipfile
+
+from bulk import SpecimenAggregate, iter_upload_images
+from conftest import requires_model
+from detections import Detections
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def _tar(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def test_a_plain_upload_is_one_image():
+    assert list(iter_upload_images("slide.jpg", io.BytesIO(b"jpeg"))) == [("slide.jpg", b"jpeg")]
+
+
+def test_zip_members_are_read_one_by_one_and_non_images_skipped():
+    upload = _zip({"a.jpg": b"1", "dir/b.PNG": b"2", "notes.txt": b"x", "__MACOSX/._a.jpg": b"y", ".hidden.jpg": b"z"})
+    images = iter_upload_images("slides.zip", upload)
+    assert next(images) == ("slides.zip/a.jpg", b"1")
+    assert list(images) == [("slides.zip/dir/b.PNG", b"2")]
+
+
+def test_tar_archives_are_read_by_extension():
+    upload = _tar({"a.tif": b"1", "readme.md": b"x", "b.webp": b"2"})
+    assert list(iter_upload_images("slides.tar.gz", upload)) == [("slides.tar.gz/a.tif", b"1"), ("slides.tar.gz/b.webp", b"2")]
+
+
+def test_specimen_aggregate_combines_images():
+    aggregate = SpecimenAggregate()
+    aggregate.add(Detections([[0, 0, 1, 1]], [0.9], [0]), ["Taenia Sp"])
+    aggregate.add(Detections([[0, 0, 1, 1], [2, 2, 3, 3]], [0.5, 0.7], [0, 1]), ["Taenia Sp", "Ascaris Lumbricoides"])
+    aggregate.add_failure()
+    assert aggregate.images == 2
+    assert aggregate.failed == 1
+    assert aggregate.species_counts == {"Taenia Sp": 2, "Ascaris Lumbricoides": 1}
+    assert len(aggregate.combined()) == 3
+    assert len(SpecimenAggregate().combined()) == 0
+
+
+@requires_model
+def test_predict_batch_streams_one_line_per_image_then_a_summary(api):
+    images = {f"field{i}.jpg": open(f"data/0{i}.jpg", "rb").read() for i in range(3)}
+    files = [
+        ("files", ("slides.zip", _zip(images).getvalue())),
+        ("files", ("single.jpg", images["field0.jpg"])),
+        ("files", ("broken.jpg", b"not an image")),
+    ]
+    with api.stream("POST", "/predict_batch", files=files, params={"confidence_threshold": 0.5}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.iter_lines() if line]
+
+    *results, summary = lines
+    assert summary["type"] == "summary"
+    assert summary["images"] == 4 and summary["failed"] == 1
+    names = {result["name"] for result in results if result["type"] == "image"}
+    assert names == {"slides.zip/field0.jpg", "slides.zip/field1.jpg", "slides.zip/field2.jpg", "single.jpg"}
+    errors = [result for result in results if result["type"] == "error"]
+    assert [error["name"] for error in errors] == ["broken.jpg"]
+    assert sum(len(result.get("boxes", [])) for result in results) == summary["total_detections"]
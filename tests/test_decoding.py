@@ -0,0 +1,75 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from decoding import ImageTooLarge, decode_image
+
+
+def _encode(image, format="JPEG", **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **params)
+    return buffer.getvalue()
+
+
+def test_pixel_limit_is_checked_before_decoding():
+    contents = _encode(Image.new("RGB", (200, 100)))
+    with pytest.raises(ImageTooLarge, match="200x100"):
+        decode_image(contents, max_pixels=200 * 100 - 1)
+    assert decode_image(contents, max_pixels=200 * 100).size == (200, 100)
+
+
+def test_no_pixel_limit_by_default():
+    assert decode_image(_encode(Image.new("RGB", (300, 200)))).size == (300, 200)
+
+
+def test_decompression_bombs_are_too_large(monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(ImageTooLarge):
+        # Twice Pillow's limit raises instead of warning
+        decode_image(_encode(Image.new("RGB", (100, 100))))
+
+
+def test_jpeg_is_decoded_at_reduced_size_but_keeps_its_original_size():
+    decoded = decode_image(_encode(Image.new("RGB", (2000, 1000))), min_size=640)
+    assert decoded.reduced
+    assert max(decoded.size) >= 640
+    assert decoded.original_size == (2000, 1000)
+    sx, sy = decoded.scale
+    assert sx == pytest.approx(2000 / decoded.size[0])
+    assert sy == pytest.approx(1000 / decoded.size[1])
+
+
+def test_png_is_decoded_at_full_size():
+    decoded = decode_image(_encode(Image.new("RGB", (2000, 1000)), "PNG"), min_size=640)
+    assert not decoded.reduced
+
+
+def test_exif_orientation_is_applied():
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    decoded = decode_image(_encode(Image.new("RGB", (300, 200)), exif=exif))
+    assert decoded.size == (200, 300)
+    assert decoded.original_size == (200, 300)
+
+
+def test_transparent_images_are_composited_on_white():
+    decoded = decode_image(_encode(Image.new("RGBA", (4, 4), (0, 0, 0, 0)), "PNG"))
+    assert decoded.array.shape == (4, 4, 3)
+    assert (decoded.array == 255).all()
+
+
+def test_16_bit_grayscale_becomes_8_bit_rgb():
+    image = Image.fromarray(np.full((4, 4), 65535, dtype=np.uint16))
+    decoded = decode_image(_encode(image, "PNG"))
+    assert decoded.array.dtype == np.uint8
+    assert decoded.array.shape == (4, 4, 3)
+    assert (decoded.array == 255).all()
+
+
+def test_decoded_array_is_read_only():
+    decoded = decode_image(_encode(Image.new("RGB", (10, 10))))
+    assert decoded.array.flags.c_contiguous
+    with pytest.raises(ValueError):
+        decoded.array[0, 0, 0] = 1
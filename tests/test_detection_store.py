@@ -0,0 +1,89 @@
+import pytest
+
+import detection_store
+from detection_store import DetectionStore
+from detections import Detections
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(detection_store.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _detections():
+    return Detections([[0, 0, 10, 10], [5, 5, 20, 20]], [0.9, 0.3], [0, 1])
+
+
+def test_entries_expire_after_the_ttl(clock):
+    store = DetectionStore(max_entries=10, ttl=60.0)
+    store.put("abc", _detections(), (100, 80), floor=0.1)
+    clock[0] += 59
+    entry = store.get("abc")
+    assert entry is not None and entry.original_size == (100, 80) and entry.floor == 0.1
+    clock[0] += 2
+    assert store.get("abc") is None
+    assert store.stats()["expired"] == 1
+
+
+def test_reading_an_entry_does_not_extend_its_ttl(clock):
+    store = DetectionStore(max_entries=10, ttl=60.0)
+    store.put("abc", _detections(), (100, 80), floor=0.1)
+    for _ in range(3):
+        clock[0] += 25
+        store.get("abc")
+    assert store.get("abc") is None
+
+
+def test_zero_ttl_keeps_entries_until_evicted(clock):
+    store = DetectionStore(max_entries=10, ttl=0)
+    store.put("abc", _detections(), (100, 80), floor=0.1)
+    clock[0] += 10 ** 6
+    assert store.get("abc") is not None
+
+
+def test_purge_expired_removes_entries_that_are_never_read(clock):
+    store = DetectionStore(max_entries=10, ttl=60.0)
+    store.put("old", _detections(), (100, 80), floor=0.1)
+    clock[0] += 30
+    store.put("new", _detections(), (100, 80), floor=0.1)
+    clock[0] += 40
+    assert store.purge_expired() == 1
+    assert store.stats()["entries"] == 1
+    assert store.get("new") is not None
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    store = DetectionStore(max_entries=2, ttl=60.0)
+    store.put("a", _detections(), (100, 80), floor=0.1)
+    store.put("b", _detections(), (100, 80), floor=0.1)
+    store.get("a")
+    store.put("c", _detections(), (100, 80), floor=0.1)
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+    assert store.stats()["evictions"] == 1
+
+
+def test_tiled_and_whole_image_detections_are_kept_apart(clock):
+    store = DetectionStore(max_entries=10, ttl=60.0)
+    store.put("abc", _detections(), (100, 80), floor=0.1, tiled=True)
+    assert store.get("abc") is None
+    assert store.get("abc", tiled=True) is not None
+
+
+def test_non_positive_max_entries_disables_the_store(clock):
+    store = DetectionStore(max_entries=0, ttl=60.0)
+    store.put("abc", _detections(), (100, 80), floor=0.1)
+    assert store.get("abc") is None
+    assert store.stats()["entries"] == 0
+
+
+def test_entries_of_another_namespace_are_dropped(clock):
+    store = DetectionStore(max_entries=10, ttl=60.0)
+    store.set_namespace("model-a:640")
+    store.put("abc", _detections(), (100, 80), floor=0.1)
+    store.set_namespace("model-a:640")
+    assert store.get("abc") is not None
+    store.set_namespace("model-b:640")
+    assert store.get("abc") is None
@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+import pytest
+
+from detections import Detections
+
+NAMES = {0: "Ascaris Lumbricoides", 1: "Taenia Sp", 2: "Trichuris Trichiura"}
+
+
+def _detections():
+    return Detections(
+        [[10.04, 20.06, 30.0, 40.0], [1, 2, 3, 4], [5, 5, 50, 50]],
+        [0.91234, 0.3, 0.6],
+        [2, 0, 2],
+    )
+
+
+def test_columnar_form_is_json_ready_and_names_only_present_classes():
+    payload = _detections().to_columnar(NAMES)
+    assert json.loads(json.dumps(payload)) == payload
+    assert payload["boxes"][0] == pytest.approx([10.0, 20.1, 30.0, 40.0])
+    assert payload["confidences"][0] == pytest.approx(0.9123)
+    assert payload["class_ids"] == [2, 0, 2]
+    assert payload["class_names"] == {"0": "Ascaris Lumbricoides", "2": "Trichuris Trichiura"}
+
+
+def test_columnar_round_trip():
+    detections = _detections()
+    restored = Detections.from_columnar(detections.to_columnar(NAMES))
+    np.testing.assert_allclose(restored.boxes, detections.boxes, atol=0.05)
+    np.testing.assert_allclose(restored.confidences, detections.confidences, atol=1e-4)
+    assert restored.class_ids.tolist() == detections.class_ids.tolist()
+
+
+def test_filter_keeps_detections_at_or_above_the_threshold():
+    assert _detections().filter(0.6).confidences.tolist() == [np.float32(0.91234), np.float32(0.6)]
+    assert len(_detections().filter(0.95)) == 0
+
+
+def test_empty_detections_serialise_to_empty_columns():
+    assert Detections.empty().to_columnar(NAMES) == {
+        "boxes": [], "confidences": [], "class_ids": [], "class_names": {},
+    }
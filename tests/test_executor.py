@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from executor import InferenceExecutor, Overloaded
+
+
+@pytest.fixture
+def executor():
+    executor = InferenceExecutor(kind="thread", workers=1, queue_size=2, endpoint_limits={"predict": 2})
+    yield executor
+    executor.shutdown()
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+async def _blocked(executor, release, *endpoints):
+    """Start one blocking job per endpoint; returns the tasks awaiting them."""
+    tasks = [asyncio.ensure_future(executor.run(endpoint, release.wait, 5)) for endpoint in endpoints]
+    # Give the jobs a chance to be admitted
+    await asyncio.sleep(0)
+    return tasks
+
+
+def test_endpoint_limit_is_rejected_with_429(executor):
+    async def scenario():
+        release = threading.Event()
+        tasks = await _blocked(executor, release, "predict", "predict")
+        try:
+            with pytest.raises(Overloaded) as info:
+                await executor.run("predict", sum, [1])
+        finally:
+            release.set()
+            await asyncio.gather(*tasks)
+        return info.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.retry_after >= 1
+    assert executor.stats()["rejected"] == {"predict": 1}
+
+
+def test_full_executor_is_rejected_with_503(executor):
+    assert executor.capacity == 3
+
+    async def scenario():
+        release = threading.Event()
+        tasks = await _blocked(executor, release, "predict", "predict", "generate_heatmap")
+        try:
+            with pytest.raises(Overloaded) as info:
+                await executor.run("other", sum, [1])
+        finally:
+            release.set()
+            await asyncio.gather(*tasks)
+        return info.value
+
+    assert asyncio.run(scenario()).status_code == 503
+
+
+def test_slots_are_released_when_the_work_finishes(executor):
+    assert asyncio.run(executor.run("predict", sum, [1, 2, 3])) == 6
+    stats = executor.stats()
+    assert stats["in_flight"] == 0
+    assert stats["completed"] == 1
+
+
+def test_retry_after_follows_the_backlog_and_service_time(executor):
+    executor._avg_service_time = 2.5
+
+    async def scenario():
+        release = threading.Event()
+        tasks = await _blocked(executor, release, "a", "b", "c")
+        try:
+            with pytest.raises(Overloaded) as info:
+                await executor.run("d", sum, [1])
+        finally:
+            release.set()
+            await asyncio.gather(*tasks)
+        return info.value
+
+    # Three jobs ahead on one worker at 2.5 s each
+    assert asyncio.run(scenario()).retry_after == 8
+
+
+def test_run_releases_the_slot_even_if_the_caller_gives_up(executor):
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    async def give_up():
+        task = asyncio.ensure_future(executor.run("predict", block))
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+
+    asyncio.run(give_up())
+    assert executor.stats()["in_flight"] == 1
+    release.set()
+    assert _wait_until(lambda: executor.stats()["in_flight"] == 0)
+
+
+def test_admit_holds_one_slot_for_a_multi_stage_request(executor):
+    async def scenario():
+        with executor.admit("predict"):
+            assert executor.stats()["in_flight"] == 1
+            # Stages of an admitted request don't take further slots
+            assert await executor.call(sum, [1, 2]) == 3
+            assert executor.stats()["in_flight"] == 1
+        assert executor.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+    with executor.admit("predict"), executor.admit("predict"):
+        with pytest.raises(Overloaded) as info:
+            with executor.admit("predict"):
+                pass
+    assert info.value.status_code == 429
+
+
+def test_run_blocking_returns_the_result_and_shares_the_limits(executor):
+    release = threading.Event()
+    worker = threading.Thread(target=executor.run_blocking, args=("predict", release.wait, 5))
+    worker.start()
+    try:
+        assert _wait_until(lambda: executor.stats()["in_flight"] == 1)
+        assert executor.run_blocking("predict", sum, [1, 2]) == 3
+        release.set()
+        worker.join()
+    finally:
+        release.set()
+    assert _wait_until(lambda: executor.stats()["in_flight"] == 0)
+
+
+def test_process_executor_refuses_work_before_it_is_started():
+    executor = InferenceExecutor(kind="process", workers=1, queue_size=1)
+    with pytest.raises(Overloaded) as info:
+        asyncio.run(executor.run("predict", sum, [1]))
+    assert info.value.status_code == 503
+    assert executor.stats()["in_flight"] == 0
+
+
+def test_admit_waiting_waits_for_a_released_slot(executor):
+    async def scenario():
+        release = threading.Event()
+        tasks = await _blocked(executor, release, "predict", "predict", "generate_heatmap")
+        admitted = asyncio.Event()
+
+        async def bulk_image():
+            async with executor.admit_waiting("predict_batch_images"):
+                admitted.set()
+
+        waiting = asyncio.ensure_future(bulk_image())
+        await asyncio.sleep(0.1)
+        # A full executor makes it wait rather than reject
+        assert not admitted.is_set()
+        release.set()
+        await asyncio.wait_for(waiting, 5)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert _wait_until(lambda: executor.stats()["in_flight"] == 0)
+    assert executor.stats()["rejected"] == {}
+
+
+def test_cancelled_admit_waiting_gives_no_slot_away(executor):
+    async def scenario():
+        release = threading.Event()
+        tasks = await _blocked(executor, release, "predict", "predict", "generate_heatmap")
+
+        async def bulk_image():
+            async with executor.admit_waiting("predict_batch_images"):
+                pass
+
+        waiting = asyncio.ensure_future(bulk_image())
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert _wait_until(lambda: executor.stats()["in_flight"] == 0)
+    assert executor.stats()["in_flight_per_endpoint"] == {}
@@ -0,0 +1,159 @@
+import json
+import threading
+import time
+
+import pytest
+
+from jobs import CANCELLED, FAILED, QUEUED, SUCCEEDED, JobCancelled, JobQueue, JobQueueFull
+from tests.conftest import requires_model
+
+
+def _wait_for(queue, job_id, states, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in states:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} is still {queue.get(job_id)['status']}")
+
+
+def test_jobs_run_in_priority_order_with_progress():
+    order = []
+
+    def handler(kind, payload, params, report):
+        report("working", 0.5)
+        order.append(params["name"])
+        return payload.decode()
+
+    queue = JobQueue(handler)
+    low = queue.submit("test", b"low", {"name": "low"}, priority=0)
+    high = queue.submit("test", b"high", {"name": "high"}, priority=5)
+    assert queue.get(low)["queue_position"] == 2
+    assert queue.get(high)["queue_position"] == 1
+    queue.start()
+    try:
+        job = _wait_for(queue, low, (SUCCEEDED,))
+    finally:
+        queue.close()
+    assert order == ["high", "low"]
+    assert job["result"] == "low"
+    assert job["progress"] == 1.0
+    assert job["stage"] == "done"
+
+
+def test_failed_jobs_record_the_error():
+    def handler(kind, payload, params, report):
+        raise ValueError("broken image")
+
+    queue = JobQueue(handler)
+    queue.start()
+    try:
+        job = _wait_for(queue, queue.submit("test", b""), (FAILED,))
+    finally:
+        queue.close()
+    assert job["error"] == "broken image"
+
+
+def test_full_queue_rejects_submissions():
+    queue = JobQueue(lambda *args: None, max_queued=1)
+    queue.submit("test", b"")
+    with pytest.raises(JobQueueFull):
+        queue.submit("test", b"")
+
+
+def test_cancelled_job_is_not_flipped_to_succeeded():
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(kind, payload, params, report):
+        started.set()
+        release.wait(5)
+        # Finishing without another progress report must not undo the cancel
+        return "done"
+
+    queue = JobQueue(handler)
+    queue.start()
+    try:
+        job_id = queue.submit("test", b"")
+        assert started.wait(5)
+        assert queue.cancel(job_id)
+        release.set()
+        time.sleep(0.1)
+        assert queue.get(job_id)["status"] == CANCELLED
+        assert not queue.cancel(job_id)
+    finally:
+        release.set()
+        queue.close()
+
+
+def test_cancel_stops_a_running_job_at_its_next_report():
+    started = threading.Event()
+    release = threading.Event()
+    reached = []
+
+    def handler(kind, payload, params, report):
+        started.set()
+        release.wait(5)
+        try:
+            report("next", 0.5)
+        except JobCancelled:
+            reached.append("cancelled")
+            raise
+        return "done"
+
+    queue = JobQueue(handler)
+    queue.start()
+    try:
+        job_id = queue.submit("test", b"")
+        assert started.wait(5)
+        queue.cancel(job_id)
+        release.set()
+        assert _wait_for(queue, job_id, (CANCELLED,))["stage"] == "started"
+        time.sleep(0.1)
+    finally:
+        queue.close()
+    assert reached == ["cancelled"]
+
+
+def test_cancelled_queued_job_never_runs():
+    ran = []
+    queue = JobQueue(lambda kind, payload, params, report: ran.append(payload))
+    job_id = queue.submit("test", b"x")
+    assert queue.get(job_id)["status"] == QUEUED
+    assert queue.cancel(job_id)
+    queue.start()
+    time.sleep(0.1)
+    queue.close()
+    assert ran == []
+    assert queue.stats()["queued"] == 0
+
+
+def test_finished_jobs_expire():
+    queue = JobQueue(lambda *args: None, result_ttl=0.0)
+    job_id = queue.complete("test", "result")
+    time.sleep(0.01)
+    assert queue.purge_expired() == 1
+    assert queue.get(job_id) is None
+
+
+@requires_model
+def test_unknown_job_events_are_404(api):
+    assert api.get("/heatmap_jobs/missing/events").status_code == 404
+
+
+@requires_model
+def test_job_events_stream_until_the_job_finishes(api):
+    with open("data/00.jpg", "rb") as f:
+        submitted = api.post("/heatmap_jobs", files={"file": ("00.jpg", f, "image/jpeg")}).json()
+    events = []
+    with api.stream("GET", f"/heatmap_jobs/{submitted['job_id']}/events") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        for line in response.iter_lines():
+            if line.startswith("event: "):
+                events.append(line[len("event: "):])
+            elif line.startswith("data: "):
+                last = json.loads(line[len("data: "):])
+    assert events[-1] == SUCCEEDED
+    assert last["image_heatmap"]
+    assert last["params"]["image_hash"] == submitted["image_hash"]
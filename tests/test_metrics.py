@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from metrics import COUNT_BUCKETS, Registry, RequestMetricsMiddleware
+from tests.conftest import requires_model
+
+
+def _samples(text):
+    """``{'name{labels}': value}`` for every sample line of an exposition."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_counter_is_rendered_per_label_set():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ("endpoint",))
+    requests.inc(endpoint="/predict")
+    requests.inc(2, endpoint="/predict")
+    requests.inc(endpoint="/render")
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert _samples(text) == {
+        'requests_total{endpoint="/predict"}': 3,
+        'requests_total{endpoint="/render"}': 1,
+    }
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    detections = registry.histogram("detections", "Detections per image", buckets=COUNT_BUCKETS)
+    for value in (0, 1, 3, 1000):
+        detections.observe(value)
+    samples = _samples(registry.render())
+    assert samples['detections_bucket{le="0"}'] == 1
+    assert samples['detections_bucket{le="1"}'] == 2
+    assert samples['detections_bucket{le="5"}'] == 3
+    assert samples['detections_bucket{le="500"}'] == 3
+    assert samples['detections_bucket{le="+Inf"}'] == 4
+    assert samples["detections_count"] == 4
+    assert samples["detections_sum"] == 1004
+
+
+def test_wrong_labels_are_rejected():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ("endpoint",))
+    with pytest.raises(ValueError):
+        requests.inc(route="/predict")
+    with pytest.raises(ValueError):
+        registry.counter("requests_total", "Registered twice")
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("errors_total", "Errors", ("detail",)).inc(detail='bad "quote"\n')
+    assert 'errors_total{detail="bad \\"quote\\"\\n"} 1' in registry.render()
+
+
+def test_callbacks_are_evaluated_at_scrape_time_and_failures_are_skipped():
+    registry = Registry()
+    state = {"size": 1}
+    registry.gauge_callback("cache_bytes", "Cache size", lambda: state["size"])
+    registry.counter_callback("hits_total", "Hits", lambda: {"memory": 4, "disk": None}, ("tier",))
+    registry.gauge_callback("broken", "Broken collector", lambda: 1 / 0)
+    state["size"] = 5
+    samples = _samples(registry.render())
+    assert samples == {"cache_bytes": 5, 'hits_total{tier="memory"}': 4}
+
+
+def test_middleware_records_route_status_and_sizes():
+    registry = Registry()
+    finished = []
+
+    class Route:
+        path = "/items/{item_id}"
+
+    async def app(scope, receive, send):
+        scope["route"] = Route()
+        await receive()
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b"created"})
+
+    async def receive():
+        return {"type": "http.request", "body": b"12345", "more_body": False}
+
+    async def send(message):
+        pass
+
+    middleware = RequestMetricsMiddleware(
+        app, registry, listeners=[lambda endpoint, started, done, status: finished.append((endpoint, status))]
+    )
+    asyncio.run(middleware({"type": "http", "path": "/items/7"}, receive, send))
+
+    samples = _samples(registry.render())
+    assert samples['parasite_http_requests_total{endpoint="/items/{item_id}",status="201"}'] == 1
+    assert samples['parasite_http_request_bytes_sum{endpoint="/items/{item_id}"}'] == 5
+    assert samples['parasite_http_response_bytes_sum{endpoint="/items/{item_id}"}'] == 7
+    assert finished == [("/items/{item_id}", 201)]
+
+
+@requires_model
+def test_metrics_endpoint_reports_stages(api):
+    with open("data/00.jpg", "rb") as f:
+        assert api.post("/predict", files={"file": ("00.jpg", f, "image/jpeg")}).status_code == 200
+    response = api.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = _samples(response.text)
+    assert samples['parasite_http_requests_total{endpoint="/predict",status="200"}'] >= 1
+    assert any(name.startswith('parasite_stage_duration_seconds_count{endpoint="predict",') for name in samples)
@@ -0,0 +1,67 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from detections import Detections
+from rendering import draw_detections, encode_image
+from tests.conftest import requires_model
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, size=(300, 400, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("fmt, media_type, pil_format", [
+    ("jpeg", "image/jpeg", "JPEG"),
+    ("webp", "image/webp", "WEBP"),
+    ("png", "image/png", "PNG"),
+])
+def test_encode_image_formats(image, fmt, media_type, pil_format):
+    body, returned_type = encode_image(image, fmt)
+    assert returned_type == media_type
+    with Image.open(io.BytesIO(body)) as decoded:
+        assert decoded.format == pil_format
+        assert decoded.size == (400, 300)
+
+
+def test_encode_image_downscales_to_max_size(image):
+    body, _ = encode_image(image, "jpeg", max_size=200)
+    with Image.open(io.BytesIO(body)) as decoded:
+        assert decoded.size == (200, 150)
+    # Images already within max_size are left alone
+    body, _ = encode_image(image, "jpeg", max_size=1000)
+    with Image.open(io.BytesIO(body)) as decoded:
+        assert decoded.size == (400, 300)
+
+
+def test_encode_image_quality_trades_size(image):
+    small, _ = encode_image(image, "jpeg", quality=20)
+    large, _ = encode_image(image, "jpeg", quality=95)
+    assert len(small) < len(large)
+
+
+def test_encode_image_rejects_unknown_formats(image):
+    with pytest.raises(ValueError):
+        encode_image(image, "gif")
+
+
+def test_draw_detections_draws_on_a_copy(image):
+    original = image.copy()
+    detections = Detections([[50, 50, 150, 150]], [0.9], [0])
+    drawn = draw_detections(image, detections, {0: "egg"})
+    assert drawn.shape == image.shape
+    assert not np.array_equal(drawn, original)
+    np.testing.assert_array_equal(image, original)
+
+
+@requires_model
+@pytest.mark.parametrize("params", [{"max_size": -1}, {"quality": 0}, {"quality": 101}])
+def test_render_rejects_invalid_output_settings(api, params):
+    with open("data/00.jpg", "rb") as f:
+        response = api.post("/render", params=params, files={"file": ("00.jpg", f, "image/jpeg")})
+    assert response.status_code == 400
+    assert next(iter(params)) in response.json()["detail"]
@@ -0,0 +1,90 @@
+import os
+
+from result_cache import ResultCache, hash_image, make_key
+
+
+def test_make_key_is_independent_of_parameter_order():
+    assert make_key("predict", "abc", b=1, a=2) == make_key("predict", "abc", a=2, b=1)
+    assert make_key("predict", "abc", a=1) != make_key("render", "abc", a=1)
+
+
+def test_hash_image_is_the_sha256_of_the_bytes():
+    assert hash_image(b"") == "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    cache = ResultCache(max_bytes=30)
+    for name in "abc":
+        cache.put(make_key("predict", name), b"x" * 10)
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get(make_key("predict", "a")) is not None
+    cache.put(make_key("predict", "d"), b"x" * 10)
+    assert cache.get(make_key("predict", "b")) is None
+    assert all(cache.get(make_key("predict", name)) is not None for name in "acd")
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 30
+
+
+def test_memory_stays_within_its_byte_budget():
+    cache = ResultCache(max_bytes=100)
+    for i in range(20):
+        cache.put(make_key("predict", str(i)), b"x" * (i + 1))
+        assert cache.stats()["bytes"] <= 100
+    # A value larger than the whole budget is not cached at all
+    cache.put(make_key("predict", "huge"), b"x" * 101)
+    assert cache.get(make_key("predict", "huge")) is None
+    assert cache.stats()["bytes"] <= 100
+
+
+def test_replacing_a_key_does_not_count_it_twice():
+    cache = ResultCache(max_bytes=100)
+    key = make_key("predict", "a")
+    cache.put(key, b"x" * 40)
+    cache.put(key, b"y" * 60)
+    assert cache.stats()["bytes"] == 60
+    assert cache.get(key) == b"y" * 60
+
+
+def test_evicted_entries_spill_to_disk_and_are_promoted_back(tmp_path):
+    cache = ResultCache(max_bytes=10, disk_dir=str(tmp_path), disk_max_bytes=1000)
+    first, second = make_key("predict", "a"), make_key("predict", "b")
+    cache.put(first, b"a" * 10)
+    cache.put(second, b"b" * 10)
+    assert cache.stats()["disk_entries"] == 1
+    assert cache.get(first) == b"a" * 10
+    assert cache.stats()["disk_hits"] == {"predict": 1}
+
+
+def test_disk_tier_stays_within_its_byte_budget(tmp_path):
+    cache = ResultCache(max_bytes=1, disk_dir=str(tmp_path), disk_max_bytes=25)
+    for i in range(5):
+        cache.put(make_key("predict", str(i)), b"x" * 10)
+    stats = cache.stats()
+    assert stats["disk_bytes"] <= 25
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".bin")]) == stats["disk_entries"] == 2
+
+
+def test_memory_only_kinds_never_reach_disk(tmp_path):
+    cache = ResultCache(max_bytes=10, disk_dir=str(tmp_path), disk_max_bytes=1000, memory_only_kinds=("image",))
+    cache.put(make_key("image", "a"), b"a" * 10)
+    cache.put(make_key("image", "b"), b"b" * 10)
+    assert cache.stats()["disk_entries"] == 0
+    assert cache.get(make_key("image", "a")) is None
+
+
+def test_disk_tier_is_cleared_when_the_model_changes(tmp_path):
+    key = make_key("predict", "a")
+    cache = ResultCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=1000)
+    cache.set_namespace("model-1")
+    cache.put(key, b"result")
+
+    same_model = ResultCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=1000)
+    same_model.set_namespace("model-1")
+    assert same_model.get(key) == b"result"
+
+    other_model = ResultCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=1000)
+    other_model.set_namespace("model-2")
+    assert other_model.get(key) is None
+    assert other_model.stats()["disk_entries"] == 0
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".bin")]
@@ -0,0 +1,80 @@
+import pytest
+
+import runtime
+from runtime import ModelRuntime, load_runtime, read_metadata
+
+
+@pytest.fixture
+def loaders(monkeypatch):
+    """Fake loaders; a backend listed in ``failing`` raises instead of loading."""
+    tried, failing = [], set()
+
+    def loader(name):
+        def load(artifact):
+            tried.append(name)
+            if name in failing:
+                raise FileNotFoundError(f"{artifact} does not exist")
+            return ModelRuntime(object(), name, artifact, {0: "egg"}, 640)
+        return load
+
+    monkeypatch.setattr(runtime, "LOADERS", {"pytorch": loader("pytorch"), "openvino": loader("openvino")})
+    return tried, failing
+
+
+def test_auto_prefers_openvino(loaders):
+    tried, _ = loaders
+    loaded, errors = load_runtime("auto", "best.pt", "best_openvino_model")
+    assert loaded.backend == "openvino"
+    assert loaded.artifact == "best_openvino_model"
+    assert errors == {}
+    assert tried == ["openvino"]
+
+
+def test_falls_back_to_the_other_backend(loaders):
+    tried, failing = loaders
+    failing.add("pytorch")
+    loaded, errors = load_runtime("pytorch", "best.pt", "best_openvino_model")
+    assert loaded.backend == "openvino"
+    assert tried == ["pytorch", "openvino"]
+    assert errors == {"pytorch": "best.pt does not exist"}
+
+
+def test_reports_every_failure_when_nothing_loads(loaders):
+    _, failing = loaders
+    failing.update({"pytorch", "openvino"})
+    loaded, errors = load_runtime("auto", "best.pt", "best_openvino_model")
+    assert loaded is None
+    assert set(errors) == {"pytorch", "openvino"}
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        load_runtime("tensorrt", "best.pt", "best_openvino_model")
+
+
+def test_missing_artifacts_are_reported_without_importing_a_model(tmp_path):
+    loaded, errors = load_runtime("auto", str(tmp_path / "best.pt"), str(tmp_path / "openvino"))
+    assert loaded is None
+    assert errors["pytorch"].endswith("does not exist")
+    assert errors["openvino"].endswith("does not exist")
+
+    (tmp_path / "openvino").mkdir()
+    (tmp_path / "openvino" / "best.xml").write_text("<net/>")
+    _, errors = load_runtime("openvino", str(tmp_path / "best.pt"), str(tmp_path / "openvino"))
+    assert errors["openvino"].endswith("best.bin is missing")
+
+
+def test_read_metadata(tmp_path):
+    assert read_metadata(str(tmp_path)) == {}
+    (tmp_path / "metadata.yaml").write_text("imgsz: [640, 640]\nbatch: 4\n")
+    assert read_metadata(str(tmp_path)) == {"imgsz": [640, 640], "batch": 4}
+
+
+def test_identity_changes_when_the_artifact_changes(tmp_path):
+    weights = tmp_path / "best.pt"
+    weights.write_bytes(b"weights")
+    identity = runtime.artifact_identity("pytorch", str(weights))
+    assert identity == runtime.artifact_identity("pytorch", str(weights))
+    assert identity != runtime.artifact_identity("openvino", str(weights))
+    weights.write_bytes(b"retrained weights")
+    assert identity != runtime.artifact_identity("pytorch", str(weights))
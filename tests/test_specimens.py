@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from detections import Detections
+from specimens import CONFIDENCE_BINS, UNKNOWN_SPECIES, SpecimenStore, UnknownSpecimen
+from tests.conftest import requires_model
+
+
+def _field(*entries):
+    """Detections and species names from ``(species, confidence)`` pairs."""
+    boxes = [[i * 20, 0, i * 20 + 10, 10] for i in range(len(entries))]
+    detections = Detections(boxes, [confidence for _, confidence in entries], [0] * len(entries))
+    return detections, [species for species, _ in entries]
+
+
+@pytest.fixture
+def store():
+    return SpecimenStore()
+
+
+def _add(store, specimen_id, image_hash, *entries, size=(1000, 1000)):
+    detections, species = _field(*entries)
+    return store.add_field(specimen_id, image_hash, detections, species, size, 0.25)
+
+
+def test_summary_aggregates_all_fields(store):
+    specimen_id = store.create("stool sample")
+    _add(store, specimen_id, "a", ("Ascaris", 0.9), ("Ascaris", 0.7), ("Hymenolepis", 0.6))
+    _add(store, specimen_id, "b")
+    _add(store, specimen_id, "c", ("Ascaris", 0.8))
+
+    summary = store.summary(specimen_id)
+    assert summary["name"] == "stool sample"
+    assert summary["fields"] == 3
+    assert summary["positive_fields"] == 2
+    assert summary["total_detections"] == 4
+    assert summary["species_counts"] == {"Ascaris": 3, "Hymenolepis": 1}
+    assert summary["species_mean_confidence"]["Ascaris"] == pytest.approx(0.8)
+    assert summary["mean_confidence"] == pytest.approx(0.75)
+    # Eggs per field are 3, 0 and 1
+    assert summary["eggs_per_field"]["mean"] == pytest.approx(4 / 3)
+    assert summary["eggs_per_field"]["std"] == pytest.approx(np.std([3, 0, 1]))
+    assert summary["eggs_per_field"]["max"] == 3
+    assert summary["eggs_per_megapixel"] == pytest.approx(4 / 3)
+
+
+def test_unknown_species_is_not_a_unique_species(store):
+    specimen_id = store.create()
+    _add(store, specimen_id, "a", ("Ascaris", 0.9), (UNKNOWN_SPECIES, 0.3), (UNKNOWN_SPECIES, 0.4))
+    summary = store.summary(specimen_id)
+    assert summary["unique_species"] == 1
+    assert summary["species_counts"] == {"Ascaris": 1, UNKNOWN_SPECIES: 2}
+
+
+def test_confidence_histogram_counts_every_detection(store):
+    specimen_id = store.create()
+    _add(store, specimen_id, "a", ("Ascaris", 0.01), ("Ascaris", 0.52), ("Ascaris", 1.0))
+    histogram = store.summary(specimen_id)["confidence_histogram"]
+    assert len(histogram["bin_edges"]) == CONFIDENCE_BINS + 1
+    assert sum(histogram["counts"]) == 3
+    assert histogram["counts"][0] == 1
+    assert histogram["counts"][10] == 1
+    assert histogram["counts"][-1] == 1
+
+
+def test_an_image_is_only_counted_once(store):
+    specimen_id = store.create()
+    assert _add(store, specimen_id, "a", ("Ascaris", 0.9)) == (1, True)
+    assert _add(store, specimen_id, "a", ("Ascaris", 0.9)) == (1, False)
+    assert _add(store, specimen_id, "b", ("Ascaris", 0.9)) == (2, True)
+    assert store.summary(specimen_id)["total_detections"] == 2
+
+
+def test_fields_are_exported_in_order_across_pages(store):
+    specimen_id = store.create()
+    for i in range(5):
+        _add(store, specimen_id, f"image-{i}", *[("Ascaris", 0.5)] * i, size=(640, 480))
+    fields = list(store.iter_fields(specimen_id, page_size=2))
+    assert [field["field"] for field, _ in fields] == [1, 2, 3, 4, 5]
+    assert [len(detections) for _, detections in fields] == [0, 1, 2, 3, 4]
+    field, detections = fields[2]
+    assert (field["image_hash"], field["width"], field["height"]) == ("image-2", 640, 480)
+    np.testing.assert_allclose(detections.boxes[1], [20, 0, 30, 10])
+
+
+def test_unknown_and_deleted_specimens(store):
+    with pytest.raises(UnknownSpecimen):
+        _add(store, "missing", "a")
+    assert store.summary("missing") is None
+    specimen_id = store.create()
+    _add(store, specimen_id, "a", ("Ascaris", 0.9))
+    assert store.delete(specimen_id)
+    assert not store.exists(specimen_id)
+    assert store.stats() == {"specimens": 0, "fields": 0}
+
+
+@requires_model
+def test_specimen_api_attaches_fields_and_exports_them(api):
+    specimen_id = api.post("/specimens", params={"name": "api test"}).json()["specimen_id"]
+    for name in ("00.jpg", "01.jpg"):
+        with open(f"data/{name}", "rb") as f:
+            response = api.post(f"/specimens/{specimen_id}/images", files={"file": (name, f, "image/jpeg")})
+        assert response.status_code == 200
+    summary = api.get(f"/specimens/{specimen_id}").json()
+    assert summary["fields"] == 2
+    export = api.get(f"/specimens/{specimen_id}/detections").text.splitlines()
+    assert len(export) == 2
@@ -0,0 +1,41 @@
+from tests.conftest import requires_model
+
+
+@requires_model
+def test_liveness_and_readiness(api):
+    assert api.get("/health/live").json() == {"status": "alive"}
+    ready = api.get("/health/ready")
+    assert ready.status_code == 200
+    assert ready.json()["status"] == "ready"
+    assert "load_model" in ready.json()["phases_ms"]
+
+
+@requires_model
+def test_detection_is_refused_while_starting(api, monkeypatch):
+    import backend
+
+    monkeypatch.setitem(backend.startup_state, "status", "starting")
+    assert api.get("/health/ready").status_code == 503
+    with open("data/00.jpg", "rb") as f:
+        response = api.post("/predict", files={"file": ("00.jpg", f, "image/jpeg")})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+
+@requires_model
+def test_explainer_preload_failure_is_reported(api, monkeypatch):
+    import backend
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("no explainer")
+
+    monkeypatch.setattr(backend.explainer_pool, "preload", fail)
+    monkeypatch.setattr(backend.config, "EXPLAINER_PRELOAD", True)
+    monkeypatch.setattr(backend.config, "WARMUP_ENABLED", False)
+    for key in ("status", "error", "explainer_error"):
+        monkeypatch.setitem(backend.startup_state, key, backend.startup_state[key])
+    backend._startup()
+    report = api.get("/health/ready").json()
+    # Heatmaps still work without preloaded explainers
+    assert report["status"] == "ready"
+    assert report["explainer_error"] == "no explainer"
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from detections import Detections
+from tests.conftest import requires_model
+from tiling import (
+    count_tiles, iter_tile_batches, merge_detections, nms_keep, region_window, tile_windows, to_global,
+)
+
+
+def _detections(boxes, confidences, class_ids=None):
+    return Detections(boxes, confidences, class_ids if class_ids is not None else [0] * len(confidences))
+
+
+def test_nms_drops_lower_scored_duplicates():
+    detections = _detections(
+        [[0, 0, 10, 10], [1, 1, 11, 11], [50, 50, 60, 60]],
+        [0.6, 0.9, 0.7],
+    )
+    merged = merge_detections(detections, method="nms")
+    np.testing.assert_allclose(merged.confidences, [0.9, 0.7])
+
+
+def test_nms_treats_a_box_cut_at_a_seam_as_a_duplicate():
+    # The half box has a low IoU with the full one but lies entirely inside it
+    detections = _detections([[0, 0, 20, 20], [10, 0, 20, 20]], [0.8, 0.7])
+    merged = merge_detections(detections, method="nms")
+    assert merged.boxes.tolist() == [[0, 0, 20, 20]]
+
+
+def test_nms_only_merges_within_a_class():
+    detections = _detections([[0, 0, 10, 10], [0, 0, 10, 10]], [0.8, 0.7], [0, 1])
+    assert len(merge_detections(detections, method="nms")) == 2
+
+
+def test_wbf_averages_boxes_weighted_by_confidence():
+    detections = _detections([[0, 0, 10, 10], [2, 2, 12, 12], [50, 50, 60, 60]], [0.75, 0.25, 0.5])
+    merged = merge_detections(detections, method="wbf", threshold=0.5)
+    assert len(merged) == 2
+    np.testing.assert_allclose(merged.boxes[0], [0.5, 0.5, 10.5, 10.5])
+    np.testing.assert_allclose(merged.confidences, [0.5, 0.5])
+
+
+def test_merge_detections_handles_empty_input_and_rejects_unknown_methods():
+    assert len(merge_detections(Detections.empty(), method="wbf")) == 0
+    with pytest.raises(ValueError):
+        merge_detections(_detections([[0, 0, 1, 1]], [0.5]), method="soft-nms")
+
+
+def test_tile_windows_cover_the_image_with_full_size_tiles():
+    windows = list(tile_windows(1500, 700, tile_size=640, overlap=0.2))
+    assert len(windows) == count_tiles(1500, 700, tile_size=640, overlap=0.2)
+    assert all(x1 - x0 == 640 and y1 - y0 == 640 for x0, y0, x1, y1 in windows)
+    assert max(x1 for _, _, x1, _ in windows) == 1500
+    assert max(y1 for _, _, _, y1 in windows) == 700
+
+
+def test_small_images_are_a_single_tile():
+    assert list(tile_windows(300, 200, tile_size=640)) == [(0, 0, 300, 200)]
+
+
+def test_tile_batches_are_views_into_the_image():
+    image = np.zeros((700, 1500, 3), dtype=np.uint8)
+    batches = list(iter_tile_batches(image, tile_size=640, overlap=0.2, batch_size=4))
+    assert [len(windows) for windows, _ in batches] == [4, 2]
+    windows, crops = batches[0]
+    assert all(np.shares_memory(crop, image) for crop in crops)
+    assert crops[1].shape == (640, 640, 3)
+
+
+def test_to_global_shifts_boxes_by_the_window_origin():
+    local = _detections([[1, 2, 3, 4]], [0.5])
+    assert to_global(local, (100, 200, 740, 840)).boxes.tolist() == [[101, 202, 103, 204]]
+
+
+def test_nms_keep_returns_the_indices_merge_detections_keeps():
+    detections = _detections(
+        [[0, 0, 10, 10], [1, 1, 11, 11], [50, 50, 60, 60]],
+        [0.6, 0.9, 0.7],
+    )
+    keep = nms_keep(detections)
+    assert sorted(keep.tolist()) == [1, 2]
+    merged = merge_detections(detections, method="nms")
+    np.testing.assert_allclose(sorted(detections.confidences[keep]), sorted(merged.confidences))
+
+
+def test_region_window_is_centred_on_the_box():
+    assert region_window([1000, 1000, 1040, 1040], 4000, 3000) == (700, 700, 1340, 1340)
+
+
+def test_region_window_stays_inside_the_image():
+    assert region_window([0, 0, 20, 20], 4000, 3000) == (0, 0, 640, 640)
+    assert region_window([3990, 2990, 4000, 3000], 4000, 3000) == (3360, 2360, 4000, 3000)
+    # Images smaller than the window are covered completely
+    assert region_window([10, 10, 50, 50], 300, 200) == (0, 0, 300, 200)
+
+
+def test_region_window_grows_for_large_boxes():
+    left, top, right, bottom = region_window([0, 0, 1000, 100], 4000, 3000)
+    assert right - left == 1100
+    assert bottom - top == 640
+
+
+@requires_model
+def test_cascade_reports_the_stage_of_every_detection(api):
+    with open("data/01.jpg", "rb") as f:
+        response = api.post(
+            "/predict",
+            params={"cascade": "true", "response_format": "detections"},
+            files={"file": ("01.jpg", f, "image/jpeg")},
+        )
+    assert response.status_code == 200
+    payload = response.json()
+    assert len(payload["stages"]) == len(payload["confidences"])
+    assert set(payload["stages"]) <= {"coarse", "refine", "tiled"}
+    assert payload["cascade"]["refined"] in (None, "refine", "tiled")
+
+
+@requires_model
+def test_cascade_and_tiled_are_exclusive(api):
+    with open("data/01.jpg", "rb") as f:
+        response = api.post(
+            "/predict", params={"cascade": "true", "tiled": "true"}, files={"file": ("01.jpg", f, "image/jpeg")}
+        )
+    assert response.status_code == 400
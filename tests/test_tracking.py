@@ -0,0 +1,83 @@
+import pytest
+
+from detections import Detections
+from tests.conftest import requires_model
+from tracking import IoUTracker
+
+
+def _frame(*boxes, class_id=0, confidence=0.9):
+    return Detections(list(boxes), [confidence] * len(boxes), [class_id] * len(boxes))
+
+
+def _run(tracker, frames):
+    counted = []
+    for frame in frames:
+        _, confirmed = tracker.update(frame)
+        counted.extend(track.id for track in confirmed)
+    return counted
+
+
+def test_an_egg_in_view_is_counted_once_after_min_hits_frames():
+    tracker = IoUTracker(iou_threshold=0.3, max_missed=2, min_hits=3)
+    # Slow stage movement: the box shifts a little every frame
+    frames = [_frame([10 + i, 10, 50 + i, 50]) for i in range(10)]
+    assert _run(tracker, frames[:2]) == []
+    assert _run(tracker, frames[2:]) == [1]
+
+
+def test_single_frame_detections_are_never_counted():
+    tracker = IoUTracker(min_hits=2)
+    frames = [_frame([0, 0, 10, 10]), _frame(), _frame([100, 100, 110, 110]), _frame()]
+    assert _run(tracker, frames) == []
+
+
+def test_track_ids_follow_detections_across_frames():
+    tracker = IoUTracker(min_hits=1)
+    first, _ = tracker.update(_frame([0, 0, 10, 10], [100, 100, 120, 120]))
+    second, _ = tracker.update(_frame([101, 101, 121, 121], [1, 1, 11, 11]))
+    assert second.tolist() == first.tolist()[::-1]
+
+
+def test_an_egg_lost_for_longer_than_max_missed_is_counted_again():
+    tracker = IoUTracker(max_missed=1, min_hits=1)
+    egg = _frame([0, 0, 10, 10])
+    assert _run(tracker, [egg, _frame(), egg]) == [1]
+    assert _run(tracker, [_frame(), _frame(), egg]) == [2]
+
+
+def test_reset_starts_a_new_slide():
+    tracker = IoUTracker(min_hits=1)
+    _run(tracker, [_frame([0, 0, 10, 10])])
+    tracker.reset()
+    assert tracker.tracks == []
+    assert _run(tracker, [_frame([0, 0, 10, 10])]) == [1]
+
+
+def test_class_is_decided_by_confidence_weighted_votes():
+    tracker = IoUTracker(min_hits=1)
+    tracker.update(_frame([0, 0, 10, 10], class_id=2, confidence=0.9))
+    tracker.update(_frame([0, 0, 10, 10], class_id=5, confidence=0.4))
+    tracker.update(_frame([0, 0, 10, 10], class_id=2, confidence=0.8))
+    assert tracker.tracks[0].class_id == 2
+    assert tracker.tracks[0].best_confidence == pytest.approx(0.9)
+
+
+@requires_model
+def test_live_stream_answers_frames_and_rejects_invalid_commands(api):
+    import backend
+
+    with open("data/00.jpg", "rb") as f:
+        frame = f.read()
+    url = f"/ws/stream?access_token={backend.API_KEY}&confidence_threshold=0.5"
+    with api.websocket_connect(url) as websocket:
+        websocket.send_text('{"confidence_threshold": "high"}')
+        error = websocket.receive_json()
+        assert error["type"] == "error"
+        assert "confidence_threshold" in error["error"]
+        websocket.send_text("[1, 2]")
+        assert websocket.receive_json()["type"] == "error"
+        # The receiver is still running after invalid commands
+        websocket.send_bytes(frame)
+        message = websocket.receive_json()
+        assert message["type"] == "detections"
+        assert len(message["boxes"]) == len(message["track_ids"])
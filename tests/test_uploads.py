@@ -0,0 +1,200 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+from starlette.exceptions import HTTPException
+
+from tests.conftest import requires_model
+from uploads import UploadLimitMiddleware, UploadRejected, check_head, read_upload, sniff_format
+
+
+def _png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class _Upload:
+    """The part of ``UploadFile`` that ``read_upload`` uses."""
+
+    def __init__(self, contents, size=None):
+        self._file = io.BytesIO(contents)
+        self.size = len(contents) if size is None else size
+        self.reads = 0
+
+    async def read(self, size=-1):
+        self.reads += 1
+        return self._file.read(size)
+
+
+def _read(upload, **limits):
+    return asyncio.run(read_upload(upload, **limits))
+
+
+def test_formats_are_sniffed_from_magic_numbers():
+    assert sniff_format(_png(1, 1)) == "png"
+    assert sniff_format(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "webp"
+    assert sniff_format(b"%PDF-1.4") is None
+
+
+def test_valid_upload_is_read_completely():
+    contents = _png(64, 48)
+    assert _read(_Upload(contents), max_bytes=10 ** 6, max_pixels=64 * 48) == contents
+
+
+def test_declared_size_over_the_limit_is_rejected_before_reading():
+    upload = _Upload(_png(8, 8), size=10 ** 9)
+    with pytest.raises(UploadRejected) as info:
+        _read(upload, max_bytes=10 ** 6)
+    assert (info.value.status_code, info.value.reason) == (413, "bytes")
+    assert upload.reads == 0
+
+
+def test_bytes_over_the_limit_are_rejected_while_reading():
+    # An unknown size can't be checked upfront
+    with pytest.raises(UploadRejected) as info:
+        _read(_Upload(_png(256, 256) + b"\0" * 10 ** 5, size=None), max_bytes=1000)
+    assert info.value.status_code == 413
+
+
+def test_unsupported_and_empty_files_are_rejected():
+    with pytest.raises(UploadRejected) as info:
+        _read(_Upload(b"%PDF-1.4 not an image"))
+    assert (info.value.status_code, info.value.reason) == (415, "format")
+    with pytest.raises(UploadRejected) as info:
+        _read(_Upload(b""))
+    assert (info.value.status_code, info.value.reason) == (400, "empty")
+
+
+def test_pixel_limit_is_checked_from_the_header():
+    head = _png(4000, 3000)[:64]
+    with pytest.raises(UploadRejected) as info:
+        check_head(head, max_pixels=10 ** 6)
+    assert (info.value.status_code, info.value.reason) == (413, "pixels")
+    assert check_head(head, max_pixels=12 * 10 ** 6)
+    # Too short to tell the format yet
+    assert not check_head(head[:4])
+
+
+def _multipart_app():
+    async def app(scope, receive, send):
+        while (await receive()).get("more_body"):
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+    return app
+
+
+def _scope(length, client=("10.0.0.1", 1234), headers=()):
+    return {
+        "type": "http",
+        "path": "/predict",
+        "client": client,
+        "headers": [
+            (b"content-type", b"multipart/form-data; boundary=x"),
+            (b"content-length", str(length).encode()),
+            *headers,
+        ],
+    }
+
+
+def _call(middleware, scope, chunks):
+    sent = []
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1} for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent[0]["status"]
+
+
+def test_middleware_rejects_a_declared_length_over_the_limit():
+    reasons = []
+    middleware = UploadLimitMiddleware(_multipart_app(), max_bytes=100, on_reject=reasons.append)
+    assert _call(middleware, _scope(1000), [b"x" * 1000]) == 413
+    assert reasons == ["request_bytes"]
+
+
+def test_middleware_cuts_off_bodies_that_exceed_the_limit_while_streaming():
+    middleware = UploadLimitMiddleware(_multipart_app(), path_max_bytes={"/predict": 100})
+    # The declared length understates the body
+    with pytest.raises(HTTPException) as info:
+        _call(middleware, _scope(10), [b"x" * 60, b"x" * 60])
+    assert info.value.status_code == 413
+
+
+def test_middleware_limits_concurrent_uploads_per_client():
+    async def scenario():
+        started = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def slow_app(scope, receive, send):
+            started.set()
+            await finish.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        middleware = UploadLimitMiddleware(slow_app, max_per_client=1, client_header="X-Forwarded-For")
+        statuses = []
+
+        async def request(client, forwarded):
+            async def receive():
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append((forwarded, message["status"]))
+
+            scope = _scope(0, client=client, headers=[(b"x-forwarded-for", forwarded)])
+            await middleware(scope, receive, send)
+
+        first = asyncio.ensure_future(request(("10.0.0.1", 1), b"1.1.1.1"))
+        await started.wait()
+        # Same proxy address, but a different forwarded client, and then the same one again
+        await request(("10.0.0.1", 2), b"1.1.1.1, 10.0.0.1")
+        other = asyncio.ensure_future(request(("10.0.0.1", 3), b"2.2.2.2"))
+        await asyncio.sleep(0)
+        finish.set()
+        await asyncio.gather(first, other)
+        return statuses
+
+    statuses = asyncio.run(scenario())
+    assert (b"1.1.1.1, 10.0.0.1", 429) in statuses
+    assert (b"1.1.1.1", 200) in statuses
+    assert (b"2.2.2.2", 200) in statuses
+
+
+@requires_model
+def test_api_rejects_unsupported_uploads_without_counting_them_as_errors(api):
+    response = api.post("/predict", files={"file": ("notes.pdf", b"%PDF-1.4 not an image", "application/pdf")})
+    assert response.status_code == 415
+    metrics = api.get("/metrics").text
+    assert 'parasite_uploads_rejected_total{reason="format"}' in metrics
+
+
+def _request_errors(api, endpoint):
+    for line in api.get("/metrics").text.splitlines():
+        if line.startswith(f'parasite_request_errors_total{{endpoint="{endpoint}"}}'):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+@requires_model
+@pytest.mark.parametrize("endpoint", ["/predict", "/render"])
+@pytest.mark.parametrize("threshold", ["-0.1", "1.5", "nan"])
+def test_out_of_range_thresholds_are_client_errors(api, endpoint, threshold):
+    errors = _request_errors(api, endpoint.strip("/"))
+    with open("data/00.jpg", "rb") as f:
+        response = api.post(
+            endpoint, params={"confidence_threshold": threshold}, files={"file": ("00.jpg", f, "image/jpeg")}
+        )
+    assert response.status_code == 400
+    assert "confidence_threshold" in response.json()["detail"]
+    assert _request_errors(api, endpoint.strip("/")) == errors
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from worker_pool import PoolNotStarted, WorkerCrashed, WorkerPool
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(workers=1, threads_per_worker=1, task_timeout=5.0)
+    yield pool
+    pool.shutdown()
+
+
+def test_submit_never_starts_the_pool(pool):
+    with pytest.raises(PoolNotStarted):
+        pool.submit(sum, [1, 2])
+    assert pool.stats()["processes"] == []
+
+
+def test_tasks_run_in_the_workers(pool):
+    pool.start()
+    assert pool.submit(sum, [1, 2, 3]).result(timeout=30) == 6
+    assert pool.submit(divmod, 7, 2).result(timeout=30) == (3, 1)
+
+
+def test_worker_exceptions_are_raised_to_the_caller(pool):
+    pool.start()
+    with pytest.raises(ZeroDivisionError):
+        pool.submit(divmod, 1, 0).result(timeout=30)
+    assert pool.stats()["restarts"] == 0
+
+
+def test_stuck_worker_is_killed_and_restarted_after_the_task_timeout(pool):
+    pool.start()
+    # The first task also waits for the worker to finish starting up
+    assert pool.submit(sum, [1]).result(timeout=30) == 1
+    first_pid = pool.stats()["processes"][0]["pid"]
+    with pytest.raises(WorkerCrashed):
+        pool.submit(time.sleep, 60).result(timeout=30)
+
+    deadline = time.monotonic() + 30
+    while pool.stats()["restarts"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["restarts"] == 1
+    assert stats["crashed_tasks"] == 1
+    assert stats["processes"][0]["pid"] != first_pid
+    # The replacement worker serves new tasks
+    assert pool.submit(sum, [4, 5]).result(timeout=30) == 9
@@ -0,0 +1,133 @@
+"""
+Tiled (sliced) inference for high-resolution microscope images.
+
+The detector is trained at 640x640, so on 4000+ px captures small eggs shrink
+to a few pixels when the whole image is letterboxed. Instead the image is cut
+into overlapping ``tile_size`` windows, each window is detected at native
+resolution, boxes are shifted back to image coordinates, and duplicates along
+tile seams are merged with NMS or weighted box fusion.
+
+Windows are generated lazily and crops are numpy views, so only the tiles in
+flight are ever materialised by the predictor.
+"""
+import numpy as np
+
+from detections import Detections
+
+
+def _starts(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    # Last window is aligned to the edge so every tile is full size
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_windows(width, height, tile_size=640, overlap=0.2):
+    """Yield ``(x0, y0, x1, y1)`` windows covering the image with the given overlap ratio."""
+    if not 0 <= overlap < 1:
+        raise ValueError("overlap must be in [0, 1)")
+    stride = max(1, int(round(tile_size * (1 - overlap))))
+    for y0 in _starts(height, tile_size, stride):
+        for x0 in _starts(width, tile_size, stride):
+            yield x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height)
+
+
+def count_tiles(width, height, tile_size=640, overlap=0.2):
+    stride = max(1, int(round(tile_size * (1 - overlap))))
+    return len(_starts(width, tile_size, stride)) * len(_starts(height, tile_size, stride))
+
+
+def iter_tile_batches(img_array, tile_size=640, overlap=0.2, batch_size=4):
+    """Yield ``(windows, crops)`` batches; crops are views into ``img_array``."""
+    height, width = img_array.shape[:2]
+    windows, crops = [], []
+    for window in tile_windows(width, height, tile_size, overlap):
+        x0, y0, x1, y1 = window
+        windows.append(window)
+        crops.append(img_array[y0:y1, x0:x1])
+        if len(windows) == batch_size:
+            yield windows, crops
+            windows, crops = [], []
+    if windows:
+        yield windows, crops
+
+
+def to_global(detections, window):
+    """Shift tile-local boxes by the window origin."""
+    x0, y0 = window[0], window[1]
+    offset = np.array([x0, y0, x0, y0], dtype=np.float32)
+    return Detections(detections.boxes + offset, detections.confidences, detections.class_ids)
+
+
+def concatenate(detections_list):
+    if not detections_list:
+        return Detections.empty()
+    return Detections(
+        np.concatenate([d.boxes for d in detections_list]),
+        np.concatenate([d.confidences for d in detections_list]),
+        np.concatenate([d.class_ids for d in detections_list]),
+    )
+
+
+def _overlap(box, boxes):
+    """Intersection over the smaller box, which treats a box cut off at a seam as a duplicate."""
+    ix0 = np.maximum(box[0], boxes[:, 0])
+    iy0 = np.maximum(box[1], boxes[:, 1])
+    ix1 = np.minimum(box[2], boxes[:, 2])
+    iy1 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(np.minimum(area, areas), 1e-6)
+
+
+def _clusters(detections, threshold):
+    """Greedy, per-class clustering in descending confidence order."""
+    order = np.argsort(-detections.confidences)
+    remaining = np.ones(len(detections), dtype=bool)
+    for i in order:
+        if not remaining[i]:
+            continue
+        candidates = np.flatnonzero(remaining & (detections.class_ids == detections.class_ids[i]))
+        members = candidates[_overlap(detections.boxes[i], detections.boxes[candidates]) >= threshold]
+        remaining[members] = False
+        yield i, members
+
+
+def nms_keep(detections, threshold=0.6):
+    """Indices kept by ``merge_detections(..., "nms")``, for callers carrying extra per-box data."""
+    return np.array([i for i, _ in _clusters(detections, threshold)], dtype=np.int64)
+
+
+def region_window(box, width, height, size=640):
+    """
+    Window of at least ``size`` pixels (or the box plus a 10% margin, if larger)
+    centred on ``box``, shifted to stay inside a ``width`` x ``height`` image.
+    """
+    x0, y0, x1, y1 = box
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    window_w = min(width, max(size, (x1 - x0) * 1.1))
+    window_h = min(height, max(size, (y1 - y0) * 1.1))
+    left = int(round(min(max(cx - window_w / 2, 0), width - window_w)))
+    top = int(round(min(max(cy - window_h / 2, 0), height - window_h)))
+    return left, top, min(width, left + int(round(window_w))), min(height, top + int(round(window_h)))
+
+
+def merge_detections(detections, method="nms", threshold=0.6):
+    """Merge duplicate detections from overlapping tiles with ``nms`` or ``wbf``."""
+    if len(detections) == 0:
+        return detections
+    if method == "nms":
+        return detections.select(nms_keep(detections, threshold))
+    if method == "wbf":
+        boxes, confidences, class_ids = [], [], []
+        for i, members in _clusters(detections, threshold):
+            weights = detections.confidences[members]
+            boxes.append((detections.boxes[members] * weights[:, None]).sum(0) / weights.sum())
+            confidences.append(weights.mean())
+            class_ids.append(detections.class_ids[i])
+        merged = Detections(np.array(boxes), np.array(confidences), np.array(class_ids))
+        return merged.select(np.argsort(-merged.confidences))
+    raise ValueError(f"Unknown merge method: {method!r}")
@@ -0,0 +1,64 @@
+"""
+Per-request stage timing.
+
+Endpoints time their stages (decode, inference, plot, encode, ...) with a
+``StageTimer`` and report them in a ``Server-Timing`` response header, which
+browsers' dev tools and the benchmark harness understand.
+
+A timer can be activated for the current request context, so helpers that
+don't take a timer argument (executor queue wait, batch wait, serialisation)
+can still ``record`` into it.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_active_timer = ContextVar("active_stage_timer", default=None)
+
+
+class StageTimer:
+    """Accumulates wall-clock seconds per named stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def activate(self):
+        """Make this the timer ``record`` adds to in the current context."""
+        _active_timer.set(self)
+        return self
+
+    def header(self):
+        """``Server-Timing`` header value, durations in milliseconds."""
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items())
+
+
+def record(name, seconds):
+    """Add to the active request's timer, if any."""
+    timer = _active_timer.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+def parse_server_timing(value):
+    """Parse a ``Server-Timing`` header into ``{stage: milliseconds}``."""
+    stages = {}
+    for entry in (value or "").split(","):
+        parts = [p.strip() for p in entry.split(";")]
+        if not parts[0]:
+            continue
+        for part in parts[1:]:
+            if part.startswith("dur="):
+                stages[parts[0]] = float(part[4:])
+    return stages
@@ -0,0 +1,119 @@
+"""
+Frame-to-frame tracking of detections for live slide scanning.
+
+A deliberately simple IoU tracker. Detections in a new frame are matched
+greedily to existing tracks, taking the highest IoU first. Unmatched detections
+start new tracks. Tracks that go unmatched for more than ``max_missed``
+frames are dropped. A track is confirmed, and so counted, once it has been
+matched in ``min_hits`` frames, so single-frame false positives are never
+counted and an egg that stays in view is counted exactly once.
+
+The class of a track is decided by confidence-weighted votes over its
+frames, so one misclassified frame doesn't flip it.
+"""
+import itertools
+from collections import Counter
+
+import numpy as np
+
+
+def iou_matrix(a, b):
+    """Pairwise IoU of ``xyxy`` boxes ``a`` (N, 4) and ``b`` (M, 4)."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+class Track:
+    __slots__ = ("id", "box", "votes", "best_confidence", "hits", "missed", "confirmed")
+
+    def __init__(self, track_id, box, class_id, confidence):
+        self.id = track_id
+        self.box = box
+        self.votes = Counter({int(class_id): float(confidence)})
+        self.best_confidence = float(confidence)
+        self.hits = 1
+        self.missed = 0
+        self.confirmed = False
+
+    @property
+    def class_id(self):
+        return self.votes.most_common(1)[0][0]
+
+    def update(self, box, class_id, confidence):
+        self.box = box
+        self.votes[int(class_id)] += float(confidence)
+        self.best_confidence = max(self.best_confidence, float(confidence))
+        self.hits += 1
+        self.missed = 0
+
+
+class IoUTracker:
+    """Greedy IoU tracker with confirmation after ``min_hits`` frames."""
+
+    def __init__(self, iou_threshold=0.3, max_missed=10, min_hits=3):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def reset(self):
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def _match(self, boxes):
+        """``(track_index, detection_index)`` pairs, highest IoU first."""
+        track_boxes = np.array([t.box for t in self.tracks], dtype=np.float32).reshape(-1, 4)
+        iou = iou_matrix(track_boxes, boxes)
+        candidates = np.argwhere(iou >= self.iou_threshold)
+        order = np.argsort(-iou[candidates[:, 0], candidates[:, 1]], kind="stable")
+        used_tracks, used_detections, pairs = set(), set(), []
+        for t, d in candidates[order].tolist():
+            if t not in used_tracks and d not in used_detections:
+                used_tracks.add(t)
+                used_detections.add(d)
+                pairs.append((t, d))
+        return pairs
+
+    def update(self, detections):
+        """
+        Advance by one frame.
+
+        Returns ``(track_ids, confirmed)``: the track id of every detection, in
+        detection order, and the tracks confirmed by this frame (each track is
+        reported there exactly once).
+        """
+        boxes = detections.boxes
+        track_ids = np.zeros(len(detections), dtype=np.int64)
+        matched = set()
+        for t, d in self._match(boxes):
+            track = self.tracks[t]
+            track.update(boxes[d].copy(), detections.class_ids[d], detections.confidences[d])
+            track_ids[d] = track.id
+            matched.add(t)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        for d in np.flatnonzero(track_ids == 0).tolist():
+            track = Track(next(self._ids), boxes[d].copy(), detections.class_ids[d], detections.confidences[d])
+            self.tracks.append(track)
+            track_ids[d] = track.id
+
+        confirmed = []
+        for track in self.tracks:
+            if not track.confirmed and track.hits >= self.min_hits:
+                track.confirmed = True
+                confirmed.append(track)
+        return track_ids, confirmed
@@ -0,0 +1,216 @@
+"""
+Bounded, validated reading of uploaded images.
+
+Starlette spools multipart file parts to a temporary file, so by the time an
+endpoint runs the upload sits on disk, not in memory. ``read_upload`` reads it
+from there in chunks instead of with one ``file.read()``, and rejects it as
+early as possible:
+
+- the declared size, and then the bytes actually read, against ``max_bytes``;
+- the first bytes against the magic numbers of the supported image formats;
+- the width and height in the header against ``max_pixels``, as soon as the
+  header has arrived, so a decompression bomb costs a few kilobytes of
+  reading instead of a full read and decode.
+
+``UploadLimitMiddleware`` bounds what reaches the spool in the first place. It
+cuts off request bodies above a per-path byte limit while they stream in, and
+allows each client only ``max_per_client`` upload requests at once, so a few
+clients sending huge slides can't take all the memory.
+"""
+import io
+import threading
+import warnings
+from collections import Counter
+
+from PIL import Image
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+
+# Read in small steps until the header has been checked, then in large ones
+HEADER_CHUNK_SIZE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+# Past this, give up on the early header check and let the decoder judge the file
+HEADER_MAX_BYTES = 1024 * 1024
+
+MAGIC_NUMBERS = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+
+class UploadRejected(Exception):
+    """Raised when an upload fails validation; carries the HTTP status and a metric label."""
+
+    def __init__(self, status_code, reason, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+
+
+def sniff_format(head):
+    """Image format from the first bytes of a file, or None if unsupported."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for magic, image_format in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return image_format
+    return None
+
+
+def _header_size(head):
+    """``(width, height)`` from the header in ``head``, or None while it is incomplete."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        try:
+            with Image.open(io.BytesIO(head)) as image:
+                return image.size
+        except Image.DecompressionBombError as e:
+            raise UploadRejected(413, "pixels", f"Image too large: {str(e)}")
+        except Exception:
+            return None
+
+
+def _too_many_bytes(max_bytes):
+    return UploadRejected(413, "bytes", f"Upload is larger than {max_bytes} bytes")
+
+
+def check_head(head, max_pixels=0, complete=False):
+    """
+    Validate the start of an upload; returns True once the header has been checked.
+
+    ``complete`` means ``head`` is the whole file, so a header that still
+    can't be parsed is left for the decoder to report.
+    """
+    if not complete and len(head) < 12:
+        return False
+    if sniff_format(head) is None:
+        raise UploadRejected(415, "format", "Unsupported file type, upload a JPEG, PNG, BMP, TIFF or WebP image")
+    size = _header_size(head)
+    if size is None:
+        return complete or len(head) >= HEADER_MAX_BYTES
+    width, height = size
+    if max_pixels and width * height > max_pixels:
+        raise UploadRejected(
+            413, "pixels", f"Image too large: {width}x{height} pixels, the limit is {max_pixels} pixels"
+        )
+    return True
+
+
+async def read_upload(file, max_bytes=0, max_pixels=0):
+    """Read an ``UploadFile`` in chunks, validating it on the way; raises ``UploadRejected``."""
+    if max_bytes and file.size is not None and file.size > max_bytes:
+        raise _too_many_bytes(max_bytes)
+    head = bytearray()
+    while True:
+        chunk = await file.read(HEADER_CHUNK_SIZE)
+        head += chunk
+        if max_bytes and len(head) > max_bytes:
+            raise _too_many_bytes(max_bytes)
+        if not chunk:
+            if not head:
+                raise UploadRejected(400, "empty", "The uploaded file is empty")
+            check_head(head, max_pixels, complete=True)
+            return bytes(head)
+        if check_head(head, max_pixels):
+            break
+    chunks = [bytes(head)]
+    size = len(head)
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            raise _too_many_bytes(max_bytes)
+        chunks.append(chunk)
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware limiting multipart request bodies by size and by client concurrency.
+
+    ``max_bytes`` applies to every multipart request unless ``path_max_bytes``
+    has an entry for its path. Clients are told apart by ``client_header``
+    (e.g. ``X-Forwarded-For`` behind a proxy) or else by their address.
+    ``on_reject`` is called with the rejection reason.
+    """
+
+    def __init__(self, app, max_bytes=0, path_max_bytes=None, max_per_client=0, client_header="", on_reject=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_max_bytes = dict(path_max_bytes or {})
+        self.max_per_client = max_per_client
+        self.client_header = client_header.lower().encode("latin-1")
+        self.on_reject = on_reject
+        self._lock = threading.Lock()
+        self._active = Counter()
+
+    def _client(self, scope, headers):
+        if self.client_header and self.client_header in headers:
+            # The first address of a forwarding chain is the original client
+            return headers[self.client_header].decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def _reject(self, reason):
+        if self.on_reject is not None:
+            self.on_reject(reason)
+
+    def _acquire(self, client):
+        with self._lock:
+            if self.max_per_client and self._active[client] >= self.max_per_client:
+                return False
+            self._active[client] += 1
+            return True
+
+    def _release(self, client):
+        with self._lock:
+            self._active[client] -= 1
+            if self._active[client] <= 0:
+                del self._active[client]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").lower().startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        max_bytes = self.path_max_bytes.get(scope["path"], self.max_bytes)
+        length = headers.get(b"content-length")
+        if max_bytes and length is not None and length.isdigit() and int(length) > max_bytes:
+            self._reject("request_bytes")
+            response = JSONResponse({"detail": f"Request body is larger than {max_bytes} bytes"}, status_code=413)
+            return await response(scope, receive, send)
+
+        client = self._client(scope, headers)
+        if not self._acquire(client):
+            self._reject("client_concurrency")
+            response = JSONResponse(
+                {"detail": f"Too many concurrent uploads from this client ({self.max_per_client} in flight)"},
+                status_code=429,
+                headers={"Retry-After": "1"},
+            )
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if max_bytes and received > max_bytes:
+                    # Raised inside body parsing, which re-raises HTTPExceptions as they are
+                    self._reject("request_bytes")
+                    raise HTTPException(status_code=413, detail=f"Request body is larger than {max_bytes} bytes")
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send)
+        finally:
+            self._release(client)
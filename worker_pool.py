@@ -0,0 +1,373 @@
+"""
+Supervised pool of forked inference worker processes.
+
+The front process (uvicorn) handles HTTP and hands CPU-bound stages to a fixed
+set of worker processes:
+
+- Workers are forked after the model has been loaded and warmed up, so the
+  weights are shared copy-on-write rather than loaded once per worker.
+- Arguments and results are pickled with protocol 5; large buffers (decoded
+  image arrays) travel out-of-band through one ``multiprocessing.shared_memory``
+  segment per message, so the pipe only carries a few hundred bytes of
+  metadata. Workers read their inputs in place, without a copy.
+- Each task goes to the worker with the fewest outstanding tasks.
+- A reader thread per worker notices when a worker dies and restarts it; the
+  tasks it held fail with ``WorkerCrashed``. A monitor thread kills workers
+  whose current task runs longer than ``task_timeout``.
+
+``submit`` has the ``concurrent.futures`` signature, so the pool is a drop-in
+replacement for a ``ProcessPoolExecutor`` inside ``InferenceExecutor``.
+"""
+import itertools
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import resource_tracker, shared_memory
+
+
+# Smaller buffers are cheaper to send inline than through a shared memory segment
+SHM_MIN_BYTES = 64 * 1024
+
+
+class WorkerCrashed(Exception):
+    """Raised for tasks that were running or queued on a worker that died."""
+
+
+class PoolNotStarted(RuntimeError):
+    """Raised by ``submit`` before ``start`` has forked the workers."""
+
+
+class _RemoteError(Exception):
+    """Stands in for a worker exception that can't be pickled."""
+
+
+# -- serialisation --------------------------------------------------------
+
+
+def _dumps(obj):
+    """Pickle ``obj``; returns ``(data, shm, layout)`` with large buffers placed in ``shm``."""
+    buffers = []
+
+    def keep_inline(buffer):
+        if buffer.raw().nbytes < SHM_MIN_BYTES:
+            return True
+        buffers.append(buffer)
+        return False
+
+    data = pickle.dumps(obj, protocol=5, buffer_callback=keep_inline)
+    if not buffers:
+        return data, None, []
+    raws = [buffer.raw() for buffer in buffers]
+    shm = shared_memory.SharedMemory(create=True, size=sum(raw.nbytes for raw in raws))
+    layout, offset = [], 0
+    for raw in raws:
+        shm.buf[offset:offset + raw.nbytes] = raw
+        layout.append((offset, raw.nbytes))
+        offset += raw.nbytes
+    return data, shm, layout
+
+
+def _loads(data, shm, layout, copy):
+    """Inverse of ``_dumps``; ``copy=False`` leaves arrays backed by ``shm``."""
+    if shm is None:
+        return pickle.loads(data)
+    views = [shm.buf[offset:offset + size] for offset, size in layout]
+    buffers = [bytearray(view) for view in views] if copy else views
+    if copy:
+        for view in views:
+            view.release()
+    return pickle.loads(data, buffers=buffers)
+
+
+def _attach(name):
+    return shared_memory.SharedMemory(name=name) if name else None
+
+
+def _close(shm, unlink=False):
+    """Close (and unlink) a segment; returns False if arrays still reference it."""
+    if shm is None:
+        return True
+    try:
+        shm.close()
+        closed = True
+    except BufferError:
+        closed = False
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    return closed
+
+
+# -- worker side ------------------------------------------------------------
+
+# Argument segments still referenced after their task (the predictor keeps its
+# last batch); retried after every task and otherwise dropped with the process
+_still_mapped = []
+
+
+def _worker_main(conn, threads):
+    # Ctrl-C is handled by the front process, which then shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if threads:
+        try:
+            import torch
+
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        task_id, data, shm_name, layout = message
+        shm = _attach(shm_name)
+        try:
+            fn, args, kwargs = _loads(data, shm, layout, copy=False)
+            ok, result = True, fn(*args, **kwargs)
+        except BaseException as e:
+            ok, result = False, e
+        fn = args = kwargs = None
+        try:
+            reply = _dumps(result)
+        except Exception as e:
+            ok, reply = False, _dumps(_RemoteError(f"{type(result).__name__}: {result!r} ({e})"))
+        result = None
+        _still_mapped[:] = [s for s in _still_mapped + [shm] if not _close(s)]
+        data, result_shm, result_layout = reply
+        conn.send((task_id, ok, data, result_shm.name if result_shm else None, result_layout))
+        # The front process unlinks the segment once it has read it
+        _close(result_shm)
+
+
+# -- front side ---------------------------------------------------------------
+
+
+class _Task:
+    __slots__ = ("id", "future", "shm")
+
+    def __init__(self, task_id, future, shm):
+        self.id = task_id
+        self.future = future
+        self.shm = shm
+
+
+class _Worker:
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        # Tasks in the order the worker runs them; the first one is running
+        self.tasks = deque()
+        self.head_started = None
+        self.completed = 0
+        self.started_at = time.time()
+
+
+def _memory_kb(pid):
+    """Resident and shared memory of a process in kB (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line and not line.startswith(" "))
+    except OSError:
+        return None
+    kb = lambda name: int(fields.get(name, "0 kB").split()[0])
+    return {
+        "rss": kb("Rss"),
+        "pss": kb("Pss"),
+        "shared": kb("Shared_Clean") + kb("Shared_Dirty"),
+    }
+
+
+class WorkerPool:
+    """Forked worker processes with shared-memory hand-off, supervision and least-loaded dispatch."""
+
+    def __init__(self, workers=2, threads_per_worker=0, task_timeout=0.0):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.task_timeout = task_timeout
+        self._ctx = multiprocessing.get_context("fork")
+        self._lock = threading.Lock()
+        self._workers = []
+        self._ids = itertools.count()
+        self._restarts = 0
+        self._crashed_tasks = 0
+        self._timeouts = 0
+        self._started = False
+        self._closed = False
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self):
+        """Fork the workers; call once the model is loaded so its pages are shared."""
+        with self._lock:
+            if self._started or self._closed:
+                return
+            self._started = True
+            # Forked workers then share one tracker, which only cleans up segments nobody unlinked
+            resource_tracker.ensure_running()
+            for index in range(self.workers):
+                self._workers.append(self._spawn(index))
+        if self.task_timeout > 0:
+            threading.Thread(target=self._monitor, name="worker-pool-monitor", daemon=True).start()
+
+    def _spawn(self, index):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.threads_per_worker),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(index, process, parent_conn)
+        threading.Thread(target=self._read, args=(worker,), name=f"worker-reader-{index}", daemon=True).start()
+        return worker
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in workers:
+            worker.process.join(timeout=5 if wait else 0.1)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(timeout=1)
+            self._fail_tasks(worker, "Worker pool shut down")
+
+    # -- dispatch ----------------------------------------------------------
+
+    def submit(self, fn, *args, **kwargs):
+        # Forking here could happen mid warm-up, while the model lock is held,
+        # and the children would inherit that lock held forever
+        if not self._started:
+            raise PoolNotStarted("Inference workers have not been started yet")
+        future = Future()
+        data, shm, layout = _dumps((fn, args, kwargs))
+        task = _Task(next(self._ids), future, shm)
+        with self._lock:
+            if self._closed:
+                _close(shm, unlink=True)
+                raise RuntimeError("Worker pool is shut down")
+            # Least loaded worker; ties go to the lowest index
+            worker = min(self._workers, key=lambda w: len(w.tasks))
+            if not worker.tasks:
+                worker.head_started = time.monotonic()
+            worker.tasks.append(task)
+        future.set_running_or_notify_cancel()
+        try:
+            with worker.send_lock:
+                worker.conn.send((task.id, data, shm.name if shm else None, layout))
+        except OSError:
+            # The reader thread restarts the worker and fails its tasks, including this one
+            pass
+        return future
+
+    # -- supervision ---------------------------------------------------------
+
+    def _read(self, worker):
+        while True:
+            try:
+                task_id, ok, data, shm_name, layout = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                task = worker.tasks.popleft() if worker.tasks and worker.tasks[0].id == task_id else None
+                worker.head_started = time.monotonic()
+                worker.completed += 1
+            shm = _attach(shm_name)
+            try:
+                result = _loads(data, shm, layout, copy=True)
+            except Exception as e:
+                ok, result = False, e
+            finally:
+                _close(shm, unlink=True)
+            if task is None:
+                continue
+            _close(task.shm, unlink=True)
+            if not task.future.done():
+                if ok:
+                    task.future.set_result(result)
+                else:
+                    task.future.set_exception(result)
+        self._on_exit(worker)
+
+    def _on_exit(self, worker):
+        worker.process.join(timeout=5)
+        with self._lock:
+            # Swap in the replacement first so no new task can land on the dead worker
+            if not self._closed:
+                self._restarts += 1
+                self._workers[self._workers.index(worker)] = self._spawn(worker.index)
+        crashed = self._fail_tasks(worker, f"Inference worker exited with code {worker.process.exitcode}")
+        with self._lock:
+            self._crashed_tasks += crashed
+
+    def _fail_tasks(self, worker, reason):
+        with self._lock:
+            tasks = list(worker.tasks)
+            worker.tasks.clear()
+        for task in tasks:
+            _close(task.shm, unlink=True)
+            if not task.future.done():
+                task.future.set_exception(WorkerCrashed(reason))
+        return len(tasks)
+
+    def _monitor(self):
+        while not self._closed:
+            time.sleep(1.0)
+            now = time.monotonic()
+            with self._lock:
+                stuck = [
+                    w for w in self._workers
+                    if w.tasks and w.head_started is not None and now - w.head_started > self.task_timeout
+                ]
+            for worker in stuck:
+                # The reader thread sees the pipe close and restarts the worker
+                self._timeouts += 1
+                worker.process.kill()
+
+    def stats(self):
+        with self._lock:
+            workers = list(self._workers)
+            totals = {
+                "restarts": self._restarts,
+                "crashed_tasks": self._crashed_tasks,
+                "timeouts": self._timeouts,
+            }
+        return {
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            **totals,
+            "processes": [
+                {
+                    "index": w.index,
+                    "pid": w.process.pid,
+                    "alive": w.process.is_alive(),
+                    "outstanding": len(w.tasks),
+                    "completed": w.completed,
+                    "uptime": round(time.time() - w.started_at, 1),
+                    "memory_kb": _memory_kb(w.process.pid),
+                }
+                for w in workers
+            ],
+        }